@@ -1,5 +1,5 @@
 import atexit
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, g
 from pydantic import ValidationError
 from werkzeug.exceptions import HTTPException
 from .routes.patients import patients_bp
@@ -14,20 +14,31 @@ from .routes.coordinates import coordinates_bp
 from .routes.parents import parents_bp
 from .routes.mfa import mfa_bp
 from .config import Config
-from flask_bcrypt import Bcrypt
 from .db import Database
+from .query_log import start_query_log, stop_query_log, current_query_log
+from .json_provider import JSON_PROVIDERS
+from .cache import create_patient_cache
+from .revocation import create_revocation_cache
+from .maintenance import create_maintenance_scheduler
+from .hashing import create_password_hasher
 from .models import ErrorResponse
 import os
 from dotenv import load_dotenv
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager
+from flask_jwt_extended import JWTManager, get_jwt_identity
 import datetime
-from .services.token_service import is_token_blacklisted
+from .services.token_service import is_token_blacklisted, is_token_generation_revoked
 
 
 def create_app(config_file: str = "config.toml", use_test_db: bool = False):
     app = Flask(__name__)
 
+    json_provider = os.getenv("INF6150_JSON_PROVIDER", "fast")
+    if json_provider not in JSON_PROVIDERS:
+        raise ValueError(
+            f"Unknown JSON provider '{json_provider}'. Known providers: {', '.join(JSON_PROVIDERS)}.")
+    app.json = JSON_PROVIDERS[json_provider](app)
+
     CORS(app, resources={
         r"/api/*": {
             "origins": "*",
@@ -43,11 +54,12 @@ def create_app(config_file: str = "config.toml", use_test_db: bool = False):
             res.headers['X-Content-Type-Options'] = '*'
             return res
 
-    bcrypt = Bcrypt(app)
-    app.config['BCRYPT'] = bcrypt
-
     load_dotenv()
 
+    password_hasher = create_password_hasher(app.logger)
+    app.config['PASSWORD_HASHER'] = password_hasher
+    atexit.register(password_hasher.close)
+
     if use_test_db:
         user = os.getenv("INF6150_TEST_DATABASE_USER")
         password = os.getenv("INF6150_TEST_DATABASE_PASSWORD")
@@ -102,7 +114,9 @@ def create_app(config_file: str = "config.toml", use_test_db: bool = False):
     @jwt.token_in_blocklist_loader
     def check_if_token_is_revoked(jwt_header, jwt_payload):
         jti = jwt_payload["jti"]
-        return is_token_blacklisted(jti)
+        # Tokens issued before generations existed count as generation 0.
+        return is_token_blacklisted(jti) or is_token_generation_revoked(
+            jwt_payload["sub"], jwt_payload.get("gen", 0))
 
     # Optional: Handle expired or invalid tokens
     @jwt.expired_token_loader
@@ -140,6 +154,62 @@ def create_app(config_file: str = "config.toml", use_test_db: bool = False):
     db_instance = Database(user, password, host, port, database)
     app.config['DATABASE'] = db_instance
 
+    def current_session_key():
+        try:
+            return get_jwt_identity()
+        except RuntimeError:
+            return None
+
+    db_instance.session_key_provider = current_session_key
+
+    app.config['PATIENT_CACHE'] = create_patient_cache(app)
+    app.config['REVOCATION_CACHE'] = create_revocation_cache(db_instance)
+    app.config['MAINTENANCE'] = create_maintenance_scheduler(db_instance, app.logger)
+
+    @app.before_request
+    def start_maintenance():
+        app.config['MAINTENANCE'].ensure_running()
+
+    # Query count and time of each request, sent back as X-Query-Count and
+    # X-Query-Time headers so that tests and benchmarks can check budgets.
+    app.config['QUERY_LOG_HEADERS'] = app.config.get('TESTING', False) or os.getenv(
+        "INF6150_QUERY_LOG_HEADERS", 'False').lower() in ('true', '1', 't')
+    query_count_warning = int(os.getenv("INF6150_QUERY_COUNT_WARNING", "0"))
+
+    @app.before_request
+    def start_request_query_log():
+        g.query_log_token = start_query_log()
+
+    @app.after_request
+    def report_request_queries(response):
+        query_log = current_query_log()
+        if query_log is None or 'query_log_token' not in g:
+            return response
+        if app.config['QUERY_LOG_HEADERS']:
+            response.headers['X-Query-Count'] = str(query_log.count)
+            response.headers['X-Query-Time'] = f"{query_log.total_time * 1000:.3f}"
+        if query_count_warning and query_log.count > query_count_warning:
+            app.logger.warning(
+                "%s %s issued %d queries (%.1f ms): %s",
+                request.method, request.path, query_log.count,
+                query_log.total_time * 1000,
+                "; ".join(query["statement"][:120] for query in query_log.queries))
+        return response
+
+    @app.teardown_request
+    def stop_request_query_log(error=None):
+        token = g.pop('query_log_token', None)
+        if token is not None:
+            stop_query_log(token)
+
+    @app.after_request
+    def pin_writer_to_primary(response):
+        # Read-your-writes: once a user changed something, their next reads
+        # are served by the primary instead of a possibly lagging replica.
+        if request.method in ("POST", "PUT", "DELETE") and response.status_code < 400:
+            db_instance.mark_write()
+        return response
+
     app.register_blueprint(patients_bp, url_prefix='/api/patients')
     app.register_blueprint(users_bp, url_prefix='/api/users')
     app.register_blueprint(
@@ -181,7 +251,19 @@ def create_app(config_file: str = "config.toml", use_test_db: bool = False):
                 with conn.cursor() as cur:
                     cur.execute("SELECT 1")
                     cur.fetchone()
-            return jsonify({"status": "healthy", "database": "connected"}), 200
+            health = {
+                "status": "healthy",
+                "database": "connected",
+                "pool": db_instance.pool_stats()
+            }
+            if db_instance.replica_pools:
+                health["replicas"] = db_instance.replica_pool_stats()
+            health["patient_cache"] = app.config['PATIENT_CACHE'].stats()
+            if app.config['REVOCATION_CACHE'] is not None:
+                health["revocation_cache"] = app.config['REVOCATION_CACHE'].stats()
+            health["maintenance"] = app.config['MAINTENANCE'].stats()
+            health["password_hasher"] = password_hasher.stats()
+            return jsonify(health), 200
         except Exception as e:
             app.logger.error(f"Health check failed: {str(e)}")
             return jsonify({"status": "unhealthy", "error": str(e)}), 500
@@ -0,0 +1,42 @@
+import os
+import threading
+from typing import Callable, Optional
+
+
+class ProcessLocalThread:
+    """
+    Daemon thread started on first use in each process.
+
+    Threads don't survive a fork: a worker forked from a process whose
+    thread was already running starts its own the first time it calls
+    `ensure_started`.
+
+    Args:
+        target: Body of the thread.
+        name: Name of the thread.
+        on_start: Called in the starting process just before the thread
+            starts, e.g. to forget state inherited from the parent.
+    """
+
+    def __init__(self, target: Callable, name: str, on_start: Optional[Callable] = None):
+        self.target = target
+        self.name = name
+        self.on_start = on_start
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the thread was started in this process."""
+        return self._pid == os.getpid()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if self.on_start is not None:
+                self.on_start()
+            threading.Thread(target=self.target, name=self.name, daemon=True).start()
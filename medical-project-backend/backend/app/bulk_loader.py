@@ -0,0 +1,304 @@
+import io
+import json
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+from .hashing import bcrypt_rounds, hash_password, hashing_context
+
+# Columns loaded for each table. The first column is the entity id: it is
+# generated when a record doesn't carry one so that every version row of
+# the same entity can be told apart from the start.
+TABLE_COLUMNS = {
+    "establishments": ["establishment_id", "establishment_name"],
+    "users": [
+        "user_id", "medical_insurance_id", "login", "password_hash",
+        "user_type", "first_name", "last_name", "phone_number", "email",
+        "gender", "city_of_birth", "date_of_birth"
+    ],
+    "coordinates": [
+        "coordinate_id", "user_id", "street_address", "apartment",
+        "postal_code", "city", "country"
+    ],
+    "medical_history": [
+        "history_id", "patient_id", "diagnostic", "treatment", "doctor_id",
+        "start_date", "end_date"
+    ],
+    "medical_visits": [
+        "visit_id", "patient_id", "establishment_id", "doctor_id",
+        "visit_date", "diagnostic_established", "treatment", "visit_summary",
+        "notes"
+    ],
+    "parents": ["parent_id", "child_id"],
+}
+
+REQUIRED_FIELDS = {
+    "establishments": ["establishment_name"],
+    "users": [
+        "login", "user_type", "first_name", "last_name", "phone_number",
+        "email"
+    ],
+    "coordinates": [
+        "user_id", "street_address", "postal_code", "city", "country"
+    ],
+    "medical_history": ["patient_id", "diagnostic", "treatment", "doctor_id"],
+    "medical_visits": [
+        "patient_id", "establishment_id", "doctor_id", "visit_date",
+        "visit_summary"
+    ],
+    "parents": ["parent_id", "child_id"],
+}
+
+# Loaded from the records, so that exports and generated datasets keep their
+# history. COPY sends the same columns for every row: records without them
+# (e.g. hand-written files) get the time of the load, as the column defaults
+# would give them.
+TIMESTAMP_COLUMNS = {
+    "establishments": ["created_at"],
+    "users": ["created_at", "modified_at"],
+    "coordinates": ["created_at", "modified_at"],
+    "medical_history": ["created_at", "modified_at"],
+    "medical_visits": ["created_at", "modified_at"],
+    "parents": [],
+}
+
+GENERATED_ID_TABLES = {
+    "establishments", "users", "coordinates", "medical_history",
+    "medical_visits"
+}
+
+# parents has a composite primary key and duplicates must be ignored, which
+# COPY can't do: rows go through a staging table first.
+CREATE_PARENTS_STAGING_TABLE = """
+CREATE TEMPORARY TABLE parents_staging (
+    parent_id   UUID NOT NULL,
+    child_id    UUID NOT NULL
+) ON COMMIT DROP;
+"""
+
+MERGE_PARENTS_STAGING_TABLE = """
+INSERT INTO parents (parent_id, child_id)
+SELECT parent_id, child_id FROM parents_staging
+ON CONFLICT (parent_id, child_id) DO NOTHING;
+"""
+
+# Projections filled by triggers as rows are loaded.
+CURRENT_TABLES = {
+    "users": "users_current",
+    "coordinates": "coordinates_current",
+    "medical_history": "medical_history_current",
+    "medical_visits": "medical_visits_current",
+}
+
+COPY_NULL = "\\N"
+
+
+def iter_records(path: str, chunk_size: int = 1 << 16):
+    """
+    Yield the records of a JSON array or NDJSON file one at a time, without
+    loading the whole file in memory.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        first = ""
+        while True:
+            char = f.read(1)
+            if not char or not char.isspace():
+                first = char
+                break
+
+        if first == "[":
+            yield from _iter_json_array(f, chunk_size)
+            return
+
+        if first:
+            f.seek(0)
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(
+                        f"{path}:{line_number}: invalid JSON: {e}") from e
+
+
+def _iter_json_array(f, chunk_size: int):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    expect_value = True
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            if buffer[pos] == ",":
+                expect_value = True
+            pos += 1
+
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+
+        if pos < len(buffer) and expect_value:
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError("Invalid or truncated JSON array.")
+            else:
+                yield record
+                pos = end
+                expect_value = False
+                continue
+        elif pos < len(buffer):
+            raise ValueError(
+                f"Unexpected '{buffer[pos]}' between array elements.")
+
+        if eof:
+            raise ValueError("Unterminated JSON array.")
+
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return COPY_NULL
+    if not isinstance(value, str):
+        value = str(value)
+    return '"' + value.replace('"', '""') + '"'
+
+
+class BulkLoader:
+    """
+    Load JSON or NDJSON records into a table with COPY FROM STDIN.
+
+    Records are streamed from the file and sent in batches, all in a single
+    transaction. User passwords are hashed on all CPU cores; records that
+    already carry a `password_hash` (e.g. exported from another system) are
+    loaded as is.
+
+    Args:
+        db_instance: The Database to load into.
+        batch_size: Number of records sent per COPY.
+        workers: Processes used to hash passwords (the CPU count by default).
+        progress: Called with (table, rows loaded so far) after each batch.
+    """
+
+    def __init__(self, db_instance, batch_size: int = 5000, workers: int = None, progress=None):
+        self.db_instance = db_instance
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.progress = progress
+        self.rounds = bcrypt_rounds()
+
+    def load(self, path: str, table: str = None) -> int:
+        """Load the file into `table` (the file name by default) and return the number of rows."""
+        table = table or Path(path).stem
+        if table not in TABLE_COLUMNS:
+            raise ValueError(f"Unknown table '{table}'.")
+
+        executor = None
+        if table == "users" and self.workers > 1:
+            executor = ProcessPoolExecutor(
+                self.workers, mp_context=hashing_context())
+
+        total = 0
+        try:
+            with self.db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    target = table
+                    if table == "parents":
+                        cur.execute(CREATE_PARENTS_STAGING_TABLE)
+                        target = "parents_staging"
+
+                    columns = TABLE_COLUMNS[table] + TIMESTAMP_COLUMNS[table]
+                    loaded_at = datetime.now(timezone.utc).isoformat()
+                    batch = []
+                    for record in iter_records(path):
+                        batch.append(self._prepare(
+                            table, record, total + len(batch) + 1, loaded_at))
+                        if len(batch) >= self.batch_size:
+                            total += self._copy(cur, table, target, columns, batch, executor)
+                            self._report(table, total)
+                            batch = []
+                    if batch:
+                        total += self._copy(cur, table, target, columns, batch, executor)
+                        self._report(table, total)
+
+                    if table == "parents":
+                        cur.execute(MERGE_PARENTS_STAGING_TABLE)
+                conn.commit()
+
+                # Fresh statistics, so that the planner doesn't keep using
+                # plans made for a nearly empty table.
+                with conn.cursor() as cur:
+                    cur.execute(f"ANALYZE {table};")
+                    if table in CURRENT_TABLES:
+                        cur.execute(f"ANALYZE {CURRENT_TABLES[table]};")
+                conn.commit()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return total
+
+    def _prepare(self, table: str, record: dict, number: int, loaded_at: str) -> dict:
+        if not isinstance(record, dict):
+            raise ValueError(f"Record {number} of '{table}' is not an object.")
+
+        missing = [field for field in REQUIRED_FIELDS[table]
+                   if record.get(field) is None]
+        if table == "users" and record.get("password") is None \
+                and record.get("password_hash") is None:
+            missing.append("password")
+        if missing:
+            raise ValueError(
+                f"Record {number} of '{table}' is missing {', '.join(missing)}.")
+
+        id_column = TABLE_COLUMNS[table][0]
+        if table in GENERATED_ID_TABLES and record.get(id_column) is None:
+            record = {**record, id_column: str(uuid.uuid4())}
+        missing_timestamps = {column: loaded_at for column in TIMESTAMP_COLUMNS[table]
+                              if record.get(column) is None}
+        if missing_timestamps:
+            record = {**record, **missing_timestamps}
+        return record
+
+    def _copy(self, cur, table: str, target: str, columns: list[str], records: list[dict], executor) -> int:
+        if table == "users":
+            self._hash_passwords(records, executor)
+
+        buffer = io.StringIO()
+        for record in records:
+            buffer.write(",".join(_copy_value(record.get(column))
+                                  for column in columns))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        cur.copy_expert(
+            f"COPY {target} ({', '.join(columns)}) FROM STDIN "
+            f"WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer
+        )
+        return len(records)
+
+    def _report(self, table: str, total: int):
+        if self.progress:
+            self.progress(table, total)
+
+    def _hash_passwords(self, records: list[dict], executor):
+        pending = [record for record in records
+                   if record.get("password_hash") is None]
+        passwords = [record["password"] for record in pending]
+        hash_with_cost = partial(hash_password, rounds=self.rounds)
+        if executor is None:
+            hashes = map(hash_with_cost, passwords)
+        else:
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            hashes = executor.map(hash_with_cost, passwords, chunksize=chunksize)
+        for record, password_hash in zip(pending, hashes):
+            record["password_hash"] = password_hash
@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
+from flask import current_app
+
+# Every patient whose chart shows the user: the user's own chart, their
+# children's and those with a visit or medical history by them.
+CHARTS_OF_USER_QUERY = """
+    SELECT medical_insurance_id FROM users_current
+    WHERE user_id = %(user_id)s AND medical_insurance_id IS NOT NULL
+    UNION
+    SELECT c.medical_insurance_id
+    FROM parents p
+    JOIN users_current c ON c.user_id = p.child_id
+    WHERE p.parent_id = %(user_id)s AND c.medical_insurance_id IS NOT NULL
+    UNION
+    SELECT patient_id FROM medical_visits_current WHERE doctor_id = %(user_id)s
+    UNION
+    SELECT patient_id FROM medical_history_current WHERE doctor_id = %(user_id)s;
+"""
+
+
+class MemoryCache:
+    """
+    Thread-safe in-process LRU cache of patient documents.
+
+    Entries are stored with the version of their key read before the
+    document was built, and `put` drops documents whose key was invalidated
+    in the meantime: a read racing with a write can't cache what the write
+    replaced. Cached values are shared between requests and must not be
+    modified.
+
+    Args:
+        max_entries: Documents kept before the least recently used ones are
+            evicted. 0 disables the cache.
+        ttl: Seconds after which an entry expires, bounding how stale it
+            gets when the database is changed behind the application's
+            back. 0 keeps entries until evicted or invalidated.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._generation = 0
+        self._clock = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def version(self, key: str):
+        with self._lock:
+            return self._generation, self._versions.get(key, 0)
+
+    def get(self, key: str, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version \
+                    or (entry[2] is not None and entry[2] < time.monotonic()):
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: str, version, value):
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if version != (self._generation, self._versions.get(key, 0)):
+                return
+            self._entries[key] = (version, value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            # Versions come from a counter shared by every key so that a
+            # version is never handed out twice for the same key.
+            self._clock += 1
+            self._versions[key] = self._clock
+            self._entries.pop(key, None)
+            self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else None,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
+
+
+class RedisCache:
+    """
+    Patient documents cached in Redis (or any server speaking its
+    protocol), shared by every process of the application.
+
+    Keys embed the current generation and version of the patient, which
+    invalidations increment: stale documents are never read again and
+    expire after `ttl` seconds. Memory is bounded by the server, which
+    should run with an LRU `maxmemory-policy`.
+
+    Args:
+        url: Server URL, e.g. redis://localhost:6379/0.
+        serializer: Object with `dumps` and `loads`, the app's JSON provider.
+        ttl: Seconds after which an entry expires.
+        prefix: Prefix of every key, to share a server between deployments.
+    """
+
+    def __init__(self, url: str, serializer, ttl: float = 300.0,
+                 prefix: str = "inf6150:patient"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                "The redis patient cache requires the 'redis' package.")
+        self._client = redis.Redis.from_url(url)
+        self._serializer = serializer
+        self.ttl = ttl
+        self.prefix = prefix
+        self.enabled = True
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def version(self, key: str):
+        generation, version = self._client.mget(
+            f"{self.prefix}:generation", f"{self.prefix}:version:{key}")
+        return int(generation or 0), int(version or 0)
+
+    def _key(self, key: str, version) -> str:
+        return f"{self.prefix}:{version[0]}:{version[1]}:{key}"
+
+    def get(self, key: str, version):
+        value = self._client.get(self._key(key, version))
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return self._serializer.loads(value)
+
+    def put(self, key: str, version, value):
+        self._client.set(self._key(key, version), self._serializer.dumps(value),
+                         ex=int(self.ttl) or None)
+
+    def invalidate(self, key: str):
+        self._client.incr(f"{self.prefix}:version:{key}")
+        with self._lock:
+            self._invalidations += 1
+
+    def clear(self):
+        self._client.incr(f"{self.prefix}:generation")
+        with self._lock:
+            self._invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "backend": "redis",
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else None,
+                "invalidations": self._invalidations,
+            }
+
+
+def create_patient_cache(app):
+    """Patient cache configured by the INF6150_PATIENT_CACHE* variables."""
+    backend = os.getenv("INF6150_PATIENT_CACHE", "memory")
+    ttl = float(os.getenv("INF6150_PATIENT_CACHE_TTL", "300"))
+    if backend == "memory":
+        return MemoryCache(
+            int(os.getenv("INF6150_PATIENT_CACHE_SIZE", "1024")), ttl)
+    if backend == "redis":
+        return RedisCache(
+            os.getenv("INF6150_PATIENT_CACHE_URL", "redis://localhost:6379/0"),
+            app.json, ttl)
+    if backend == "none":
+        return MemoryCache(0, ttl)
+    raise ValueError(
+        f"Unknown patient cache '{backend}'. Known caches: memory, redis, none.")
+
+
+def invalidate_patients(medical_insurance_ids: Iterable[str]):
+    """
+    Drop the cached documents of the patients. Called once the write is
+    committed, so that no read can cache the document it replaces.
+    """
+    cache = current_app.config['PATIENT_CACHE']
+    for medical_insurance_id in set(medical_insurance_ids):
+        if medical_insurance_id is not None:
+            cache.invalidate(medical_insurance_id)
+
+
+def charts_of_user(cur, user_id: str) -> list[str]:
+    """Medical insurance ids of the patients whose chart shows the user."""
+    cur.execute(CHARTS_OF_USER_QUERY, {"user_id": user_id})
+    return [row[0] for row in cur.fetchall()]
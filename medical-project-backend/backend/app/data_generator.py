@@ -0,0 +1,368 @@
+import json
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+import bcrypt
+
+# Order in which the generated files must be loaded (foreign keys).
+GENERATED_TABLES = [
+    "establishments",
+    "users",
+    "coordinates",
+    "parents",
+    "medical_history",
+    "medical_visits",
+]
+
+FIRST_NAMES = [
+    "Alice", "Amir", "Ana", "Benoit", "Camille", "Chloe", "David", "Emma",
+    "Fatima", "Felix", "Gabriel", "Hana", "Hugo", "Ines", "Jacob", "Julie",
+    "Karim", "Laura", "Leo", "Lina", "Louis", "Maya", "Mohamed", "Nathan",
+    "Noah", "Olivia", "Raphael", "Rosalie", "Samuel", "Sofia", "Thomas",
+    "Yasmine", "Zoe",
+]
+LAST_NAMES = [
+    "Tremblay", "Gagnon", "Roy", "Cote", "Bouchard", "Gauthier", "Morin",
+    "Lavoie", "Fortin", "Gagne", "Ouellet", "Pelletier", "Belanger", "Levesque",
+    "Bergeron", "Leblanc", "Paquette", "Girard", "Simard", "Boucher", "Nguyen",
+    "Smith", "Martin", "Diallo", "Haddad", "Garcia",
+]
+CITIES = [
+    "Montreal", "Quebec", "Laval", "Gatineau", "Longueuil", "Sherbrooke",
+    "Saguenay", "Levis", "Trois-Rivieres", "Terrebonne",
+]
+STREETS = [
+    "Rue Sainte-Catherine", "Boulevard Saint-Laurent", "Rue Sherbrooke",
+    "Avenue du Parc", "Rue Saint-Denis", "Chemin de la Cote-des-Neiges",
+    "Rue Notre-Dame", "Boulevard Rene-Levesque",
+]
+DIAGNOSTICS = [
+    "Hypertension", "Type 2 diabetes", "Asthma", "Seasonal allergies",
+    "Migraine", "Anxiety disorder", "Hypothyroidism", "Osteoarthritis",
+    "Gastroesophageal reflux", "Iron deficiency anemia", "Bronchitis",
+    "Lower back pain",
+]
+TREATMENTS = [
+    "Lisinopril 10mg daily", "Metformin 500mg twice daily",
+    "Salbutamol inhaler as needed", "Cetirizine 10mg daily",
+    "Sumatriptan as needed", "Cognitive behavioural therapy",
+    "Levothyroxine 50mcg daily", "Physiotherapy", "Omeprazole 20mg daily",
+    "Iron supplements", "Rest and fluids", "Ibuprofen as needed",
+]
+VISIT_SUMMARIES = [
+    "Routine check-up", "Follow-up visit", "Prescription renewal",
+    "Emergency consultation", "Lab results review", "Annual physical",
+    "Specialist referral", "Vaccination",
+]
+ESTABLISHMENT_KINDS = ["Hospital", "Clinic", "Medical Center", "CLSC"]
+# Years of birth by user type: doctors are 25 to 70 at the end of the
+# generated period.
+BIRTH_YEARS = {
+    "PATIENT": (1930, 2023),
+    "DOCTOR": (1955, 1999),
+}
+# Parents are 16 to 50 years older than their child, and at least 25 at the
+# end of the generated period.
+PARENT_AGE_AT_BIRTH = (16, 50)
+LATEST_PARENT_BIRTH = date(1999, 12, 31)
+GENDERS = ["Male", "Female", "Other"]
+AREA_CODES = ["514", "438", "450", "418", "819"]
+
+DEFAULT_PASSWORD = "password"
+BCRYPT_ALPHABET = b"./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+class DatasetGenerator:
+    """
+    Deterministically generate a realistic dataset as NDJSON files that
+    `db add` loads with COPY.
+
+    The same seed always produces the same files. Per-patient counts are
+    skewed: most patients have a few history entries and visits, a long
+    Pareto tail has many, and a small share of "heavy" patients has a visit
+    edited thousands of times, as seen on long-lived production records.
+
+    Every user gets the same precomputed password hash (of `password`), since
+    hashing a million passwords would dominate the generation time.
+
+    Args:
+        patients: Number of patients to generate.
+        seed: Seed of the random generator.
+        doctors: Number of doctors (one per 200 patients by default).
+        establishments: Number of establishments (one per 2000 patients by default).
+        parent_ratio: Share of patients with one or two parents.
+        versions_alpha: Pareto shape of the number of versions per entity;
+            lower means a longer tail.
+        visits_alpha: Pareto shape of the number of visits and history
+            entries per patient.
+        heavy_ratio: Share of patients with a visit edited thousands of times.
+        max_versions: Upper bound of versions of a single entity.
+    """
+
+    def __init__(self,
+                 patients: int,
+                 seed: int = 6150,
+                 doctors: int = None,
+                 establishments: int = None,
+                 parent_ratio: float = 0.2,
+                 versions_alpha: float = 2.5,
+                 visits_alpha: float = 1.6,
+                 heavy_ratio: float = 0.0005,
+                 max_versions: int = 2000):
+        self.patients = patients
+        self.seed = seed
+        self.doctors = doctors or max(5, patients // 200)
+        self.establishments = establishments or max(3, patients // 2000)
+        self.parent_ratio = parent_ratio
+        self.versions_alpha = versions_alpha
+        self.visits_alpha = visits_alpha
+        self.heavy_ratio = heavy_ratio
+        self.max_versions = max_versions
+
+        self.rng = random.Random(seed)
+        self.start = datetime(2015, 1, 1, tzinfo=timezone.utc).timestamp()
+        self.span = datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp() - self.start
+        self.birth_ranges = {}
+        for user_type, (first_year, last_year) in BIRTH_YEARS.items():
+            first_day = datetime(first_year, 1, 1, tzinfo=timezone.utc)
+            days = (datetime(last_year + 1, 1, 1, tzinfo=timezone.utc) - first_day).days
+            self.birth_ranges[user_type] = (first_day.timestamp(), days - 1)
+        # Salt derived from the seed, so that the files are reproducible.
+        salt_rng = random.Random(seed)
+        salt = b"$2b$12$" + bytes(salt_rng.choice(BCRYPT_ALPHABET)
+                                  for _ in range(21)) + b"O"
+        self.password_hash = bcrypt.hashpw(
+            DEFAULT_PASSWORD.encode("utf-8"), salt).decode("utf8")
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    # The helpers below avoid the slower conveniences of `random`, `uuid` and
+    # `datetime` since they run tens of millions of times for 1M patients.
+
+    def _int(self, low: int, high: int) -> int:
+        return low + int(self.rng.random() * (high - low + 1))
+
+    def _pick(self, values):
+        return values[int(self.rng.random() * len(values))]
+
+    def _uuid(self) -> str:
+        value = self.rng.getrandbits(128)
+        value = (value & ~(0xf000 << 64)) | (4 << 76)
+        value = (value & ~(0xc000 << 48)) | (0x8000 << 48)
+        h = "%032x" % value
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+    def _count(self, alpha: float, scale: float, cap: int) -> int:
+        return min(cap, int((self.rng.paretovariate(alpha) - 1) * scale))
+
+    def _versions(self) -> int:
+        return 1 + self._count(self.versions_alpha, 1, self.max_versions - 1)
+
+    def _timestamp(self, after: float = None) -> float:
+        if after is None:
+            return self.start + self.rng.random() * self.span
+        return after + 60 + self.rng.random() * 90 * 86400
+
+    @staticmethod
+    def _iso(timestamp: float) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(timestamp))
+
+    def _write(self, out, record: dict):
+        out.write(self._encode(record))
+        out.write("\n")
+
+    def _write_versions(self, out, record: dict, versions: int, field: str = None, mutate=None) -> int:
+        """
+        Write `versions` rows of the same entity. Only `field` (set by
+        `mutate`) and the timestamps change between versions, so the rest of
+        the record is encoded once.
+        """
+        encode = self._encode
+        static = {key: value for key, value in record.items() if key != field}
+        head = encode(static)[:-1]
+        field_key = f', "{field}": ' if field else None
+
+        created_at = self._timestamp()
+        created_at_iso = self._iso(created_at)
+        modified_at = created_at
+        value = record.get(field) if field else None
+        for version in range(versions):
+            if version:
+                modified_at = self._timestamp(modified_at)
+                value = mutate()
+            modified_at_iso = created_at_iso if not version else self._iso(modified_at)
+            if field_key:
+                out.write(f'{head}{field_key}{encode(value)}, "created_at": "{created_at_iso}", "modified_at": "{modified_at_iso}"}}\n')
+            else:
+                out.write(f'{head}, "created_at": "{created_at_iso}", "modified_at": "{modified_at_iso}"}}\n')
+        return versions
+
+    def _phone(self) -> str:
+        return f"{self._pick(AREA_CODES)}-{self._int(200, 999)}-{self._int(1000, 9999)}"
+
+    def _street_address(self) -> str:
+        return f"{self._int(1, 9999)} {self._pick(STREETS)}"
+
+    @staticmethod
+    def _years_before(day: date, years: int) -> date:
+        try:
+            return day.replace(year=day.year - years)
+        except ValueError:
+            # February 29th
+            return day.replace(year=day.year - years, day=28)
+
+    def _parent_birth(self, child_birth: str) -> str:
+        child_birth = date.fromisoformat(child_birth)
+        earliest = self._years_before(child_birth, PARENT_AGE_AT_BIRTH[1])
+        latest = min(self._years_before(child_birth, PARENT_AGE_AT_BIRTH[0]), LATEST_PARENT_BIRTH)
+        return (earliest + timedelta(days=self._int(0, (latest - earliest).days))).isoformat()
+
+    def _user(self, user_type: str, index: int, prefix: str, date_of_birth: str = None) -> dict:
+        first_name = self._pick(FIRST_NAMES)
+        last_name = self._pick(LAST_NAMES)
+        if date_of_birth is None:
+            birth_start, birth_days = self.birth_ranges[user_type]
+            date_of_birth = self._iso(birth_start + self._int(0, birth_days) * 86400)[:10]
+        return {
+            "user_id": self._uuid(),
+            "medical_insurance_id": None,
+            "login": f"{prefix}{index}",
+            "password_hash": self.password_hash,
+            "user_type": user_type,
+            "first_name": first_name,
+            "last_name": last_name,
+            "phone_number": self._phone(),
+            "email": f"{first_name}.{last_name}.{prefix}{index}@example.com".lower(),
+            "gender": self._pick(GENDERS),
+            "city_of_birth": self._pick(CITIES),
+            "date_of_birth": date_of_birth,
+        }
+
+    def _coordinate(self, user_id: str) -> dict:
+        letters = "ABCEGHJKLMNPRSTVXY"
+        return {
+            "coordinate_id": self._uuid(),
+            "user_id": user_id,
+            "street_address": self._street_address(),
+            "apartment": str(self._int(1, 400)) if self.rng.random() < 0.4 else None,
+            "postal_code": f"H{self._int(0, 9)}{self._pick(letters)} {self._int(0, 9)}{self._pick(letters)}{self._int(0, 9)}",
+            "city": self._pick(CITIES),
+            "country": "Canada",
+        }
+
+    def _history(self, patient_id: str, doctor_ids: list[str]) -> dict:
+        start_date = self._timestamp()
+        end_date = start_date + self._int(7, 720) * 86400 \
+            if self.rng.random() < 0.6 else None
+        return {
+            "history_id": self._uuid(),
+            "patient_id": patient_id,
+            "diagnostic": self._pick(DIAGNOSTICS),
+            "treatment": self._pick(TREATMENTS),
+            "doctor_id": self._pick(doctor_ids),
+            "start_date": self._iso(start_date)[:10],
+            "end_date": self._iso(end_date)[:10] if end_date else None,
+        }
+
+    def _visit(self, patient_id: str, doctor_ids: list[str], establishment_ids: list[str]) -> dict:
+        return {
+            "visit_id": self._uuid(),
+            "patient_id": patient_id,
+            "establishment_id": self._pick(establishment_ids),
+            "doctor_id": self._pick(doctor_ids),
+            "visit_date": self._iso(self._timestamp()),
+            "diagnostic_established": self._pick(DIAGNOSTICS),
+            "treatment": self._pick(TREATMENTS),
+            "visit_summary": self._pick(VISIT_SUMMARIES),
+            "notes": None,
+        }
+
+    def _visit_notes(self) -> str:
+        return f"Revision {self._int(1, 10**6)}"
+
+    def _treatment(self) -> str:
+        return self._pick(TREATMENTS)
+
+    def generate(self, output_dir: str, progress=None) -> dict:
+        """
+        Write one `<table>.ndjson` file per table in `output_dir` and return
+        the number of rows written per table. `progress` is called with the
+        number of patients generated so far.
+        """
+        output = Path(output_dir)
+        output.mkdir(parents=True, exist_ok=True)
+        files = {
+            table: open(output / f"{table}.ndjson", "w", encoding="utf-8", buffering=1 << 20)
+            for table in GENERATED_TABLES
+        }
+        counts = dict.fromkeys(GENERATED_TABLES, 0)
+        rng = self.rng
+
+        try:
+            establishment_ids = []
+            for index in range(self.establishments):
+                establishment_id = self._uuid()
+                establishment_ids.append(establishment_id)
+                self._write(files["establishments"], {
+                    "establishment_id": establishment_id,
+                    "establishment_name": f"{self._pick(CITIES)} {self._pick(ESTABLISHMENT_KINDS)} {index + 1}",
+                    "created_at": self._iso(self._timestamp()),
+                })
+            counts["establishments"] = self.establishments
+
+            doctor_ids = []
+            for index in range(self.doctors):
+                doctor = self._user("DOCTOR", index, "doctor")
+                doctor_ids.append(doctor["user_id"])
+                counts["users"] += self._write_versions(files["users"], doctor, 1)
+
+            for index in range(self.patients):
+                patient = self._user("PATIENT", index, "patient")
+                patient_id = f"GEN{index:09d}"
+                patient["medical_insurance_id"] = patient_id
+                counts["users"] += self._write_versions(
+                    files["users"], patient, self._versions(), "phone_number", self._phone)
+
+                for _ in range(1 if rng.random() < 0.85 else 2):
+                    counts["coordinates"] += self._write_versions(
+                        files["coordinates"], self._coordinate(patient["user_id"]),
+                        self._versions(), "street_address", self._street_address)
+
+                if rng.random() < self.parent_ratio:
+                    for parent_index in range(self._int(1, 2)):
+                        parent = self._user(
+                            "PARENT", index * 2 + parent_index, "parent",
+                            self._parent_birth(patient["date_of_birth"]))
+                        counts["users"] += self._write_versions(files["users"], parent, 1)
+                        self._write(files["parents"], {
+                            "parent_id": parent["user_id"],
+                            "child_id": patient["user_id"],
+                        })
+                        counts["parents"] += 1
+
+                for _ in range(self._count(self.visits_alpha, 3, 500)):
+                    counts["medical_history"] += self._write_versions(
+                        files["medical_history"], self._history(patient_id, doctor_ids),
+                        self._versions(), "treatment", self._treatment)
+
+                visits = self._count(self.visits_alpha, 6, 2000)
+                heavy = rng.random() < self.heavy_ratio
+                for visit_index in range(max(visits, 1 if heavy else 0)):
+                    if heavy and visit_index == 0:
+                        versions = self._int(
+                            min(1000, self.max_versions), self.max_versions)
+                    else:
+                        versions = self._versions()
+                    counts["medical_visits"] += self._write_versions(
+                        files["medical_visits"], self._visit(patient_id, doctor_ids, establishment_ids),
+                        versions, "notes", self._visit_notes)
+
+                if progress and (index + 1) % 10000 == 0:
+                    progress(index + 1)
+        finally:
+            for f in files.values():
+                f.close()
+
+        if progress:
+            progress(self.patients)
+        return counts
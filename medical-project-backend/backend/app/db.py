@@ -1,47 +1,93 @@
-import psycopg2.pool
 import os
 from pathlib import Path
 from dotenv import load_dotenv
 from contextlib import contextmanager
-import bcrypt
 from .schemas import (
-    CREATE_COORDINATES_TABLE,
-    CREATE_EXTENSION_UUID,
-    CREATE_HISTORY_ID_INDEX,
-    CREATE_USER_ID_INDEX,
-    CREATE_VISIT_ID_INDEX,
+    DROP_ROW_VERSION_FUNCTION,
+    DROP_ROW_VERSION_SEQUENCE,
+    CREATE_TOKEN_REVOKED_TRIGGER,
+    DROP_TOKEN_REVOKED_FUNCTION,
+    DROP_TOKEN_GENERATIONS_TABLE,
+    DROP_TOKEN_GENERATION_FUNCTION,
     DROP_COORDINATES_TABLE,
-    CREATE_MEDICAL_HISTORY_TABLE,
     DROP_MEDICAL_HISTORY_TABLE,
-    CREATE_MEDICAL_VISITS_TABLE,
     DROP_MEDICAL_VISITS_TABLE,
-    CREATE_USERS_TABLE,
     DROP_USERS_TABLE,
-    CREATE_USER_TYPE_ENUM,
     DROP_USER_TYPE_ENUM,
-    CREATE_PARENTS_TABLE,
     DROP_PARENTS_TABLE,
-    CREATE_COORDINATE_ID_INDEX,
-    CREATE_MEDICAL_INSURANCE_ID_INDEX,
     DROP_COORDINATE_ID_INDEX,
     DROP_MEDICAL_INSURANCE_ID_INDEX,
     DROP_USER_ID_INDEX,
     DROP_VISIT_ID_INDEX,
     DROP_HISTORY_ID_INDEX,
-    CREATE_ESTABLISHMENTS_TABLE,
     DROP_ESTABLISHMENTS_TABLE,
-    CREATE_JTI_INDEX,
     DROP_JTI_INDEX,
     CREATE_USER_BLACKLIST_INDEX,
     DROP_USER_BLACKLIST_INDEX,
-    CREATE_TOKEN_BLACKLIST_TABLE,
+    CREATE_TOKEN_BLACKLIST_EXPIRES_AT_INDEX,
+    DROP_TOKEN_BLACKLIST_EXPIRES_AT_INDEX,
     DROP_TOKEN_BLACKLIST_TABLE,
-    CREATE_MFA_CONFIG_TABLE,
     DROP_MFA_CONFIG_TABLE,
-    CREATE_MFA_CONFIG_INDEX,
-    DROP_MFA_CONFIG_INDEX
+    DROP_MFA_CONFIG_INDEX,
+    DROP_USERS_CURRENT_TABLE,
+    DROP_USERS_CURRENT_FUNCTION,
+    REFRESH_USERS_CURRENT,
+    DROP_COORDINATES_CURRENT_TABLE,
+    DROP_COORDINATES_CURRENT_FUNCTION,
+    REFRESH_COORDINATES_CURRENT,
+    DROP_MEDICAL_HISTORY_CURRENT_TABLE,
+    DROP_MEDICAL_HISTORY_CURRENT_FUNCTION,
+    REFRESH_MEDICAL_HISTORY_CURRENT,
+    DROP_MEDICAL_VISITS_CURRENT_TABLE,
+    DROP_MEDICAL_VISITS_CURRENT_FUNCTION,
+    REFRESH_MEDICAL_VISITS_CURRENT,
+    DROP_USERS_CURRENT_MEDICAL_INSURANCE_ID_INDEX,
+    DROP_USERS_CURRENT_EMAIL_INDEX,
+    DROP_COORDINATES_CURRENT_USER_ID_INDEX,
+    DROP_MEDICAL_HISTORY_CURRENT_PATIENT_ID_INDEX,
+    DROP_MEDICAL_VISITS_CURRENT_PATIENT_ID_INDEX,
+    DROP_USERS_MODIFIED_AT_INDEX,
+    DROP_COORDINATES_MODIFIED_AT_INDEX,
+    DROP_MEDICAL_HISTORY_MODIFIED_AT_INDEX,
+    DROP_MEDICAL_VISITS_MODIFIED_AT_INDEX,
+    DROP_USERS_VALID_PERIOD_FUNCTION,
+    REFRESH_USERS_VALID_PERIOD,
+    DROP_USERS_VALID_PERIOD_INDEX,
+    DROP_COORDINATES_VALID_PERIOD_FUNCTION,
+    REFRESH_COORDINATES_VALID_PERIOD,
+    DROP_COORDINATES_VALID_PERIOD_INDEX,
+    DROP_MEDICAL_HISTORY_VALID_PERIOD_FUNCTION,
+    REFRESH_MEDICAL_HISTORY_VALID_PERIOD,
+    DROP_MEDICAL_HISTORY_VALID_PERIOD_INDEX,
+    DROP_MEDICAL_VISITS_VALID_PERIOD_FUNCTION,
+    REFRESH_MEDICAL_VISITS_VALID_PERIOD,
+    DROP_MEDICAL_VISITS_VALID_PERIOD_INDEX,
+    DROP_SCHEMA_VERSION_TABLE,
+    DROP_COORDINATES_USER_ID_INDEX,
+    DROP_MEDICAL_HISTORY_PATIENT_ID_INDEX,
+    DROP_MEDICAL_VISITS_PATIENT_ID_INDEX,
+    DROP_PARENTS_CHILD_ID_INDEX,
+    DROP_USERS_CURRENT_DOCTOR_NAME_INDEX,
+    DROP_USERS_CURRENT_DOCTORS_INDEX
 )
-import json
+from .pool import ConnectionPool
+from .query_log import InstrumentedCursor
+import psycopg2.extensions
+import threading
+import time
+
+READ = "read"
+WRITE = "write"
+
+# Seconds the replica is behind the primary. A replica that has replayed
+# everything it received is considered up to date even if the primary has
+# been idle for a while.
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END;
+"""
 
 
 class Database:
@@ -71,78 +117,214 @@ class Database:
             raise ValueError(
                 "One or more required database environment variables are not set.")
 
-        self.pool = psycopg2.pool.SimpleConnectionPool(
-            1,
-            20,
-            user=self.user,
-            password=self.password,
-            host=self.host,
-            port=self.port,
-            database=self.database
-        )
+        self.pool = self._create_pool(self.host, self.port)
 
         if not self.pool:
             raise Exception("Connection pool could not be established.")
         print("Database connection pool created successfully.")
 
+        self._replica_lock = threading.Lock()
+        self._replica_index = 0
+        self._replica_lag = {}
+        self._recent_writers = {}
+
+        # Read replicas, given as a comma separated list of host[:port].
+        # Without replicas, read intent is served by the primary. A replica
+        # down at startup doesn't keep the application from starting: its
+        # pool connects on first use and reads go to the primary meanwhile.
+        self.replica_pools = []
+        replica_hosts = os.getenv("INF6150_DATABASE_REPLICA_HOSTS", "")
+        for replica in filter(None, (h.strip() for h in replica_hosts.split(","))):
+            replica_host, _, replica_port = replica.partition(":")
+            try:
+                pool = self._create_pool(replica_host, replica_port or self.port)
+            except psycopg2.OperationalError as e:
+                print(f"Read replica {replica} is unreachable, reads fall back to the primary: {e}")
+                pool = self._create_pool(replica_host, replica_port or self.port, minconn=0)
+                self._replica_lag[len(self.replica_pools)] = (time.monotonic(), float("inf"))
+            self.replica_pools.append(pool)
+        if self.replica_pools:
+            print(f"{len(self.replica_pools)} read replica pool(s) created successfully.")
+
+        self.replica_max_lag = float(
+            os.getenv("INF6150_DATABASE_REPLICA_MAX_LAG", "5"))
+        self.replica_lag_check_interval = float(
+            os.getenv("INF6150_DATABASE_REPLICA_LAG_CHECK_INTERVAL", "1"))
+        self.read_your_writes_window = float(
+            os.getenv("INF6150_DATABASE_READ_YOUR_WRITES_WINDOW", "10"))
+
+        # Returns a key identifying the current user (or None), used to pin
+        # reads to the primary right after that user wrote something.
+        self.session_key_provider = None
+
+    def _create_pool(self, host, port, minconn: int = None) -> ConnectionPool:
+        if minconn is None:
+            minconn = int(os.getenv("INF6150_DATABASE_POOL_MIN_SIZE", "1"))
+        return ConnectionPool(
+            minconn,
+            int(os.getenv("INF6150_DATABASE_POOL_MAX_SIZE", "20")),
+            timeout=float(os.getenv("INF6150_DATABASE_POOL_TIMEOUT", "30")),
+            max_age=float(os.getenv("INF6150_DATABASE_POOL_MAX_AGE", "1800")),
+            validate_after=float(
+                os.getenv("INF6150_DATABASE_POOL_VALIDATE_AFTER", "5")),
+            user=self.user,
+            password=self.password,
+            host=host,
+            port=port,
+            database=self.database,
+            cursor_factory=InstrumentedCursor
+        )
+
     @contextmanager
-    def get_conn(self):
-        conn = self.pool.getconn()
+    def get_conn(self, intent: str = WRITE):
+        """
+        Check out a connection for the given intent.
+
+        Write intent (the default) always uses the primary. Read intent is
+        routed to a read replica whose replication lag is within
+        `replica_max_lag` seconds, unless the current user wrote through this
+        worker less than `read_your_writes_window` seconds ago.
+        """
+        if intent not in (READ, WRITE):
+            raise ValueError(f"Unknown connection intent '{intent}'.")
+
+        pool = self.pool
+        if intent == READ and self.replica_pools and not self._pinned_to_primary():
+            pool = self._select_replica() or self.pool
+
+        conn = pool.getconn()
         try:
             yield conn
         finally:
-            self.pool.putconn(conn)
+            pool.putconn(conn)
 
-    def initialize_extensions(self):
-        queries = [
-            CREATE_EXTENSION_UUID
-        ]
-        with self.get_conn() as conn:
-            with conn.cursor() as cur:
-                for query in queries:
-                    cur.execute(query)
-            conn.commit()
-        print("All extensions have been initialized.")
+    def connect(self):
+        """
+        A connection to the primary of its own, outside of the pools, for
+        sessions that outlive a request (LISTEN for instance).
+        """
+        return psycopg2.connect(user=self.user, password=self.password,
+                                host=self.host, port=self.port,
+                                database=self.database)
 
-    def initialize_tables(self):
-        queries = [
-            CREATE_USER_TYPE_ENUM,
-            CREATE_ESTABLISHMENTS_TABLE,
-            CREATE_USERS_TABLE,
-            CREATE_COORDINATES_TABLE,
-            CREATE_MEDICAL_HISTORY_TABLE,
-            CREATE_MEDICAL_VISITS_TABLE,
-            CREATE_PARENTS_TABLE,
-            CREATE_TOKEN_BLACKLIST_TABLE,
-            CREATE_MFA_CONFIG_TABLE
-        ]
-        with self.get_conn() as conn:
-            with conn.cursor() as cur:
-                for query in queries:
-                    cur.execute(query)
-            conn.commit()
-        print("All tables have been initialized.")
+    def _current_session_key(self):
+        if self.session_key_provider is None:
+            return None
+        try:
+            return self.session_key_provider()
+        except Exception:
+            return None
 
-    def initialize_indexes(self):
-        queries = [
-            CREATE_USER_ID_INDEX,
-            CREATE_MEDICAL_INSURANCE_ID_INDEX,
-            CREATE_COORDINATE_ID_INDEX,
-            CREATE_VISIT_ID_INDEX,
-            CREATE_HISTORY_ID_INDEX,
-            CREATE_JTI_INDEX,
-            CREATE_USER_BLACKLIST_INDEX,
-            CREATE_MFA_CONFIG_INDEX
+    def mark_write(self, session_key=None):
+        """
+        Record that the current user (or `session_key`) just wrote, so that
+        its reads stick to the primary for the read-your-writes window.
+
+        Writers are only known to this process: with several workers, the
+        user's next request may land on another one and read from a replica.
+        """
+        session_key = session_key or self._current_session_key()
+        if session_key is None or self.read_your_writes_window <= 0:
+            return
+
+        now = time.monotonic()
+        with self._replica_lock:
+            self._recent_writers[session_key] = now + \
+                self.read_your_writes_window
+            if len(self._recent_writers) > 10000:
+                self._recent_writers = {
+                    key: until for key, until in self._recent_writers.items()
+                    if until > now
+                }
+
+    def _pinned_to_primary(self) -> bool:
+        session_key = self._current_session_key()
+        if session_key is None:
+            return False
+        with self._replica_lock:
+            until = self._recent_writers.get(session_key)
+        return until is not None and until > time.monotonic()
+
+    def _select_replica(self):
+        with self._replica_lock:
+            start = self._replica_index
+            self._replica_index = (start + 1) % len(self.replica_pools)
+
+        for offset in range(len(self.replica_pools)):
+            index = (start + offset) % len(self.replica_pools)
+            if self._replica_lag_seconds(index) <= self.replica_max_lag:
+                return self.replica_pools[index]
+        return None
+
+    def _replica_lag_seconds(self, index: int) -> float:
+        now = time.monotonic()
+        with self._replica_lock:
+            checked_at, lag = self._replica_lag.get(index, (None, None))
+        if checked_at is not None and now - checked_at < self.replica_lag_check_interval:
+            return lag
+
+        pool = self.replica_pools[index]
+        try:
+            conn = pool.getconn(timeout=1)
+        except Exception:
+            lag = float("inf")
+        else:
+            try:
+                with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                    cur.execute(REPLICA_LAG_QUERY)
+                    lag = float(cur.fetchone()[0] or 0)
+                conn.rollback()
+            except Exception:
+                lag = float("inf")
+            finally:
+                pool.putconn(conn)
+
+        with self._replica_lock:
+            self._replica_lag[index] = (now, lag)
+        return lag
+
+    def pool_stats(self) -> dict:
+        return self.pool.stats()
+
+    def replica_pool_stats(self) -> list:
+        with self._replica_lock:
+            lags = {index: lag for index, (_, lag) in self._replica_lag.items()}
+        return [
+            {**pool.stats(), "lag_seconds": lags.get(index)}
+            for index, pool in enumerate(self.replica_pools)
         ]
+
+    def migrate(self, log: bool = True) -> list[int]:
+        """
+        Bring the schema up to date by applying the pending migrations of
+        app/migrations.py. Existing data is kept.
+        """
+        from .migrations import migrate
+        return migrate(self, log=log)
+
+    def is_empty(self) -> bool:
         with self.get_conn() as conn:
             with conn.cursor() as cur:
-                for query in queries:
-                    cur.execute(query)
-            conn.commit()
-        print("All indexes have been initialized.")
+                cur.execute("SELECT NOT EXISTS(SELECT 1 FROM users);")
+                return cur.fetchone()[0]
 
     def drop_tables(self, log: bool = True):
         queries = [
+            DROP_USERS_CURRENT_FUNCTION,
+            DROP_COORDINATES_CURRENT_FUNCTION,
+            DROP_MEDICAL_HISTORY_CURRENT_FUNCTION,
+            DROP_MEDICAL_VISITS_CURRENT_FUNCTION,
+            DROP_USERS_VALID_PERIOD_FUNCTION,
+            DROP_COORDINATES_VALID_PERIOD_FUNCTION,
+            DROP_MEDICAL_HISTORY_VALID_PERIOD_FUNCTION,
+            DROP_MEDICAL_VISITS_VALID_PERIOD_FUNCTION,
+            DROP_ROW_VERSION_FUNCTION,
+            DROP_TOKEN_REVOKED_FUNCTION,
+            DROP_TOKEN_GENERATION_FUNCTION,
+            DROP_USERS_CURRENT_TABLE,
+            DROP_COORDINATES_CURRENT_TABLE,
+            DROP_MEDICAL_HISTORY_CURRENT_TABLE,
+            DROP_MEDICAL_VISITS_CURRENT_TABLE,
             DROP_PARENTS_TABLE,
             DROP_MEDICAL_VISITS_TABLE,
             DROP_MEDICAL_HISTORY_TABLE,
@@ -150,8 +332,11 @@ class Database:
             DROP_USERS_TABLE,
             DROP_ESTABLISHMENTS_TABLE,
             DROP_TOKEN_BLACKLIST_TABLE,
+            DROP_TOKEN_GENERATIONS_TABLE,
             DROP_USER_TYPE_ENUM,
-            DROP_MFA_CONFIG_TABLE
+            DROP_MFA_CONFIG_TABLE,
+            DROP_ROW_VERSION_SEQUENCE,
+            DROP_SCHEMA_VERSION_TABLE
         ]
         with self.get_conn() as conn:
             with conn.cursor() as cur:
@@ -168,9 +353,29 @@ class Database:
             DROP_COORDINATE_ID_INDEX,
             DROP_VISIT_ID_INDEX,
             DROP_HISTORY_ID_INDEX,
+            DROP_COORDINATES_USER_ID_INDEX,
+            DROP_MEDICAL_HISTORY_PATIENT_ID_INDEX,
+            DROP_MEDICAL_VISITS_PATIENT_ID_INDEX,
+            DROP_PARENTS_CHILD_ID_INDEX,
             DROP_JTI_INDEX,
             DROP_USER_BLACKLIST_INDEX,
-            DROP_MFA_CONFIG_INDEX
+            DROP_TOKEN_BLACKLIST_EXPIRES_AT_INDEX,
+            DROP_MFA_CONFIG_INDEX,
+            DROP_USERS_CURRENT_MEDICAL_INSURANCE_ID_INDEX,
+            DROP_USERS_CURRENT_EMAIL_INDEX,
+            DROP_USERS_CURRENT_DOCTOR_NAME_INDEX,
+            DROP_USERS_CURRENT_DOCTORS_INDEX,
+            DROP_COORDINATES_CURRENT_USER_ID_INDEX,
+            DROP_MEDICAL_HISTORY_CURRENT_PATIENT_ID_INDEX,
+            DROP_MEDICAL_VISITS_CURRENT_PATIENT_ID_INDEX,
+            DROP_USERS_MODIFIED_AT_INDEX,
+            DROP_COORDINATES_MODIFIED_AT_INDEX,
+            DROP_MEDICAL_HISTORY_MODIFIED_AT_INDEX,
+            DROP_MEDICAL_VISITS_MODIFIED_AT_INDEX,
+            DROP_USERS_VALID_PERIOD_INDEX,
+            DROP_COORDINATES_VALID_PERIOD_INDEX,
+            DROP_MEDICAL_HISTORY_VALID_PERIOD_INDEX,
+            DROP_MEDICAL_VISITS_VALID_PERIOD_INDEX
         ]
         with self.get_conn() as conn:
             with conn.cursor() as cur:
@@ -180,111 +385,48 @@ class Database:
         if log:
             print("All indexes have been dropped.")
 
-    def add_test_data(self, data_path: str):
-        with open(data_path, 'r') as f:
-            records = json.load(f)
-
-        table_name = Path(data_path).stem
-
+    def refresh_current_tables(self):
+        """
+        Rebuild the *_current tables and the valid periods of the versions
+        from the versioned tables. The triggers keep them up to date on every
+        write; this is only needed to backfill them on an existing database
+        or after a manual edit of the history.
+        """
+        queries = [
+            REFRESH_USERS_CURRENT,
+            REFRESH_COORDINATES_CURRENT,
+            REFRESH_MEDICAL_HISTORY_CURRENT,
+            REFRESH_MEDICAL_VISITS_CURRENT,
+            REFRESH_USERS_VALID_PERIOD,
+            REFRESH_COORDINATES_VALID_PERIOD,
+            REFRESH_MEDICAL_HISTORY_VALID_PERIOD,
+            REFRESH_MEDICAL_VISITS_VALID_PERIOD
+        ]
         with self.get_conn() as conn:
             with conn.cursor() as cur:
-                if table_name == "users":
-                    for record in records:
-                        password_bytes = record["password"].encode('utf-8')
-                        salt = bcrypt.gensalt()
-                        pwhash = bcrypt.hashpw(password_bytes, salt)
-                        password_hash = pwhash.decode('utf8')
-                        cur.execute("""
-                            INSERT INTO users (user_id, medical_insurance_id, login, password_hash, user_type, first_name, last_name, phone_number, email, gender, city_of_birth, date_of_birth)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-                        """, (
-                            record.get("user_id"),
-                            record.get("medical_insurance_id"),
-                            record["login"],
-                            password_hash,
-                            record["user_type"],
-                            record["first_name"],
-                            record["last_name"],
-                            record["phone_number"],
-                            record["email"],
-                            record.get("gender"),
-                            record.get("city_of_birth"),
-                            record.get("date_of_birth")
-                        ))
-                elif table_name == "coordinates":
-                    for record in records:
-                        cur.execute("""
-                            INSERT INTO coordinates (coordinate_id, user_id, street_address, apartment, postal_code, city, country)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s);
-                        """, (
-                            record.get("coordinate_id"),
-                            record["user_id"],
-                            record["street_address"],
-                            record.get("apartment"),
-                            record["postal_code"],
-                            record["city"],
-                            record["country"]
-                        ))
-                elif table_name == "medical_history":
-                    for record in records:
-                        cur.execute("""
-                            INSERT INTO medical_history (history_id, patient_id, diagnostic, treatment, doctor_id, start_date, end_date)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s);
-                        """, (
-                            record.get("history_id"),
-                            record["patient_id"],
-                            record["diagnostic"],
-                            record["treatment"],
-                            record["doctor_id"],
-                            record.get("start_date"),
-                            record.get("end_date")
-                        ))
-                elif table_name == "medical_visits":
-                    for record in records:
-                        cur.execute("""
-                        INSERT INTO medical_visits (
-                            visit_id, patient_id, establishment_id, doctor_id,
-                            visit_date, diagnostic_established, treatment,
-                            visit_summary, notes
-                        )
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
-                    """, (
-                            record.get("visit_id"),
-                            record["patient_id"],
-                            record["establishment_id"],
-                            record["doctor_id"],
-                            record["visit_date"],
-                            record.get("diagnostic_established"),
-                            record.get("treatment"),
-                            record["visit_summary"],
-                            record.get("notes")
-                        ))
-                elif table_name == "establishments":
-                    for record in records:
-                        cur.execute("""
-                        INSERT INTO establishments (establishment_id, establishment_name)
-                        VALUES (%s, %s);
-                    """, (
-                            record.get("establishment_id"),
-                            record["establishment_name"]
-                        ))
-                elif table_name == "parents":
-                    for record in records:
-                        cur.execute("""
-                            INSERT INTO parents (parent_id, child_id)
-                            VALUES (%s, %s)
-                            ON CONFLICT (parent_id, child_id) DO NOTHING;
-                        """, (
-                            record["parent_id"],
-                            record["child_id"]
-                        ))
-                else:
-                    print(f"Unknown table name '{table_name}' in data file '{data_path}'."
-                          " Skipping.")
-                    return
+                for query in queries:
+                    cur.execute(query)
             conn.commit()
-        print(f"Test data from '{data_path}' has been added.")
+        print("All current tables have been refreshed.")
+
+    def add_test_data(self, data_path: str, table_name: str = None, progress=None):
+        """
+        Bulk load a JSON array or NDJSON file into `table_name`, which
+        defaults to the file name (e.g. data/users.json goes into users).
+        """
+        from .bulk_loader import BulkLoader, TABLE_COLUMNS
+
+        table_name = table_name or Path(data_path).stem
+        if table_name not in TABLE_COLUMNS:
+            print(f"Unknown table name '{table_name}' in data file '{data_path}'."
+                  " Skipping.")
+            return
+
+        rows = BulkLoader(self, progress=progress).load(data_path, table_name)
+        print(f"Test data from '{data_path}' has been added ({rows} rows).")
 
     def close_pool(self):
         self.pool.closeall()
+        for pool in self.replica_pools:
+            pool.closeall()
         print("Database connection pool has been closed.")
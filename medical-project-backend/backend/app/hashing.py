@@ -0,0 +1,279 @@
+import logging
+import multiprocessing
+import os
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Optional
+import bcrypt
+from flask import jsonify
+from .models import ErrorResponse
+
+# Modular crypt format of bcrypt: $<variant>$<cost>$<salt and hash>. Every
+# hash records the parameters it was made with.
+BCRYPT_HASH = re.compile(r"^\$(2[abxy]?)\$(\d{2})\$")
+
+
+def hash_password(password: str, rounds: int = 12) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf8")
+
+
+def check_password(password_hash: str, password: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+    except ValueError:
+        # Not a bcrypt hash (e.g. an empty one): nothing matches it.
+        return False
+
+
+def hash_parameters(password_hash: str) -> Optional[dict]:
+    """Algorithm and cost the hash was made with, None if not a bcrypt hash."""
+    match = BCRYPT_HASH.match(password_hash or "")
+    if match is None:
+        return None
+    return {"algorithm": "bcrypt", "variant": match.group(1), "rounds": int(match.group(2))}
+
+
+def calibrate_rounds(target_ms: float, min_rounds: int = 10, max_rounds: int = 16,
+                     samples: int = 5) -> int:
+    """
+    Highest bcrypt cost whose hash takes at most `target_ms` on this machine,
+    within [min_rounds, max_rounds]. Each round doubles the work, so the
+    time of a cheap cost is measured and extrapolated.
+    """
+    probe_rounds = 8
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(probe_rounds))
+        timings.append(time.perf_counter() - start)
+    probe_ms = statistics.median(timings) * 1000
+
+    rounds = min_rounds
+    while rounds < max_rounds and probe_ms * 2 ** (rounds + 1 - probe_rounds) <= target_ms:
+        rounds += 1
+    return rounds
+
+
+def hashing_context():
+    # Forking a process holding open database connections and threads is
+    # unsafe, workers are started from a clean process instead.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn")
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when every slot of the password hasher is taken."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Too many password operations in progress, try again later.")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords with bcrypt in a pool of worker processes,
+    so that their hundreds of milliseconds of CPU don't hold the GIL of the
+    worker serving requests.
+
+    At most `workers + max_queue` operations are in progress at once. Past
+    that, and when an operation waits more than `timeout` seconds,
+    PasswordHasherBusy is raised for the request to be answered with 429
+    rather than piling up behind the others.
+
+    Hashes made with another cost than `rounds` are upgraded when their
+    password is known, after a successful login: `rehash_async` hashes it
+    again off the request, at most `max_rehashes` at a time, so that a
+    change of cost spreads over the logins instead of competing with them.
+
+    Args:
+        workers: Processes of the pool. 0 hashes on the calling thread.
+        max_queue: Operations waiting for a process beyond those running.
+        rounds: bcrypt cost factor of new hashes (2^rounds iterations).
+            Existing hashes are checked with the cost they were made with.
+        timeout: Seconds an operation may take, queueing included.
+        max_rehashes: Rehashes in progress at once, the others are skipped
+            until the next login.
+        logger: Logger of the failed rehashes.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 8, rounds: int = 12,
+                 timeout: float = 10.0, max_rehashes: int = 1,
+                 logger: Optional[logging.Logger] = None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+        self._rehash_slots = threading.BoundedSemaphore(max_rehashes)
+        self._executor = None
+        self._pid = None
+
+        self._in_progress = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._total_time = 0.0
+        self._rehashes = 0
+        self._rehashes_skipped = 0
+        self._rehash_failures = 0
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Whether the hash wasn't made with the current cost."""
+        parameters = hash_parameters(password_hash)
+        return parameters is not None and parameters["rounds"] != self.rounds
+
+    def rehash_async(self, password: str, store: Callable[[str], bool]) -> bool:
+        """
+        Hash the password with the current cost in the background and pass
+        the hash to `store`, which returns whether it replaced the old one.
+        Returns False when too many rehashes are already in progress.
+        """
+        if not self._rehash_slots.acquire(blocking=False):
+            with self._lock:
+                self._rehashes_skipped += 1
+            return False
+        threading.Thread(target=self._rehash, args=(password, store),
+                         name="password-rehash", daemon=True).start()
+        return True
+
+    def _rehash(self, password: str, store: Callable[[str], bool]):
+        try:
+            stored = store(self.hash(password))
+            with self._lock:
+                if stored:
+                    self._rehashes += 1
+                else:
+                    self._rehashes_skipped += 1
+        except PasswordHasherBusy:
+            with self._lock:
+                self._rehashes_skipped += 1
+        except Exception as e:
+            with self._lock:
+                self._rehash_failures += 1
+            self.logger.error(f"Error rehashing password: {str(e)}")
+        finally:
+            self._rehash_slots.release()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # The pool's processes belong to the process that started them: a
+        # forked worker starts its own.
+        if self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=hashing_context())
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordHasherBusy()
+
+        started = time.perf_counter()
+        with self._lock:
+            self._in_progress += 1
+        abandoned = False
+        try:
+            if self.workers == 0:
+                return function(*args)
+            future = self._pool().submit(function, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    self._timeouts += 1
+                # Running work can't be stopped: its slot is given back once
+                # it is done, or work abandoned by timed out callers would
+                # pile up in the pool beyond the limit.
+                if not future.cancel():
+                    abandoned = True
+                    future.add_done_callback(lambda _: self._finish(started))
+                raise PasswordHasherBusy()
+        finally:
+            if not abandoned:
+                self._finish(started)
+
+    def _finish(self, started: float):
+        with self._lock:
+            self._in_progress -= 1
+            self._completed += 1
+            self._total_time += time.perf_counter() - started
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._pid = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "in_progress": self._in_progress,
+                "max_in_progress": max(self.workers, 1) + self.max_queue,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "mean_ms": self._total_time / self._completed * 1000
+                if self._completed else None,
+                "rehashes": self._rehashes,
+                "rehashes_skipped": self._rehashes_skipped,
+                "rehash_failures": self._rehash_failures,
+            }
+
+
+def create_password_hasher(logger: Optional[logging.Logger] = None) -> PasswordHasher:
+    """Password hasher configured by the INF6150_BCRYPT_* variables."""
+    workers = int(os.getenv("INF6150_BCRYPT_WORKERS", str(os.cpu_count() or 1)))
+    return PasswordHasher(
+        workers,
+        max_queue=int(os.getenv("INF6150_BCRYPT_QUEUE_SIZE", str(max(workers, 1) * 4))),
+        rounds=bcrypt_rounds(),
+        timeout=float(os.getenv("INF6150_BCRYPT_TIMEOUT", "10")),
+        max_rehashes=int(os.getenv("INF6150_BCRYPT_MAX_REHASHES", str(max(workers // 2, 1)))),
+        logger=logger)
+
+
+def bcrypt_rounds() -> int:
+    """
+    Cost of new hashes: INF6150_BCRYPT_ROUNDS, or with `auto` the highest
+    cost hashing within INF6150_BCRYPT_TARGET_MS on this machine, between
+    INF6150_BCRYPT_MIN_ROUNDS and INF6150_BCRYPT_MAX_ROUNDS.
+    """
+    value = os.getenv("INF6150_BCRYPT_ROUNDS", "12")
+    if value == "auto":
+        return calibrate_rounds(
+            float(os.getenv("INF6150_BCRYPT_TARGET_MS", "250")),
+            min_rounds=int(os.getenv("INF6150_BCRYPT_MIN_ROUNDS", "10")),
+            max_rounds=int(os.getenv("INF6150_BCRYPT_MAX_ROUNDS", "16")))
+    rounds = int(value)
+    if not 4 <= rounds <= 31:
+        raise ValueError(f"INF6150_BCRYPT_ROUNDS must be between 4 and 31, not {rounds}.")
+    return rounds
+
+
+def hasher_busy_response(error: PasswordHasherBusy):
+    """429 answered to a request that found the password hasher saturated."""
+    response = jsonify(ErrorResponse(error=str(error)).model_dump())
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
@@ -0,0 +1,79 @@
+import dataclasses
+import decimal
+import uuid
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+from .serialization import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    """Types neither json nor orjson serialize themselves, as Flask does."""
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, "__html__"):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider serializing with orjson when it is installed, and with the
+    standard library otherwise. Documents are the same as with Flask's
+    default provider: sorted keys, HTTP dates, UUIDs as strings. The only
+    difference is that non-ASCII characters are written as UTF-8 instead of
+    being escaped.
+
+    orjson writes UUIDs itself. Dates and datetimes are passed through to
+    `_default`, since its own format is ISO 8601.
+    """
+
+    default = staticmethod(_default)
+
+    def _options(self, indent: bool = False) -> int:
+        options = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def _indent(self) -> bool:
+        return self.compact is False or (self.compact is None and self._app.debug)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default,
+                                option=self._options()).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # Beyond what orjson supports (non-string keys, integers over
+            # 64 bits...): the standard library has the last word.
+            return super().dumps(obj, separators=(",", ":"))
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            data = orjson.dumps(obj, default=self.default,
+                                option=self._options(indent=self._indent()))
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(data + b"\n", mimetype=self.mimetype)
+
+
+# Providers that INF6150_JSON_PROVIDER can select.
+JSON_PROVIDERS = {
+    "fast": FastJSONProvider,
+    "default": DefaultJSONProvider,
+}
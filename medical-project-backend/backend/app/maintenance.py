@@ -0,0 +1,190 @@
+import logging
+import os
+import random
+import threading
+import time
+from functools import partial
+from typing import Callable, Optional
+from .background import ProcessLocalThread
+from .services.token_service import maintain_token_partitions, purge_expired_tokens
+
+# Class of the advisory locks taken by maintenance tasks, the second key
+# being the task's index: a task runs in one worker at a time.
+MAINTENANCE_LOCK_CLASS = 61500002
+
+
+class MaintenanceTask:
+    def __init__(self, name: str, run: Callable, interval: float):
+        self.name = name
+        self.run = run
+        self.interval = interval
+
+        self.runs = 0
+        self.skips = 0
+        self.failures = 0
+        self.last_started_at = None
+        self.last_duration = None
+        self.last_result = None
+        self.last_error = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "skips": self.skips,
+            "failures": self.failures,
+            "last_started_at": self.last_started_at,
+            "last_duration": self.last_duration,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+class MaintenanceScheduler:
+    """
+    Runs the database maintenance tasks every `interval` seconds of each,
+    from a thread started by the first request of each worker.
+
+    Every worker runs the scheduler, so each run first takes the task's
+    advisory lock without waiting: a run that finds the task already
+    running elsewhere is skipped. Intervals are jittered so that workers
+    started together don't all try at once.
+
+    Args:
+        db_instance: Database the tasks are run against, passed to them.
+        enabled: Whether the background thread runs. Tasks can still be run
+            on demand with `run` and `run_all`.
+        jitter: Fraction of the interval by which runs are spread out.
+        logger: Logger of the task failures.
+    """
+
+    def __init__(self, db_instance, enabled: bool = True, jitter: float = 0.1,
+                 logger: Optional[logging.Logger] = None):
+        self.db_instance = db_instance
+        self.enabled = enabled
+        self.jitter = jitter
+        self.logger = logger or logging.getLogger(__name__)
+        self.tasks = {}
+
+        self._lock = threading.Lock()
+        self._thread = ProcessLocalThread(self._schedule, "maintenance")
+        self._stopped = threading.Event()
+
+    def add(self, name: str, run: Callable, interval: float):
+        """Schedule `run(db_instance)` every `interval` seconds. 0 disables it."""
+        self.tasks[name] = MaintenanceTask(name, run, interval)
+
+    def ensure_running(self):
+        if self.enabled:
+            self._thread.ensure_started()
+
+    def close(self):
+        self._stopped.set()
+
+    def run(self, name: str):
+        """
+        Run the task now and return its result, or None when it is already
+        running in another worker.
+        """
+        task = self.tasks[name]
+        lock_key = list(self.tasks).index(name)
+        with self.db_instance.get_conn() as lock_conn:
+            with lock_conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s, %s);",
+                            (MAINTENANCE_LOCK_CLASS, lock_key))
+                locked = cur.fetchone()[0]
+            lock_conn.commit()
+            if not locked:
+                with self._lock:
+                    task.skips += 1
+                return None
+            try:
+                return self._run_locked(task)
+            finally:
+                with lock_conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s, %s);",
+                                (MAINTENANCE_LOCK_CLASS, lock_key))
+                lock_conn.commit()
+
+    def _run_locked(self, task: MaintenanceTask):
+        started = time.monotonic()
+        with self._lock:
+            task.last_started_at = time.time()
+        try:
+            result = task.run(self.db_instance)
+        except Exception as e:
+            with self._lock:
+                task.failures += 1
+                task.last_duration = time.monotonic() - started
+                task.last_error = repr(e)
+            raise
+        with self._lock:
+            task.runs += 1
+            task.last_duration = time.monotonic() - started
+            task.last_result = result
+            task.last_error = None
+        return result
+
+    def run_all(self) -> dict:
+        """Run every task now, returning their results by name."""
+        return {name: self.run(name) for name in self.tasks}
+
+    def _next_delay(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _schedule(self):
+        # The first runs are spread over the first tenth of the interval
+        # rather than all waiting a whole interval after startup.
+        now = time.monotonic()
+        due = {name: now + task.interval * random.uniform(0, self.jitter)
+               for name, task in self.tasks.items() if task.interval > 0}
+        while due and not self._stopped.is_set():
+            name = min(due, key=due.get)
+            if self._stopped.wait(max(due[name] - time.monotonic(), 0)):
+                return
+            try:
+                self.run(name)
+            except Exception as e:
+                self.logger.error(f"Maintenance task {name} failed: {str(e)}")
+            due[name] = time.monotonic() + self._next_delay(self.tasks[name].interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "running": self._thread.running,
+                "tasks": {name: task.stats() for name, task in self.tasks.items()},
+            }
+
+
+def token_partition_ahead_days() -> int:
+    """
+    Days of token_blacklist partitions created ahead: enough for the longest
+    lived tokens, with a couple of days to spare should maintenance not run
+    for a while.
+    """
+    token_lifetime_days = max(
+        int(os.getenv("INF6150_JWT_EXPIRATION_DAYS", "1")),
+        int(os.getenv("INF6150_JWT_REFRESH_EXPIRATION_DAYS", "30")))
+    return int(os.getenv("INF6150_MAINTENANCE_TOKEN_PARTITION_AHEAD_DAYS",
+                         str(token_lifetime_days + 2)))
+
+
+def create_maintenance_scheduler(db_instance, logger: Optional[logging.Logger] = None) -> MaintenanceScheduler:
+    """Maintenance scheduler configured by the INF6150_MAINTENANCE* variables."""
+    scheduler = MaintenanceScheduler(
+        db_instance,
+        enabled=os.getenv("INF6150_MAINTENANCE", 'True').lower() in ('true', '1', 't'),
+        logger=logger)
+
+    scheduler.add(
+        "token_purge",
+        partial(purge_expired_tokens, batch_size=int(
+            os.getenv("INF6150_MAINTENANCE_TOKEN_PURGE_BATCH", "1000"))),
+        float(os.getenv("INF6150_MAINTENANCE_TOKEN_PURGE_INTERVAL", "3600")))
+
+    scheduler.add(
+        "token_partitions",
+        partial(maintain_token_partitions, ahead_days=token_partition_ahead_days()),
+        float(os.getenv("INF6150_MAINTENANCE_TOKEN_PARTITION_INTERVAL", "3600")))
+    return scheduler
@@ -0,0 +1,1220 @@
+import hashlib
+import re
+import time
+import psycopg2.extensions
+from .schemas import CREATE_SCHEMA_VERSION_TABLE
+
+# Arbitrary key of the advisory lock serializing concurrent `db migrate` runs
+# (e.g. several containers starting at once).
+MIGRATION_LOCK_KEY = 61500001
+
+# A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind, which
+# IF NOT EXISTS would then happily skip.
+SELECT_INVALID_INDEX = """
+SELECT 1 FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE c.relname = %s AND NOT i.indisvalid;
+"""
+
+
+class MigrationError(Exception):
+    """Raised when the applied migrations don't match the known ones."""
+
+
+class Migration:
+    """
+    A schema change, applied at most once and recorded in schema_version.
+
+    Transactional migrations run all their statements in one transaction.
+    Non-transactional ones run each statement on its own in autocommit mode,
+    which `CREATE INDEX CONCURRENTLY` requires, and must therefore be
+    idempotent statement by statement.
+
+    A migration requiring an optional `extension` is left pending while the
+    extension can't be created, and tried again on the next run.
+    """
+
+    def __init__(self, version: int, name: str, statements: list[str], transactional: bool = True,
+                 extension: str = None):
+        self.version = version
+        self.name = name
+        self.statements = statements
+        self.transactional = transactional
+        self.extension = extension
+
+    @property
+    def checksum(self) -> str:
+        content = "\n".join(statement.strip() for statement in self.statements)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _index_name(statement: str):
+    match = re.match(
+        r"^\s*CREATE INDEX CONCURRENTLY IF NOT EXISTS\s+(\w+)", statement)
+    return match.group(1) if match else None
+
+
+# Never edit or reorder an applied migration: add a new one instead. The
+# checksum check refuses to run against a database whose history differs.
+# The statements are written out in full rather than taken from schemas.py,
+# so that editing a query there can't change the text of an applied
+# migration.
+MIGRATIONS = [
+    Migration(1, "baseline", [
+        """
+CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+""",
+        """
+DO $$
+BEGIN
+    CREATE TYPE USER_TYPE AS ENUM ('ADMIN', 'PATIENT', 'DOCTOR', 'HEALTHCARE PROFESSIONAL', 'PARENT');
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END
+$$;
+""",
+        """
+CREATE TABLE IF NOT EXISTS establishments (
+    establishment_id        UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    establishment_name      TEXT NOT NULL,
+    created_at              TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    hidden                  BOOL DEFAULT FALSE
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS users (
+    unique_id               SERIAL PRIMARY KEY,
+    user_id                 UUID NOT NULL DEFAULT uuid_generate_v4(),
+    medical_insurance_id    TEXT,
+    login                   TEXT NOT NULL DEFAULT '',
+    password_hash           TEXT NOT NULL DEFAULT '',
+    user_type               USER_TYPE NOT NULL DEFAULT 'PARENT',
+    first_name              TEXT NOT NULL,
+    last_name               TEXT NOT NULL,
+    phone_number            TEXT NOT NULL,
+    email                   TEXT NOT NULL,
+    gender                  TEXT,
+    city_of_birth           TEXT,
+    date_of_birth           DATE,
+    hidden                  BOOL DEFAULT FALSE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    modified_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS coordinates (
+    unique_id           SERIAL PRIMARY KEY,
+    coordinate_id       UUID NOT NULL DEFAULT uuid_generate_v4(),
+    user_id             UUID NOT NULL,
+    street_address      TEXT NOT NULL,
+    apartment           TEXT,
+    postal_code         TEXT NOT NULL,
+    city                TEXT NOT NULL,
+    country             TEXT NOT NULL,
+    created_at          TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    modified_at         TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    hidden              BOOL DEFAULT FALSE
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS medical_history (
+    unique_id           SERIAL PRIMARY KEY,
+    history_id          UUID NOT NULL DEFAULT uuid_generate_v4(),
+    patient_id          TEXT NOT NULL,
+    diagnostic          TEXT NOT NULL,
+    treatment           TEXT NOT NULL,
+    doctor_id           UUID NOT NULL,
+    start_date          DATE,
+    end_date            DATE,
+    created_at          TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    modified_at         TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    hidden              BOOL DEFAULT FALSE
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS medical_visits (
+    unique_id               SERIAL PRIMARY KEY,
+    visit_id                UUID NOT NULL DEFAULT uuid_generate_v4(),
+    patient_id              TEXT NOT NULL,
+    establishment_id        UUID NOT NULL,
+    doctor_id               UUID NOT NULL,
+    visit_date              TIMESTAMP WITH TIME ZONE,
+    diagnostic_established  TEXT,
+    treatment               TEXT,
+    visit_summary           TEXT NOT NULL,
+    notes                   TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    modified_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    hidden                  BOOL DEFAULT FALSE,
+    FOREIGN KEY (establishment_id) REFERENCES establishments(establishment_id)
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS parents (
+    parent_id       UUID NOT NULL,
+    child_id        UUID NOT NULL,
+    hidden          BOOL DEFAULT FALSE,
+
+    PRIMARY KEY(parent_id, child_id)
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS token_blacklist (
+    id              SERIAL PRIMARY KEY,
+    jti             VARCHAR(36) NOT NULL UNIQUE,
+    token_type      VARCHAR(10) NOT NULL,
+    user_id         UUID NOT NULL,
+    revoked_at      TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at      TIMESTAMP WITH TIME ZONE NOT NULL,
+    hidden          BOOL DEFAULT FALSE
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS mfa_config (
+    user_id         UUID PRIMARY KEY,
+    secret          TEXT NOT NULL,
+    enabled         BOOLEAN DEFAULT FALSE,
+    created_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    modified_at     TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    backup_codes    TEXT[] DEFAULT ARRAY[]::TEXT[],
+    hidden          BOOLEAN DEFAULT FALSE
+);
+""",
+    ]),
+    Migration(2, "current_tables", [
+        """
+CREATE TABLE IF NOT EXISTS users_current (
+    user_id                 UUID PRIMARY KEY,
+    unique_id               INTEGER NOT NULL,
+    medical_insurance_id    TEXT,
+    login                   TEXT NOT NULL,
+    password_hash           TEXT NOT NULL,
+    user_type               USER_TYPE NOT NULL,
+    first_name              TEXT NOT NULL,
+    last_name               TEXT NOT NULL,
+    phone_number            TEXT NOT NULL,
+    email                   TEXT NOT NULL,
+    gender                  TEXT,
+    city_of_birth           TEXT,
+    date_of_birth           DATE,
+    hidden                  BOOL,
+    created_at              TIMESTAMP WITH TIME ZONE,
+    modified_at             TIMESTAMP WITH TIME ZONE
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS coordinates_current (
+    coordinate_id       UUID PRIMARY KEY,
+    unique_id           INTEGER NOT NULL,
+    user_id             UUID NOT NULL,
+    street_address      TEXT NOT NULL,
+    apartment           TEXT,
+    postal_code         TEXT NOT NULL,
+    city                TEXT NOT NULL,
+    country             TEXT NOT NULL,
+    created_at          TIMESTAMP WITH TIME ZONE,
+    modified_at         TIMESTAMP WITH TIME ZONE,
+    hidden              BOOL
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS medical_history_current (
+    history_id          UUID PRIMARY KEY,
+    unique_id           INTEGER NOT NULL,
+    patient_id          TEXT NOT NULL,
+    diagnostic          TEXT NOT NULL,
+    treatment           TEXT NOT NULL,
+    doctor_id           UUID NOT NULL,
+    start_date          DATE,
+    end_date            DATE,
+    created_at          TIMESTAMP WITH TIME ZONE,
+    modified_at         TIMESTAMP WITH TIME ZONE,
+    hidden              BOOL
+);
+""",
+        """
+CREATE TABLE IF NOT EXISTS medical_visits_current (
+    visit_id                UUID PRIMARY KEY,
+    unique_id               INTEGER NOT NULL,
+    patient_id              TEXT NOT NULL,
+    establishment_id        UUID NOT NULL,
+    doctor_id               UUID NOT NULL,
+    visit_date              TIMESTAMP WITH TIME ZONE,
+    diagnostic_established  TEXT,
+    treatment               TEXT,
+    visit_summary           TEXT NOT NULL,
+    notes                   TEXT,
+    created_at              TIMESTAMP WITH TIME ZONE,
+    modified_at             TIMESTAMP WITH TIME ZONE,
+    hidden                  BOOL
+);
+""",
+        """
+CREATE OR REPLACE FUNCTION sync_users_current() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO users_current (
+        user_id, unique_id, medical_insurance_id, login, password_hash,
+        user_type, first_name, last_name, phone_number, email, gender,
+        city_of_birth, date_of_birth, hidden, created_at, modified_at
+    )
+    VALUES (
+        NEW.user_id, NEW.unique_id, NEW.medical_insurance_id, NEW.login,
+        NEW.password_hash, NEW.user_type, NEW.first_name, NEW.last_name,
+        NEW.phone_number, NEW.email, NEW.gender, NEW.city_of_birth,
+        NEW.date_of_birth, NEW.hidden, NEW.created_at, NEW.modified_at
+    )
+    ON CONFLICT (user_id) DO UPDATE SET
+        unique_id = EXCLUDED.unique_id,
+        medical_insurance_id = COALESCE(EXCLUDED.medical_insurance_id,
+                                        users_current.medical_insurance_id),
+        login = EXCLUDED.login,
+        password_hash = EXCLUDED.password_hash,
+        user_type = EXCLUDED.user_type,
+        first_name = EXCLUDED.first_name,
+        last_name = EXCLUDED.last_name,
+        phone_number = EXCLUDED.phone_number,
+        email = EXCLUDED.email,
+        gender = EXCLUDED.gender,
+        city_of_birth = EXCLUDED.city_of_birth,
+        date_of_birth = EXCLUDED.date_of_birth,
+        hidden = EXCLUDED.hidden,
+        created_at = EXCLUDED.created_at,
+        modified_at = EXCLUDED.modified_at
+    WHERE users_current.unique_id <= EXCLUDED.unique_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE FUNCTION sync_coordinates_current() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO coordinates_current (
+        coordinate_id, unique_id, user_id, street_address, apartment,
+        postal_code, city, country, created_at, modified_at, hidden
+    )
+    VALUES (
+        NEW.coordinate_id, NEW.unique_id, NEW.user_id, NEW.street_address,
+        NEW.apartment, NEW.postal_code, NEW.city, NEW.country,
+        NEW.created_at, NEW.modified_at, NEW.hidden
+    )
+    ON CONFLICT (coordinate_id) DO UPDATE SET
+        unique_id = EXCLUDED.unique_id,
+        user_id = EXCLUDED.user_id,
+        street_address = EXCLUDED.street_address,
+        apartment = EXCLUDED.apartment,
+        postal_code = EXCLUDED.postal_code,
+        city = EXCLUDED.city,
+        country = EXCLUDED.country,
+        created_at = EXCLUDED.created_at,
+        modified_at = EXCLUDED.modified_at,
+        hidden = EXCLUDED.hidden
+    WHERE coordinates_current.unique_id <= EXCLUDED.unique_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE FUNCTION sync_medical_history_current() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO medical_history_current (
+        history_id, unique_id, patient_id, diagnostic, treatment, doctor_id,
+        start_date, end_date, created_at, modified_at, hidden
+    )
+    VALUES (
+        NEW.history_id, NEW.unique_id, NEW.patient_id, NEW.diagnostic,
+        NEW.treatment, NEW.doctor_id, NEW.start_date, NEW.end_date,
+        NEW.created_at, NEW.modified_at, NEW.hidden
+    )
+    ON CONFLICT (history_id) DO UPDATE SET
+        unique_id = EXCLUDED.unique_id,
+        patient_id = EXCLUDED.patient_id,
+        diagnostic = EXCLUDED.diagnostic,
+        treatment = EXCLUDED.treatment,
+        doctor_id = EXCLUDED.doctor_id,
+        start_date = EXCLUDED.start_date,
+        end_date = EXCLUDED.end_date,
+        created_at = EXCLUDED.created_at,
+        modified_at = EXCLUDED.modified_at,
+        hidden = EXCLUDED.hidden
+    WHERE medical_history_current.unique_id <= EXCLUDED.unique_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE FUNCTION sync_medical_visits_current() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO medical_visits_current (
+        visit_id, unique_id, patient_id, establishment_id, doctor_id,
+        visit_date, diagnostic_established, treatment, visit_summary, notes,
+        created_at, modified_at, hidden
+    )
+    VALUES (
+        NEW.visit_id, NEW.unique_id, NEW.patient_id, NEW.establishment_id,
+        NEW.doctor_id, NEW.visit_date, NEW.diagnostic_established,
+        NEW.treatment, NEW.visit_summary, NEW.notes, NEW.created_at,
+        NEW.modified_at, NEW.hidden
+    )
+    ON CONFLICT (visit_id) DO UPDATE SET
+        unique_id = EXCLUDED.unique_id,
+        patient_id = EXCLUDED.patient_id,
+        establishment_id = EXCLUDED.establishment_id,
+        doctor_id = EXCLUDED.doctor_id,
+        visit_date = EXCLUDED.visit_date,
+        diagnostic_established = EXCLUDED.diagnostic_established,
+        treatment = EXCLUDED.treatment,
+        visit_summary = EXCLUDED.visit_summary,
+        notes = EXCLUDED.notes,
+        created_at = EXCLUDED.created_at,
+        modified_at = EXCLUDED.modified_at,
+        hidden = EXCLUDED.hidden
+    WHERE medical_visits_current.unique_id <= EXCLUDED.unique_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE TRIGGER users_current_sync
+AFTER INSERT OR UPDATE ON users
+FOR EACH ROW EXECUTE FUNCTION sync_users_current();
+""",
+        """
+CREATE OR REPLACE TRIGGER coordinates_current_sync
+AFTER INSERT OR UPDATE ON coordinates
+FOR EACH ROW EXECUTE FUNCTION sync_coordinates_current();
+""",
+        """
+CREATE OR REPLACE TRIGGER medical_history_current_sync
+AFTER INSERT OR UPDATE ON medical_history
+FOR EACH ROW EXECUTE FUNCTION sync_medical_history_current();
+""",
+        """
+CREATE OR REPLACE TRIGGER medical_visits_current_sync
+AFTER INSERT OR UPDATE ON medical_visits
+FOR EACH ROW EXECUTE FUNCTION sync_medical_visits_current();
+""",
+        """
+TRUNCATE users_current;
+INSERT INTO users_current (
+    user_id, unique_id, medical_insurance_id, login, password_hash,
+    user_type, first_name, last_name, phone_number, email, gender,
+    city_of_birth, date_of_birth, hidden, created_at, modified_at
+)
+SELECT DISTINCT ON (u.user_id)
+    u.user_id, u.unique_id,
+    COALESCE(u.medical_insurance_id, (
+        SELECT medical_insurance_id FROM users previous
+        WHERE previous.user_id = u.user_id
+            AND previous.medical_insurance_id IS NOT NULL
+        ORDER BY previous.unique_id DESC
+        LIMIT 1
+    )),
+    u.login, u.password_hash, u.user_type, u.first_name, u.last_name,
+    u.phone_number, u.email, u.gender, u.city_of_birth, u.date_of_birth,
+    u.hidden, u.created_at, u.modified_at
+FROM users u
+ORDER BY u.user_id, u.unique_id DESC;
+""",
+        """
+TRUNCATE coordinates_current;
+INSERT INTO coordinates_current (
+    coordinate_id, unique_id, user_id, street_address, apartment,
+    postal_code, city, country, created_at, modified_at, hidden
+)
+SELECT DISTINCT ON (coordinate_id)
+    coordinate_id, unique_id, user_id, street_address, apartment,
+    postal_code, city, country, created_at, modified_at, hidden
+FROM coordinates
+ORDER BY coordinate_id, unique_id DESC;
+""",
+        """
+TRUNCATE medical_history_current;
+INSERT INTO medical_history_current (
+    history_id, unique_id, patient_id, diagnostic, treatment, doctor_id,
+    start_date, end_date, created_at, modified_at, hidden
+)
+SELECT DISTINCT ON (history_id)
+    history_id, unique_id, patient_id, diagnostic, treatment, doctor_id,
+    start_date, end_date, created_at, modified_at, hidden
+FROM medical_history
+ORDER BY history_id, unique_id DESC;
+""",
+        """
+TRUNCATE medical_visits_current;
+INSERT INTO medical_visits_current (
+    visit_id, unique_id, patient_id, establishment_id, doctor_id,
+    visit_date, diagnostic_established, treatment, visit_summary, notes,
+    created_at, modified_at, hidden
+)
+SELECT DISTINCT ON (visit_id)
+    visit_id, unique_id, patient_id, establishment_id, doctor_id,
+    visit_date, diagnostic_established, treatment, visit_summary, notes,
+    created_at, modified_at, hidden
+FROM medical_visits
+ORDER BY visit_id, unique_id DESC;
+""",
+    ]),
+    Migration(3, "read_path_indexes", [
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_id ON users(user_id, unique_id DESC);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_insurance_id ON users(medical_insurance_id, unique_id DESC);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_coordinate_id ON coordinates(coordinate_id, unique_id DESC);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_coordinates_user_id ON coordinates(user_id, coordinate_id, unique_id DESC);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_history_id ON medical_history(history_id, unique_id DESC);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_history_patient_id ON medical_history(patient_id, history_id, unique_id DESC);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_visit_id ON medical_visits(visit_id, unique_id DESC);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_visits_patient_id ON medical_visits(patient_id, visit_id, unique_id DESC);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parents_child_id ON parents(child_id) INCLUDE (parent_id) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_blacklist ON token_blacklist(user_id);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mfa_user_id ON mfa_config(user_id);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_current_medical_insurance_id ON users_current(medical_insurance_id, unique_id DESC) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_current_email ON users_current(email, modified_at DESC)
+INCLUDE (user_id, login, user_type, password_hash, first_name, last_name, medical_insurance_id)
+WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_current_doctor_name ON users_current(first_name, last_name, user_type, user_id);
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_current_doctors ON users_current(user_id)
+INCLUDE (first_name, last_name, email, phone_number, modified_at)
+WHERE user_type = 'DOCTOR' AND hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_coordinates_current_user_id ON coordinates_current(user_id, coordinate_id) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_history_current_patient_id ON medical_history_current(patient_id, history_id) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_visits_current_patient_id ON medical_visits_current(patient_id, visit_id) WHERE hidden IS NOT TRUE;
+""",
+        """
+DROP INDEX IF EXISTS idx_jti RESTRICT;
+""",
+    ], transactional=False),
+    Migration(4, "version_history_indexes", [
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_modified_at ON users(medical_insurance_id, modified_at, unique_id) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_coordinates_modified_at ON coordinates(user_id, modified_at, unique_id) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_history_modified_at ON medical_history(patient_id, modified_at, unique_id) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_visits_modified_at ON medical_visits(patient_id, modified_at, unique_id) WHERE hidden IS NOT TRUE;
+""",
+    ], transactional=False),
+    Migration(5, "valid_periods", [
+        """
+ALTER TABLE users ADD COLUMN IF NOT EXISTS valid_period TSTZRANGE;
+""",
+        """
+ALTER TABLE coordinates ADD COLUMN IF NOT EXISTS valid_period TSTZRANGE;
+""",
+        """
+ALTER TABLE medical_history ADD COLUMN IF NOT EXISTS valid_period TSTZRANGE;
+""",
+        """
+ALTER TABLE medical_visits ADD COLUMN IF NOT EXISTS valid_period TSTZRANGE;
+""",
+        """
+CREATE OR REPLACE FUNCTION set_users_valid_period() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.valid_period := tstzrange(NEW.modified_at, NULL, '[)');
+    UPDATE users
+    SET valid_period = tstzrange(lower(valid_period),
+                                 GREATEST(lower(valid_period), NEW.modified_at), '[)')
+    WHERE unique_id = (
+        SELECT unique_id FROM users
+        WHERE user_id = NEW.user_id AND unique_id < NEW.unique_id
+        ORDER BY unique_id DESC
+        LIMIT 1
+    ) AND upper_inf(valid_period);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE FUNCTION set_coordinates_valid_period() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.valid_period := tstzrange(NEW.modified_at, NULL, '[)');
+    UPDATE coordinates
+    SET valid_period = tstzrange(lower(valid_period),
+                                 GREATEST(lower(valid_period), NEW.modified_at), '[)')
+    WHERE unique_id = (
+        SELECT unique_id FROM coordinates
+        WHERE coordinate_id = NEW.coordinate_id AND unique_id < NEW.unique_id
+        ORDER BY unique_id DESC
+        LIMIT 1
+    ) AND upper_inf(valid_period);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE FUNCTION set_medical_history_valid_period() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.valid_period := tstzrange(NEW.modified_at, NULL, '[)');
+    UPDATE medical_history
+    SET valid_period = tstzrange(lower(valid_period),
+                                 GREATEST(lower(valid_period), NEW.modified_at), '[)')
+    WHERE unique_id = (
+        SELECT unique_id FROM medical_history
+        WHERE history_id = NEW.history_id AND unique_id < NEW.unique_id
+        ORDER BY unique_id DESC
+        LIMIT 1
+    ) AND upper_inf(valid_period);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE FUNCTION set_medical_visits_valid_period() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.valid_period := tstzrange(NEW.modified_at, NULL, '[)');
+    UPDATE medical_visits
+    SET valid_period = tstzrange(lower(valid_period),
+                                 GREATEST(lower(valid_period), NEW.modified_at), '[)')
+    WHERE unique_id = (
+        SELECT unique_id FROM medical_visits
+        WHERE visit_id = NEW.visit_id AND unique_id < NEW.unique_id
+        ORDER BY unique_id DESC
+        LIMIT 1
+    ) AND upper_inf(valid_period);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE TRIGGER users_valid_period
+BEFORE INSERT ON users
+FOR EACH ROW EXECUTE FUNCTION set_users_valid_period();
+""",
+        """
+CREATE OR REPLACE TRIGGER coordinates_valid_period
+BEFORE INSERT ON coordinates
+FOR EACH ROW EXECUTE FUNCTION set_coordinates_valid_period();
+""",
+        """
+CREATE OR REPLACE TRIGGER medical_history_valid_period
+BEFORE INSERT ON medical_history
+FOR EACH ROW EXECUTE FUNCTION set_medical_history_valid_period();
+""",
+        """
+CREATE OR REPLACE TRIGGER medical_visits_valid_period
+BEFORE INSERT ON medical_visits
+FOR EACH ROW EXECUTE FUNCTION set_medical_visits_valid_period();
+""",
+    ]),
+    Migration(6, "row_versions", [
+        """
+CREATE SEQUENCE IF NOT EXISTS row_version_seq;
+""",
+        """
+ALTER TABLE users_current ADD COLUMN IF NOT EXISTS row_version BIGINT;
+ALTER TABLE users_current ALTER COLUMN row_version SET DEFAULT nextval('row_version_seq');
+""",
+        """
+ALTER TABLE coordinates_current ADD COLUMN IF NOT EXISTS row_version BIGINT;
+ALTER TABLE coordinates_current ALTER COLUMN row_version SET DEFAULT nextval('row_version_seq');
+""",
+        """
+ALTER TABLE medical_history_current ADD COLUMN IF NOT EXISTS row_version BIGINT;
+ALTER TABLE medical_history_current ALTER COLUMN row_version SET DEFAULT nextval('row_version_seq');
+""",
+        """
+ALTER TABLE medical_visits_current ADD COLUMN IF NOT EXISTS row_version BIGINT;
+ALTER TABLE medical_visits_current ALTER COLUMN row_version SET DEFAULT nextval('row_version_seq');
+""",
+        """
+ALTER TABLE parents ADD COLUMN IF NOT EXISTS row_version BIGINT;
+ALTER TABLE parents ALTER COLUMN row_version SET DEFAULT nextval('row_version_seq');
+""",
+        """
+ALTER TABLE establishments ADD COLUMN IF NOT EXISTS row_version BIGINT;
+ALTER TABLE establishments ALTER COLUMN row_version SET DEFAULT nextval('row_version_seq');
+""",
+        """
+CREATE OR REPLACE FUNCTION set_row_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.row_version := nextval('row_version_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE TRIGGER users_current_row_version
+BEFORE INSERT OR UPDATE ON users_current
+FOR EACH ROW EXECUTE FUNCTION set_row_version();
+""",
+        """
+CREATE OR REPLACE TRIGGER coordinates_current_row_version
+BEFORE INSERT OR UPDATE ON coordinates_current
+FOR EACH ROW EXECUTE FUNCTION set_row_version();
+""",
+        """
+CREATE OR REPLACE TRIGGER medical_history_current_row_version
+BEFORE INSERT OR UPDATE ON medical_history_current
+FOR EACH ROW EXECUTE FUNCTION set_row_version();
+""",
+        """
+CREATE OR REPLACE TRIGGER medical_visits_current_row_version
+BEFORE INSERT OR UPDATE ON medical_visits_current
+FOR EACH ROW EXECUTE FUNCTION set_row_version();
+""",
+        """
+CREATE OR REPLACE TRIGGER parents_row_version
+BEFORE INSERT OR UPDATE ON parents
+FOR EACH ROW EXECUTE FUNCTION set_row_version();
+""",
+        """
+CREATE OR REPLACE TRIGGER establishments_row_version
+BEFORE INSERT OR UPDATE ON establishments
+FOR EACH ROW EXECUTE FUNCTION set_row_version();
+""",
+    ]),
+    Migration(7, "token_revoked_notify", [
+        """
+CREATE OR REPLACE FUNCTION notify_token_revoked() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('token_revoked', json_build_object(
+        'jti', NEW.jti,
+        'expires_at', EXTRACT(EPOCH FROM NEW.expires_at)
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE TRIGGER token_blacklist_notify
+AFTER INSERT ON token_blacklist
+FOR EACH ROW EXECUTE FUNCTION notify_token_revoked();
+""",
+    ]),
+    Migration(8, "token_generations", [
+        """
+CREATE TABLE IF NOT EXISTS token_generations (
+    user_id         UUID PRIMARY KEY,
+    generation      BIGINT NOT NULL DEFAULT 0,
+    updated_at      TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+""",
+        """
+CREATE OR REPLACE FUNCTION notify_token_generation() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('token_generation', json_build_object(
+        'user_id', NEW.user_id,
+        'generation', NEW.generation
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE TRIGGER token_generations_notify
+AFTER INSERT OR UPDATE ON token_generations
+FOR EACH ROW EXECUTE FUNCTION notify_token_generation();
+""",
+    ]),
+    Migration(9, "token_blacklist_expiry_index", [
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_token_blacklist_expires_at ON token_blacklist(expires_at);
+""",
+    ], transactional=False),
+    # The periods of the versions written before migration 5. Each backfilled
+    # version fires the *_current triggers, hence the batches of unique_id
+    # ranges, each committed on its own.
+    Migration(10, "valid_period_backfill", [
+        """
+DO $$
+DECLARE
+    batch_start BIGINT;
+    batch_end BIGINT;
+    last_id BIGINT;
+BEGIN
+    SELECT MIN(unique_id), MAX(unique_id) INTO batch_start, last_id FROM users;
+    WHILE batch_start <= last_id LOOP
+        batch_end := batch_start + 5000;
+        UPDATE users t
+SET valid_period = periods.valid_period
+FROM (
+    SELECT
+        unique_id,
+        tstzrange(modified_at, CASE WHEN next_modified_at IS NOT NULL
+                                    THEN GREATEST(modified_at, next_modified_at) END, '[)') AS valid_period
+    FROM (
+        SELECT unique_id, modified_at,
+               LEAD(modified_at) OVER (PARTITION BY user_id ORDER BY unique_id) AS next_modified_at
+        FROM users
+        WHERE user_id IN (
+            SELECT user_id FROM users
+            WHERE unique_id >= batch_start AND unique_id < batch_end
+        )
+    ) versions
+) periods
+WHERE t.unique_id = periods.unique_id
+    AND t.unique_id >= batch_start AND t.unique_id < batch_end
+    AND t.valid_period IS DISTINCT FROM periods.valid_period;
+        COMMIT;
+        batch_start := batch_end;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+DECLARE
+    batch_start BIGINT;
+    batch_end BIGINT;
+    last_id BIGINT;
+BEGIN
+    SELECT MIN(unique_id), MAX(unique_id) INTO batch_start, last_id FROM coordinates;
+    WHILE batch_start <= last_id LOOP
+        batch_end := batch_start + 5000;
+        UPDATE coordinates t
+SET valid_period = periods.valid_period
+FROM (
+    SELECT
+        unique_id,
+        tstzrange(modified_at, CASE WHEN next_modified_at IS NOT NULL
+                                    THEN GREATEST(modified_at, next_modified_at) END, '[)') AS valid_period
+    FROM (
+        SELECT unique_id, modified_at,
+               LEAD(modified_at) OVER (PARTITION BY coordinate_id ORDER BY unique_id) AS next_modified_at
+        FROM coordinates
+        WHERE coordinate_id IN (
+            SELECT coordinate_id FROM coordinates
+            WHERE unique_id >= batch_start AND unique_id < batch_end
+        )
+    ) versions
+) periods
+WHERE t.unique_id = periods.unique_id
+    AND t.unique_id >= batch_start AND t.unique_id < batch_end
+    AND t.valid_period IS DISTINCT FROM periods.valid_period;
+        COMMIT;
+        batch_start := batch_end;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+DECLARE
+    batch_start BIGINT;
+    batch_end BIGINT;
+    last_id BIGINT;
+BEGIN
+    SELECT MIN(unique_id), MAX(unique_id) INTO batch_start, last_id FROM medical_history;
+    WHILE batch_start <= last_id LOOP
+        batch_end := batch_start + 5000;
+        UPDATE medical_history t
+SET valid_period = periods.valid_period
+FROM (
+    SELECT
+        unique_id,
+        tstzrange(modified_at, CASE WHEN next_modified_at IS NOT NULL
+                                    THEN GREATEST(modified_at, next_modified_at) END, '[)') AS valid_period
+    FROM (
+        SELECT unique_id, modified_at,
+               LEAD(modified_at) OVER (PARTITION BY history_id ORDER BY unique_id) AS next_modified_at
+        FROM medical_history
+        WHERE history_id IN (
+            SELECT history_id FROM medical_history
+            WHERE unique_id >= batch_start AND unique_id < batch_end
+        )
+    ) versions
+) periods
+WHERE t.unique_id = periods.unique_id
+    AND t.unique_id >= batch_start AND t.unique_id < batch_end
+    AND t.valid_period IS DISTINCT FROM periods.valid_period;
+        COMMIT;
+        batch_start := batch_end;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+DECLARE
+    batch_start BIGINT;
+    batch_end BIGINT;
+    last_id BIGINT;
+BEGIN
+    SELECT MIN(unique_id), MAX(unique_id) INTO batch_start, last_id FROM medical_visits;
+    WHILE batch_start <= last_id LOOP
+        batch_end := batch_start + 5000;
+        UPDATE medical_visits t
+SET valid_period = periods.valid_period
+FROM (
+    SELECT
+        unique_id,
+        tstzrange(modified_at, CASE WHEN next_modified_at IS NOT NULL
+                                    THEN GREATEST(modified_at, next_modified_at) END, '[)') AS valid_period
+    FROM (
+        SELECT unique_id, modified_at,
+               LEAD(modified_at) OVER (PARTITION BY visit_id ORDER BY unique_id) AS next_modified_at
+        FROM medical_visits
+        WHERE visit_id IN (
+            SELECT visit_id FROM medical_visits
+            WHERE unique_id >= batch_start AND unique_id < batch_end
+        )
+    ) versions
+) periods
+WHERE t.unique_id = periods.unique_id
+    AND t.unique_id >= batch_start AND t.unique_id < batch_end
+    AND t.valid_period IS DISTINCT FROM periods.valid_period;
+        COMMIT;
+        batch_start := batch_end;
+    END LOOP;
+END
+$$;
+""",
+    ], transactional=False),
+    Migration(11, "valid_period_indexes", [
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_valid_period ON users USING gist (user_id, valid_period) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_coordinates_valid_period ON coordinates USING gist (user_id, valid_period) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_history_valid_period ON medical_history USING gist (patient_id, valid_period) WHERE hidden IS NOT TRUE;
+""",
+        """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_visits_valid_period ON medical_visits USING gist (patient_id, valid_period) WHERE hidden IS NOT TRUE;
+""",
+    ], transactional=False, extension="btree_gist"),
+    # Rows from before migration 6, in batches of pages for the tables
+    # without an integer key, then the check that none is left without a
+    # row version.
+    Migration(12, "row_version_backfill", [
+        """
+DO $$
+DECLARE
+    page BIGINT := 0;
+    last_page BIGINT;
+    batch_start TID;
+    batch_end TID;
+BEGIN
+    last_page := pg_relation_size('users_current') / current_setting('block_size')::BIGINT;
+    WHILE page <= last_page LOOP
+        batch_start := format('(%s,0)', page)::TID;
+        batch_end := format('(%s,0)', page + 100)::TID;
+        UPDATE users_current SET row_version = nextval('row_version_seq') WHERE ctid >= batch_start AND ctid < batch_end AND row_version IS NULL;
+        COMMIT;
+        page := page + 100;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+DECLARE
+    page BIGINT := 0;
+    last_page BIGINT;
+    batch_start TID;
+    batch_end TID;
+BEGIN
+    last_page := pg_relation_size('coordinates_current') / current_setting('block_size')::BIGINT;
+    WHILE page <= last_page LOOP
+        batch_start := format('(%s,0)', page)::TID;
+        batch_end := format('(%s,0)', page + 100)::TID;
+        UPDATE coordinates_current SET row_version = nextval('row_version_seq') WHERE ctid >= batch_start AND ctid < batch_end AND row_version IS NULL;
+        COMMIT;
+        page := page + 100;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+DECLARE
+    page BIGINT := 0;
+    last_page BIGINT;
+    batch_start TID;
+    batch_end TID;
+BEGIN
+    last_page := pg_relation_size('medical_history_current') / current_setting('block_size')::BIGINT;
+    WHILE page <= last_page LOOP
+        batch_start := format('(%s,0)', page)::TID;
+        batch_end := format('(%s,0)', page + 100)::TID;
+        UPDATE medical_history_current SET row_version = nextval('row_version_seq') WHERE ctid >= batch_start AND ctid < batch_end AND row_version IS NULL;
+        COMMIT;
+        page := page + 100;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+DECLARE
+    page BIGINT := 0;
+    last_page BIGINT;
+    batch_start TID;
+    batch_end TID;
+BEGIN
+    last_page := pg_relation_size('medical_visits_current') / current_setting('block_size')::BIGINT;
+    WHILE page <= last_page LOOP
+        batch_start := format('(%s,0)', page)::TID;
+        batch_end := format('(%s,0)', page + 100)::TID;
+        UPDATE medical_visits_current SET row_version = nextval('row_version_seq') WHERE ctid >= batch_start AND ctid < batch_end AND row_version IS NULL;
+        COMMIT;
+        page := page + 100;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+DECLARE
+    page BIGINT := 0;
+    last_page BIGINT;
+    batch_start TID;
+    batch_end TID;
+BEGIN
+    last_page := pg_relation_size('parents') / current_setting('block_size')::BIGINT;
+    WHILE page <= last_page LOOP
+        batch_start := format('(%s,0)', page)::TID;
+        batch_end := format('(%s,0)', page + 100)::TID;
+        UPDATE parents SET row_version = nextval('row_version_seq') WHERE ctid >= batch_start AND ctid < batch_end AND row_version IS NULL;
+        COMMIT;
+        page := page + 100;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+DECLARE
+    page BIGINT := 0;
+    last_page BIGINT;
+    batch_start TID;
+    batch_end TID;
+BEGIN
+    last_page := pg_relation_size('establishments') / current_setting('block_size')::BIGINT;
+    WHILE page <= last_page LOOP
+        batch_start := format('(%s,0)', page)::TID;
+        batch_end := format('(%s,0)', page + 100)::TID;
+        UPDATE establishments SET row_version = nextval('row_version_seq') WHERE ctid >= batch_start AND ctid < batch_end AND row_version IS NULL;
+        COMMIT;
+        page := page + 100;
+    END LOOP;
+END
+$$;
+""",
+        """
+DO $$
+BEGIN
+    ALTER TABLE users_current ADD CONSTRAINT users_current_row_version_not_null CHECK (row_version IS NOT NULL) NOT VALID;
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END
+$$;
+""",
+        """
+ALTER TABLE users_current VALIDATE CONSTRAINT users_current_row_version_not_null;
+""",
+        """
+DO $$
+BEGIN
+    ALTER TABLE coordinates_current ADD CONSTRAINT coordinates_current_row_version_not_null CHECK (row_version IS NOT NULL) NOT VALID;
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END
+$$;
+""",
+        """
+ALTER TABLE coordinates_current VALIDATE CONSTRAINT coordinates_current_row_version_not_null;
+""",
+        """
+DO $$
+BEGIN
+    ALTER TABLE medical_history_current ADD CONSTRAINT medical_history_current_row_version_not_null CHECK (row_version IS NOT NULL) NOT VALID;
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END
+$$;
+""",
+        """
+ALTER TABLE medical_history_current VALIDATE CONSTRAINT medical_history_current_row_version_not_null;
+""",
+        """
+DO $$
+BEGIN
+    ALTER TABLE medical_visits_current ADD CONSTRAINT medical_visits_current_row_version_not_null CHECK (row_version IS NOT NULL) NOT VALID;
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END
+$$;
+""",
+        """
+ALTER TABLE medical_visits_current VALIDATE CONSTRAINT medical_visits_current_row_version_not_null;
+""",
+        """
+DO $$
+BEGIN
+    ALTER TABLE parents ADD CONSTRAINT parents_row_version_not_null CHECK (row_version IS NOT NULL) NOT VALID;
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END
+$$;
+""",
+        """
+ALTER TABLE parents VALIDATE CONSTRAINT parents_row_version_not_null;
+""",
+        """
+DO $$
+BEGIN
+    ALTER TABLE establishments ADD CONSTRAINT establishments_row_version_not_null CHECK (row_version IS NOT NULL) NOT VALID;
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END
+$$;
+""",
+        """
+ALTER TABLE establishments VALIDATE CONSTRAINT establishments_row_version_not_null;
+""",
+    ], transactional=False),
+]
+
+
+def _applied_migrations(cur) -> dict:
+    cur.execute("SELECT version, name, checksum FROM schema_version;")
+    return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+
+def _verify(migrations: list[Migration], applied: dict):
+    known = {migration.version: migration for migration in migrations}
+    for version, (name, checksum) in sorted(applied.items()):
+        migration = known.get(version)
+        if migration is None:
+            raise MigrationError(
+                f"Database has migration {version} ({name}) which this version "
+                "of the application doesn't know about.")
+        if migration.checksum != checksum:
+            raise MigrationError(
+                f"Migration {version} ({name}) was modified after being applied.")
+
+
+def _create_extension(conn, extension: str) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE EXTENSION IF NOT EXISTS {extension};")
+        conn.commit()
+        return True
+    except psycopg2.Error:
+        # Not installed on the server, or not allowed for this role.
+        conn.rollback()
+        return False
+
+
+def _apply(conn, migration: Migration):
+    start = time.monotonic()
+    with conn.cursor() as cur:
+        if migration.transactional:
+            for statement in migration.statements:
+                cur.execute(statement)
+        else:
+            conn.commit()
+            conn.autocommit = True
+            try:
+                for statement in migration.statements:
+                    index_name = _index_name(statement)
+                    if index_name:
+                        cur.execute(SELECT_INVALID_INDEX, (index_name,))
+                        if cur.fetchone():
+                            cur.execute(
+                                f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+                    cur.execute(statement)
+            finally:
+                conn.autocommit = False
+
+        cur.execute("""
+            INSERT INTO schema_version (version, name, checksum, execution_ms)
+            VALUES (%s, %s, %s, %s);
+        """, (
+            migration.version,
+            migration.name,
+            migration.checksum,
+            int((time.monotonic() - start) * 1000)
+        ))
+    conn.commit()
+
+
+def migrate(db_instance, migrations: list[Migration] = None, log: bool = True) -> list[int]:
+    """
+    Apply the pending migrations in order and return their versions.
+
+    Safe to run on every start: already applied migrations are skipped, and
+    a session advisory lock keeps concurrent runs from racing each other.
+    """
+    migrations = sorted(migrations or MIGRATIONS, key=lambda m: m.version)
+    applied_now = []
+
+    with db_instance.get_conn() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(CREATE_SCHEMA_VERSION_TABLE)
+                conn.commit()
+                applied = _applied_migrations(cur)
+            conn.commit()
+            _verify(migrations, applied)
+
+            for migration in migrations:
+                if migration.version in applied:
+                    continue
+                if migration.extension and not _create_extension(conn, migration.extension):
+                    if log:
+                        print(f"Skipping migration {migration.version} ({migration.name}): "
+                              f"the {migration.extension} extension is not available.")
+                    continue
+                if log:
+                    print(f"Applying migration {migration.version} ({migration.name})...")
+                try:
+                    _apply(conn, migration)
+                except Exception:
+                    conn.rollback()
+                    raise
+                applied_now.append(migration.version)
+        finally:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s);",
+                            (MIGRATION_LOCK_KEY,))
+            conn.commit()
+
+    if log:
+        if applied_now:
+            print(f"Applied {len(applied_now)} migration(s).")
+        else:
+            print("Database schema is up to date.")
+    return applied_now
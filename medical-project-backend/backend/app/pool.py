@@ -0,0 +1,259 @@
+import threading
+import time
+from collections import deque
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+
+class PoolTimeoutError(PoolError):
+    """Raised when no connection could be checked out before the timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool.
+
+    Unlike psycopg2's SimpleConnectionPool, checkouts block (up to `timeout`
+    seconds) when every connection is in use instead of failing immediately.
+    Connections are validated on checkout, recycled once older than `max_age`
+    seconds and the pool is pre-warmed with `minconn` connections.
+
+    Args:
+        minconn: Number of connections opened at startup and kept open.
+        maxconn: Maximum number of connections opened at the same time.
+        timeout: Seconds to wait for a free connection before giving up.
+        max_age: Seconds after which a connection is closed and replaced.
+        validate_after: Idle seconds after which a connection is pinged
+            with `SELECT 1` before being handed out.
+        **conn_kwargs: Passed as is to `psycopg2.connect`.
+    """
+
+    def __init__(self,
+                 minconn: int,
+                 maxconn: int,
+                 timeout: float = 30.0,
+                 max_age: float = 1800.0,
+                 validate_after: float = 5.0,
+                 **conn_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(
+                "Invalid pool size: expected 0 <= minconn <= maxconn and maxconn >= 1.")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_age = max_age
+        self.validate_after = validate_after
+        self._conn_kwargs = conn_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._created_at = {}
+        self._released_at = {}
+        self._checked_out_at = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._invalidated = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._checkout_total = 0.0
+        self._checkout_max = 0.0
+        self._in_use_max = 0
+
+        for _ in range(minconn):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append(conn)
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._conn_kwargs)
+        now = time.monotonic()
+        self._created_at[id(conn)] = now
+        self._released_at[id(conn)] = now
+        return conn
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._released_at.pop(id(conn), None)
+        if not conn.closed:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _count(self, counter: str):
+        with self._cond:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _is_expired(self, conn, now: float) -> bool:
+        created_at = self._created_at.get(id(conn), now)
+        return self.max_age > 0 and now - created_at >= self.max_age
+
+    def _is_usable(self, conn, now: float) -> bool:
+        if conn.closed:
+            return False
+
+        status = conn.info.transaction_status
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        idle_for = now - self._released_at.get(id(conn), now)
+        if idle_for < self.validate_after:
+            return True
+
+        try:
+            # A plain cursor is used on purpose so that validation pings are
+            # never mistaken for application queries.
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, timeout: float = None):
+        """
+        Check out a connection, waiting up to `timeout` seconds (the pool
+        default when omitted) for one to be returned by another thread.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {timeout:.1f}s waiting for a "
+                        f"database connection ({self.maxconn} in use).")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        now = time.monotonic()
+        if conn is not None:
+            if self._is_expired(conn, now):
+                self._count("_recycled")
+                self._discard(conn)
+                conn = None
+            elif not self._is_usable(conn, now):
+                self._count("_invalidated")
+                self._discard(conn)
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        now = time.monotonic()
+        waited = now - start
+        with self._cond:
+            self._checked_out_at[id(conn)] = now
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._in_use_max = max(
+                self._in_use_max, len(self._checked_out_at))
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        """
+        Return a connection to the pool. Any transaction left open is rolled
+        back; broken, expired or explicitly closed connections are discarded.
+        """
+        now = time.monotonic()
+        with self._cond:
+            checked_out_at = self._checked_out_at.pop(id(conn), None)
+            if checked_out_at is not None:
+                duration = now - checked_out_at
+                self._checkout_total += duration
+                self._checkout_max = max(self._checkout_max, duration)
+
+        keep = not (close or self._closed or conn.closed)
+        if keep:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._count("_invalidated")
+                keep = False
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    self._count("_invalidated")
+                    keep = False
+
+        if keep and self._is_expired(conn, now):
+            self._count("_recycled")
+            keep = False
+
+        with self._cond:
+            if keep:
+                self._released_at[id(conn)] = now
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+            self._cond.notify()
+
+        if not keep:
+            self._discard(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the pool counters, meant to size the pool from real
+        traffic. Durations are in milliseconds.
+        """
+        with self._cond:
+            checkouts = self._checkouts
+            returned = checkouts - len(self._checked_out_at)
+            return {
+                "size": self._size,
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "idle": len(self._idle),
+                "in_use": len(self._checked_out_at),
+                "in_use_max": self._in_use_max,
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "invalidated": self._invalidated,
+                "wait_ms_avg": (self._wait_total / checkouts * 1000) if checkouts else 0.0,
+                "wait_ms_max": self._wait_max * 1000,
+                "checkout_ms_avg": (self._checkout_total / returned * 1000) if returned else 0.0,
+                "checkout_ms_max": self._checkout_max * 1000,
+            }
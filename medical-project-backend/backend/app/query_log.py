@@ -0,0 +1,115 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+import psycopg2.extensions
+
+# Query log of the request (or `capture_queries` block) being handled, None
+# when nothing is being recorded.
+_current_log: ContextVar = ContextVar("query_log", default=None)
+
+
+class QueryLog:
+    """
+    Statements executed while the log is active, with their duration in
+    seconds and the number of rows they returned or affected.
+
+    Only the statement text is kept, never the parameters: they hold patient
+    data.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def record(self, statement, duration: float, rows: int, executions: int = 1):
+        if isinstance(statement, bytes):
+            statement = statement.decode("utf-8", "replace")
+        self.queries.append({
+            "statement": " ".join(str(statement).split()),
+            "duration": duration,
+            "rows": rows,
+            "executions": executions,
+        })
+
+    @property
+    def count(self) -> int:
+        """Number of statements sent to the server, `executemany` counting each set of parameters."""
+        return sum(query["executions"] for query in self.queries)
+
+    @property
+    def total_time(self) -> float:
+        return sum(query["duration"] for query in self.queries)
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "time_ms": self.total_time * 1000,
+            "queries": [
+                {**query, "duration": query["duration"] * 1000}
+                for query in self.queries
+            ],
+        }
+
+
+def start_query_log():
+    """Start recording the queries of the current context. Returns the token to give to `stop_query_log`."""
+    return _current_log.set(QueryLog())
+
+
+def stop_query_log(token):
+    _current_log.reset(token)
+
+
+def current_query_log():
+    return _current_log.get()
+
+
+@contextmanager
+def capture_queries():
+    """Record the queries executed inside the block: `with capture_queries() as log: ...`."""
+    token = start_query_log()
+    try:
+        yield current_query_log()
+    finally:
+        stop_query_log(token)
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor recording its statements in the active QueryLog, if any.
+
+    Used as the default cursor of the pooled connections. Internal pings and
+    maintenance queries ask for a plain cursor so that they don't count
+    towards the budget of the request that happened to trigger them.
+    """
+
+    def execute(self, query, vars=None):
+        log = _current_log.get()
+        if log is None:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            log.record(query, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        log = _current_log.get()
+        if log is None:
+            return super().executemany(query, vars_list)
+        vars_list = list(vars_list)
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            log.record(query, time.perf_counter() - start, self.rowcount,
+                       executions=len(vars_list))
+
+    def copy_expert(self, sql, file, size=8192):
+        log = _current_log.get()
+        if log is None:
+            return super().copy_expert(sql, file, size)
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            log.record(sql, time.perf_counter() - start, self.rowcount)
@@ -0,0 +1,221 @@
+import json
+import psycopg2.extensions
+
+# The hot read queries of the service modules, with the index each one is
+# expected to use. `params` is a query returning sample parameters taken from
+# the data itself, so the plans are explained with realistic values.
+HOT_QUERIES = [
+    {
+        "name": "patient by medical insurance id",
+        "query": """
+            SELECT * FROM users_current
+            WHERE medical_insurance_id = %s AND hidden IS NOT TRUE
+            ORDER BY unique_id DESC
+            LIMIT 1;
+        """,
+        "params": "SELECT medical_insurance_id FROM users_current WHERE medical_insurance_id IS NOT NULL LIMIT 1;",
+        "expected_index": "idx_users_current_medical_insurance_id",
+    },
+    {
+        "name": "patient coordinates",
+        "query": """
+            SELECT * FROM coordinates_current
+            WHERE user_id = %s AND hidden IS NOT TRUE
+            ORDER BY coordinate_id;
+        """,
+        "params": "SELECT user_id FROM coordinates_current LIMIT 1;",
+        "expected_index": "idx_coordinates_current_user_id",
+    },
+    {
+        "name": "patient medical history",
+        "query": """
+            SELECT * FROM medical_history_current
+            WHERE patient_id = %s AND hidden IS NOT TRUE
+            ORDER BY history_id;
+        """,
+        "params": "SELECT patient_id FROM medical_history_current LIMIT 1;",
+        "expected_index": "idx_medical_history_current_patient_id",
+    },
+    {
+        "name": "patient medical visits",
+        "query": """
+            SELECT * FROM medical_visits_current
+            WHERE patient_id = %s AND hidden IS NOT TRUE
+            ORDER BY visit_id;
+        """,
+        "params": "SELECT patient_id FROM medical_visits_current LIMIT 1;",
+        "expected_index": "idx_medical_visits_current_patient_id",
+    },
+    {
+        "name": "patient parents",
+        "query": """
+            SELECT parent_id FROM parents
+            WHERE child_id = %s AND hidden IS NOT TRUE;
+        """,
+        "params": "SELECT child_id FROM parents LIMIT 1;",
+        "expected_index": "idx_parents_child_id",
+    },
+    {
+        "name": "login by email",
+        "query": """
+            SELECT user_id, login, user_type, password_hash,
+                first_name, last_name, medical_insurance_id
+            FROM users_current
+            WHERE email = %s AND hidden IS NOT TRUE
+            ORDER BY modified_at DESC
+            LIMIT 1;
+        """,
+        "params": "SELECT email FROM users_current LIMIT 1;",
+        "expected_index": "idx_users_current_email",
+    },
+    {
+        "name": "doctor by name",
+        "query": """
+            SELECT user_id FROM users_current
+            WHERE first_name = %s AND last_name = %s AND user_type = 'DOCTOR'
+            ORDER BY user_id
+            LIMIT 1;
+        """,
+        "params": "SELECT first_name, last_name FROM users_current WHERE user_type = 'DOCTOR' LIMIT 1;",
+        "expected_index": "idx_users_current_doctor_name",
+    },
+    {
+        "name": "all doctors",
+        "query": """
+            SELECT user_id, first_name, last_name, email, phone_number, modified_at
+            FROM users_current
+            WHERE user_type = 'DOCTOR' and hidden IS NOT TRUE
+            ORDER BY user_id;
+        """,
+        "params": None,
+        "expected_index": "idx_users_current_doctors",
+    },
+    {
+        "name": "patient at date",
+        "query": """
+            SELECT * FROM users
+            WHERE user_id = %s AND hidden IS NOT TRUE
+              AND valid_period @> now()
+            ORDER BY unique_id DESC
+            LIMIT 1;
+        """,
+        "params": "SELECT user_id FROM users LIMIT 1;",
+        "expected_index": "idx_users_valid_period",
+    },
+    {
+        "name": "coordinates at date",
+        "query": """
+            SELECT DISTINCT ON (coordinate_id) * FROM coordinates
+            WHERE user_id = %s AND hidden IS NOT TRUE
+              AND valid_period @> now()
+            ORDER BY coordinate_id, unique_id DESC;
+        """,
+        "params": "SELECT user_id FROM coordinates LIMIT 1;",
+        "expected_index": "idx_coordinates_valid_period",
+    },
+    {
+        "name": "visits at date",
+        "query": """
+            SELECT DISTINCT ON (visit_id) * FROM medical_visits
+            WHERE patient_id = %s AND hidden IS NOT TRUE
+              AND valid_period @> now()
+            ORDER BY visit_id, unique_id DESC;
+        """,
+        "params": "SELECT patient_id FROM medical_visits LIMIT 1;",
+        "expected_index": "idx_medical_visits_valid_period",
+    },
+    {
+        "name": "patient versions in window",
+        "query": """
+            SELECT modified_at FROM users
+            WHERE medical_insurance_id = %s AND hidden IS NOT TRUE
+              AND modified_at >= %s AND modified_at <= 'infinity'
+            ORDER BY modified_at
+            LIMIT 101;
+        """,
+        "params": "SELECT medical_insurance_id, min(modified_at) FROM users WHERE medical_insurance_id IS NOT NULL GROUP BY medical_insurance_id LIMIT 1;",
+        "expected_index": "idx_users_modified_at",
+    },
+    {
+        "name": "visit versions in window",
+        "query": """
+            SELECT modified_at FROM medical_visits
+            WHERE patient_id = %s AND hidden IS NOT TRUE
+              AND modified_at >= %s AND modified_at <= 'infinity'
+            ORDER BY modified_at
+            LIMIT 101;
+        """,
+        "params": "SELECT patient_id, min(modified_at) FROM medical_visits GROUP BY patient_id LIMIT 1;",
+        "expected_index": "idx_medical_visits_modified_at",
+    },
+    {
+        "name": "revoked token",
+        "query": """
+            SELECT 1 FROM token_blacklist
+            WHERE jti = %s;
+        """,
+        "params": "SELECT gen_random_uuid()::text;",
+        "expected_index": "token_blacklist_jti_key",
+    },
+]
+
+
+def _plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def explain_hot_queries(db_instance, disable_seqscan: bool = False) -> list[dict]:
+    """
+    Run EXPLAIN on each of the HOT_QUERIES and report the indexes its plan
+    uses.
+
+    On a small development database the planner rightly prefers sequential
+    scans; `disable_seqscan` discourages them to check that the indexes are
+    at least usable by the queries.
+    """
+    results = []
+    with db_instance.get_conn() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            if disable_seqscan:
+                cur.execute("SET LOCAL enable_seqscan = off;")
+
+            for hot_query in HOT_QUERIES:
+                params = ()
+                if hot_query["params"]:
+                    cur.execute(hot_query["params"])
+                    params = cur.fetchone()
+                    if params is None:
+                        results.append({
+                            "name": hot_query["name"],
+                            "status": "skipped",
+                            "reason": "no sample data",
+                        })
+                        continue
+
+                cur.execute("EXPLAIN (FORMAT JSON) " + hot_query["query"], params)
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                root = plan[0]["Plan"]
+
+                nodes = list(_plan_nodes(root))
+                indexes = sorted({node["Index Name"]
+                                 for node in nodes if "Index Name" in node})
+                seq_scans = sorted({node["Relation Name"] for node in nodes
+                                    if node["Node Type"] == "Seq Scan"})
+
+                expected = hot_query["expected_index"]
+                status = "ok" if expected in indexes else "missing"
+
+                results.append({
+                    "name": hot_query["name"],
+                    "status": status,
+                    "expected_index": expected,
+                    "indexes": indexes,
+                    "seq_scans": seq_scans,
+                    "total_cost": root["Total Cost"],
+                })
+        conn.rollback()
+    return results
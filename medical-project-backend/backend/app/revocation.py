@@ -0,0 +1,222 @@
+import json
+import os
+import select
+import threading
+import time
+from typing import Callable, Optional
+import psycopg2.extensions
+from .background import ProcessLocalThread
+
+# Channels notified by the token_blacklist_notify trigger on every
+# revocation and by token_generations_notify on every generation bump.
+REVOCATION_CHANNEL = "token_revoked"
+GENERATION_CHANNEL = "token_generation"
+
+UNEXPIRED_REVOCATIONS_QUERY = """
+    SELECT jti, EXTRACT(EPOCH FROM expires_at)
+    FROM token_blacklist
+    WHERE expires_at > NOW();
+"""
+
+TOKEN_GENERATIONS_QUERY = """
+    SELECT user_id, generation FROM token_generations;
+"""
+
+
+class RevocationCache:
+    """
+    JTIs of the revoked tokens that haven't expired and token generations
+    of the users, kept in memory by each worker so that authenticated
+    requests check revocations without a database round trip.
+
+    A listener thread, started by the first lookup of each process, LISTENs
+    on the token_revoked and token_generation channels over a connection of
+    its own and reloads everything every `refresh_interval` seconds as a
+    safety net. Between notifications it pings the database, which
+    delivers the notifications committed before the ping: once the ping
+    returns, every revocation committed before it was sent is known.
+
+    The cache is only trusted while that is less than `max_staleness`
+    seconds old. Otherwise (listener starting, database unreachable, lost
+    connection) lookups return None and the caller checks the
+    database itself, so a revocation reaches every worker within
+    `max_staleness` seconds.
+
+    Args:
+        connect: Opens a dedicated connection to the primary.
+        max_staleness: Seconds the cache is trusted without news from the
+            database.
+        refresh_interval: Seconds between full reloads.
+    """
+
+    def __init__(self, connect: Callable, max_staleness: float = 10.0,
+                 refresh_interval: float = 300.0):
+        self._connect = connect
+        self.max_staleness = max_staleness
+        self.refresh_interval = refresh_interval
+        # Pings are frequent enough that the cache stays fresh with a
+        # slow round trip or two.
+        self.heartbeat_interval = max_staleness / 3
+
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._generations = {}
+        self._confirmed_at = None
+        self._listener = ProcessLocalThread(self._listen, "revocation-listener",
+                                            on_start=self._forget_confirmation)
+        self._stopped = threading.Event()
+
+        self._lookups = 0
+        self._fallbacks = 0
+        self._notifications = 0
+        self._reloads = 0
+        self._reconnects = 0
+        self._last_error = None
+
+    def is_revoked(self, jti: str) -> Optional[bool]:
+        """Whether the token is revoked, or None when the cache is stale."""
+        self._ensure_listening()
+        with self._lock:
+            self._lookups += 1
+            if not self._fresh():
+                self._fallbacks += 1
+                return None
+            return jti in self._revoked
+
+    def generation(self, user_id: str) -> Optional[int]:
+        """Current token generation of the user, or None when the cache is stale."""
+        self._ensure_listening()
+        with self._lock:
+            self._lookups += 1
+            if not self._fresh():
+                self._fallbacks += 1
+                return None
+            return self._generations.get(user_id, 0)
+
+    def set_generation(self, user_id: str, generation: int):
+        """Record a generation bump made by this worker without waiting for its notification."""
+        with self._lock:
+            self._generations[user_id] = max(generation, self._generations.get(user_id, 0))
+
+    def add(self, jti: str, expires_at: float):
+        """Record a revocation made by this worker without waiting for its notification."""
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def close(self):
+        self._stopped.set()
+
+    def _fresh(self) -> bool:
+        return self._confirmed_at is not None \
+            and time.monotonic() - self._confirmed_at <= self.max_staleness
+
+    def _ensure_listening(self):
+        self._listener.ensure_started()
+
+    def _forget_confirmation(self):
+        # Inherited from the parent process, whose listener isn't ours.
+        with self._lock:
+            self._confirmed_at = None
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.set_isolation_level(
+                    psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    # Listening before loading: a revocation committed in
+                    # between is both loaded and notified, never missed.
+                    cur.execute(f"LISTEN {REVOCATION_CHANNEL}; LISTEN {GENERATION_CHANNEL};")
+                    self._reload(cur)
+                next_reload = time.monotonic() + self.refresh_interval
+
+                while not self._stopped.is_set():
+                    select.select([conn], [], [], self.heartbeat_interval)
+                    started = time.monotonic()
+                    with conn.cursor() as cur:
+                        if started >= next_reload:
+                            self._reload(cur)
+                            next_reload = started + self.refresh_interval
+                        else:
+                            cur.execute("SELECT 1;")
+                    conn.poll()
+                    self._receive(conn.notifies)
+                    del conn.notifies[:]
+                    with self._lock:
+                        self._confirmed_at = started
+            except Exception as e:
+                with self._lock:
+                    self._reconnects += 1
+                    self._last_error = repr(e)
+                self._stopped.wait(min(self.heartbeat_interval, 1.0))
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _reload(self, cur):
+        started = time.monotonic()
+        cur.execute(UNEXPIRED_REVOCATIONS_QUERY)
+        revoked = {jti: float(expires_at) for jti, expires_at in cur.fetchall()}
+        cur.execute(TOKEN_GENERATIONS_QUERY)
+        generations = {str(user_id): generation for user_id, generation in cur.fetchall()}
+        with self._lock:
+            # Revocations added locally meanwhile are notified again later.
+            self._revoked = revoked
+            self._generations = generations
+            self._confirmed_at = started
+            self._reloads += 1
+
+    def _receive(self, notifies):
+        if not notifies:
+            return
+        now = time.time()
+        with self._lock:
+            for notify in notifies:
+                payload = json.loads(notify.payload)
+                if notify.channel == GENERATION_CHANNEL:
+                    user_id = payload["user_id"]
+                    self._generations[user_id] = max(
+                        payload["generation"], self._generations.get(user_id, 0))
+                else:
+                    self._revoked[payload["jti"]] = float(payload["expires_at"])
+                self._notifications += 1
+            if len(self._revoked) > 10000:
+                self._revoked = {jti: expires_at for jti, expires_at
+                                 in self._revoked.items() if expires_at > now}
+
+    def stats(self) -> dict:
+        with self._lock:
+            age = time.monotonic() - self._confirmed_at \
+                if self._confirmed_at is not None else None
+            return {
+                "revoked": len(self._revoked),
+                "generations": len(self._generations),
+                "fresh": self._fresh(),
+                "age": age,
+                "lookups": self._lookups,
+                "fallbacks": self._fallbacks,
+                "notifications": self._notifications,
+                "reloads": self._reloads,
+                "reconnects": self._reconnects,
+                "last_error": self._last_error,
+            }
+
+
+def create_revocation_cache(db_instance) -> Optional[RevocationCache]:
+    """Revocation cache configured by the INF6150_REVOCATION_* variables."""
+    backend = os.getenv("INF6150_REVOCATION_CACHE", "listen")
+    if backend == "none":
+        return None
+    if backend != "listen":
+        raise ValueError(
+            f"Unknown revocation cache '{backend}'. Known caches: listen, none.")
+    return RevocationCache(
+        db_instance.connect,
+        max_staleness=float(os.getenv("INF6150_REVOCATION_MAX_STALENESS", "10")),
+        refresh_interval=float(
+            os.getenv("INF6150_REVOCATION_REFRESH_INTERVAL", "300")))
@@ -2,7 +2,8 @@ from flask import Blueprint, request, jsonify
 from flask.views import MethodView
 from pydantic import ValidationError
 from ..models import Login, ErrorResponse
-from ..services.auth_service import login, logout
+from ..services.auth_service import login, logout, logout_everywhere
+from ..hashing import PasswordHasherBusy, hasher_busy_response
 from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from datetime import datetime
 
@@ -62,6 +63,8 @@ class LoginAPI(MethodView):
         try:
             response_data, response_code = login(data)
             return jsonify(response_data), response_code
+        except PasswordHasherBusy as e:
+            return hasher_busy_response(e)
         except Exception as e:
             return jsonify({"status": "Internal server error", "error": str(e)}), 500
 
@@ -85,6 +88,21 @@ class LogoutAPI(MethodView):
             return jsonify(error_response.model_dump()), 500
 
 
+class LogoutEverywhereAPI(MethodView):
+    @jwt_required()
+    def post(self):
+        """
+        Revoke every token of the user, on every device, including this one.
+        """
+        try:
+            response_data, status_code = logout_everywhere(get_jwt_identity())
+            return jsonify(response_data), status_code
+
+        except Exception as e:
+            error_response = ErrorResponse(error=str(e))
+            return jsonify(error_response.model_dump()), 500
+
+
 auth_register_view = RegisterAPI.as_view('register_account')
 auth_bp.add_url_rule(
     '/register', view_func=auth_register_view, methods=['POST'])
@@ -94,3 +112,7 @@ auth_bp.add_url_rule('/login', view_func=auth_login_view, methods=['POST'])
 
 auth_logout_view = LogoutAPI.as_view('logout')
 auth_bp.add_url_rule('/logout', view_func=auth_logout_view, methods=['POST'])
+
+auth_logout_everywhere_view = LogoutEverywhereAPI.as_view('logout_everywhere')
+auth_bp.add_url_rule('/logout-everywhere', view_func=auth_logout_everywhere_view,
+                     methods=['POST'])
@@ -1,7 +1,9 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask.views import MethodView
-from ..services.doctor_service import get_all_doctors
+from ..services.doctor_service import get_all_doctors, stream_all_doctors
 from ..utils.auth_utils import roles_required
+from ..utils.streaming import wants_ndjson, ndjson_response
+from ..utils.conditional import not_modified, with_etag
 
 doctors_bp = Blueprint('doctors', __name__)
 
@@ -10,11 +12,21 @@ class DoctorsAPI(MethodView):
     @roles_required(["ADMIN", "DOCTOR", "HEALTHCARE PROFESSIONAL"])
     def get(self):
         """
-        Retrieve all doctors.
+        Retrieve all doctors, streamed one per line with
+        `Accept: application/x-ndjson`. JSON listings carry an ETag and
+        are answered with 304 when If-None-Match already has it.
         """
-        result, status_code = get_all_doctors()
+        if wants_ndjson():
+            result, status_code = stream_all_doctors()
+            if status_code == 200:
+                return ndjson_response(result["data"])
+            return jsonify(result), status_code
+        result, status_code = get_all_doctors(request.if_none_match)
+        if status_code == 304:
+            return not_modified(result["etag"])
         if status_code == 200:
-            return jsonify(result), 200
+            etag = result.pop("etag")
+            return with_etag(jsonify(result), etag)
         else:
             return jsonify(result), status_code
 
@@ -3,11 +3,19 @@ from flask import Blueprint, request, jsonify
 from flask.views import MethodView
 from pydantic import ValidationError
 from ..models import PatientCreate, ErrorResponse, PatientUpdate, StatusResponse, PatientVersionHistoryResponse
-from ..services.patient_service import add_patient, get_patient, update_patient, hide_patient, get_patient_at_date, get_patient_version_history
+from ..services.patient_service import add_patient, get_patient, update_patient, hide_patient, get_patient_at_date, get_patient_version_history, stream_patient, stream_patient_version_history
+from ..utils.pagination import parse_timestamp, encode_cursor, decode_cursor
+from ..utils.streaming import wants_ndjson, ndjson_response
+from ..utils.conditional import not_modified, with_etag
+from ..hashing import PasswordHasherBusy, hasher_busy_response
+from typing import Optional
 from datetime import datetime
 
 patients_bp = Blueprint('patients', __name__)
 
+DEFAULT_VERSION_HISTORY_LIMIT = 100
+MAX_VERSION_HISTORY_LIMIT = 1000
+
 
 class PatientAPI(MethodView):
     @roles_required(["ADMIN", "DOCTOR", "HEALTHCARE PROFESSIONAL"])
@@ -32,6 +40,8 @@ class PatientAPI(MethodView):
         try:
             response_result, _ = add_patient(data)
             return jsonify(response_result["data"].model_dump()), 201
+        except PasswordHasherBusy as e:
+            return hasher_busy_response(e)
         except Exception as e:
             error_response = ErrorResponse(error=repr(e))
             return jsonify(error_response.model_dump()), 500
@@ -63,14 +73,42 @@ class PatientPutAPI(MethodView):
             return jsonify(error_response.model_dump()), 500
 
 
+def _comma_separated(name: str) -> Optional[list[str]]:
+    """Values of a comma-separated query parameter, None when absent."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
 class PatientDetailAPI(MethodView):
     @self_doctor_or_admin_access(param_name='medical_insurance_id')
     def get(self, medical_insurance_id: str):
         """
         Retrieve a patient by their medical_insurance_id, including user info,
         multiple coordinates, medical history, medical visits, and parents.
+        With `Accept: application/x-ndjson`, the current record is streamed
+        one item per line instead. The current record as JSON carries an
+        ETag, and is answered with 304 when If-None-Match already has it.
+
+        `fields` and `include` (comma-separated) project the current record
+        as JSON: `fields` names the members to return, every field of the
+        user when absent, and `include` the lists to add to them.
         """
         from_date_str = request.args.get('from_date')
+        fields = _comma_separated('fields')
+        include = _comma_separated('include')
+        if (fields is not None or include is not None) \
+                and (from_date_str or wants_ndjson()):
+            error_response = ErrorResponse(
+                error="fields and include only apply to the current patient as JSON.")
+            return jsonify(error_response.model_dump()), 400
+        if not from_date_str and wants_ndjson():
+            result, status_code = stream_patient(medical_insurance_id)
+            if status_code == 200:
+                return ndjson_response(result["data"])
+            error_response = ErrorResponse(error=result["message"])
+            return jsonify(error_response.model_dump()), status_code
         if from_date_str:
             try:
                 from_date = datetime.strptime(from_date_str, '%d-%m-%Y').date()
@@ -80,12 +118,15 @@ class PatientDetailAPI(MethodView):
             result, status_code = get_patient_at_date(
                 medical_insurance_id, from_date)
         else:
-            result, status_code = get_patient(medical_insurance_id)
+            result, status_code = get_patient(
+                medical_insurance_id, request.if_none_match, fields, include)
+        if status_code == 304:
+            return not_modified(result["etag"])
         if status_code == 200:
-            return jsonify(result["data"].model_dump()), 200
-        elif status_code == 404:
+            return with_etag(jsonify(result["data"]), result.get("etag")), 200
+        elif status_code in (400, 404):
             error_response = ErrorResponse(error=result["message"])
-            return jsonify(error_response.model_dump()), 404
+            return jsonify(error_response.model_dump()), status_code
         else:
             error_response = ErrorResponse(error=result["message"])
             return jsonify(error_response.model_dump()), 500
@@ -112,9 +153,60 @@ class PatientHistoryAPI(MethodView):
         """
         Retrieve the complete version history of a patient by their medical_insurance_id.
         Returns a map where each key is a timestamp and the value is the full patient record at that time.
+        With `?format=diff`, returns the first record in full followed by the changes of each version.
+        With `since`, `until`, `limit` or `cursor`, returns a page of versions along with the
+        cursor of the next page. Otherwise, with `Accept: application/x-ndjson`, the whole
+        history is streamed one version per line.
         """
-        result, status_code = get_patient_version_history(medical_insurance_id)
-        if status_code == 200:
+        history_format = request.args.get('format', 'full')
+        if history_format not in ('full', 'diff'):
+            error_response = ErrorResponse(
+                error=f"Unknown format '{history_format}', expected 'full' or 'diff'.")
+            return jsonify(error_response.model_dump()), 400
+
+        paginated = any(request.args.get(name)
+                        for name in ('since', 'until', 'limit', 'cursor'))
+        since = until = limit = None
+        if paginated:
+            try:
+                if request.args.get('cursor'):
+                    page = decode_cursor(request.args['cursor'])
+                    since = parse_timestamp(page['since'])
+                    until = parse_timestamp(page['until']) if page.get('until') else None
+                    limit = int(page['limit'])
+                else:
+                    since = parse_timestamp(request.args['since']) if request.args.get('since') else None
+                    until = parse_timestamp(request.args['until']) if request.args.get('until') else None
+                    limit = int(request.args.get('limit', DEFAULT_VERSION_HISTORY_LIMIT))
+                if not 1 <= limit <= MAX_VERSION_HISTORY_LIMIT:
+                    raise ValueError(
+                        f"limit must be between 1 and {MAX_VERSION_HISTORY_LIMIT}.")
+            except (KeyError, TypeError, ValueError) as e:
+                # KeyError and TypeError can only come from a malformed cursor.
+                error_response = ErrorResponse(
+                    error=str(e) if isinstance(e, ValueError) else "Invalid cursor.")
+                return jsonify(error_response.model_dump()), 400
+        elif wants_ndjson():
+            result, status_code = stream_patient_version_history(
+                medical_insurance_id, diff=history_format == 'diff')
+            if status_code == 200:
+                return ndjson_response(result["data"])
+            error_response = ErrorResponse(error=str(result["message"]))
+            return jsonify(error_response.model_dump()), status_code
+
+        result, status_code = get_patient_version_history(
+            medical_insurance_id, diff=history_format == 'diff',
+            since=since, until=until, limit=limit)
+        if status_code == 200 and paginated:
+            next_cursor = None
+            if result["next_since"] is not None:
+                next_cursor = encode_cursor({
+                    "since": result["next_since"].isoformat(),
+                    "until": until.isoformat() if until else None,
+                    "limit": limit
+                })
+            return jsonify({"data": result["data"], "next_cursor": next_cursor}), 200
+        elif status_code == 200:
             return jsonify(result["data"]), 200
         elif status_code == 404:
             error_response = ErrorResponse(error=result["message"])
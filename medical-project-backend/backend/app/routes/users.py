@@ -4,6 +4,7 @@ from pydantic import ValidationError
 from ..models import CredentialsUpdate, UserCreate, ErrorResponse, UserUpdate, StatusResponse
 from ..services.users_service import add_user, get_user, update_user, hide_user, update_user_credentials
 from ..utils.auth_utils import roles_required, self_user_doctor_or_admin_access
+from ..hashing import PasswordHasherBusy, hasher_busy_response
 
 users_bp = Blueprint('users', __name__)
 
@@ -30,6 +31,8 @@ class UserPostAPI(MethodView):
         try:
             response_result, _ = add_user(data)
             return jsonify(response_result["data"].model_dump()), 201
+        except PasswordHasherBusy as e:
+            return hasher_busy_response(e)
         except Exception as e:
             error_response = ErrorResponse(error=repr(e))
             return jsonify(error_response.model_dump()), 500
@@ -69,7 +72,7 @@ class UserGetAPI(MethodView):
         """
         result, status_code = get_user(user_id)
         if status_code == 200:
-            return jsonify(result["data"].model_dump()), 200
+            return jsonify(result["data"]), 200
         elif status_code == 404:
             error_response = ErrorResponse(error=result["message"])
             return jsonify(error_response.model_dump()), 404
@@ -111,7 +114,10 @@ class UserPutCredentialsAPI(MethodView):
         except ValidationError as ve:
             error_response = ErrorResponse(error=str(ve))
             return jsonify(error_response.model_dump()), 400
-        result, status_code = update_user_credentials(user_id, data)
+        try:
+            result, status_code = update_user_credentials(user_id, data)
+        except PasswordHasherBusy as e:
+            return hasher_busy_response(e)
         if status_code == 201:
             status_response = StatusResponse(status=result["status"])
             return jsonify(status_response.model_dump()), status_code
@@ -1,160 +1,277 @@
-CREATE_EXTENSION_UUID = 'CREATE EXTENSION IF NOT EXISTS "uuid-ossp";'
-
-CREATE_USER_TYPE_ENUM = """
-CREATE TYPE USER_TYPE AS ENUM ('ADMIN', 'PATIENT', 'DOCTOR', 'HEALTHCARE PROFESSIONAL', 'PARENT');
-"""
-
 DROP_USER_TYPE_ENUM = "DROP TYPE IF EXISTS USER_TYPE CASCADE;"
 
-CREATE_USER_ID_INDEX = "CREATE INDEX idx_user_id ON users(user_id);"
 DROP_USER_ID_INDEX = "DROP INDEX IF EXISTS idx_user_id RESTRICT"
-CREATE_MEDICAL_INSURANCE_ID_INDEX = "CREATE INDEX idx_medical_insurance_id ON users(medical_insurance_id);"
 DROP_MEDICAL_INSURANCE_ID_INDEX = "DROP INDEX IF EXISTS idx_medical_insurance_id RESTRICT"
 
-CREATE_COORDINATE_ID_INDEX = "CREATE INDEX idx_coordinate_id ON coordinates(coordinate_id);"
 DROP_COORDINATE_ID_INDEX = "DROP INDEX IF EXISTS idx_coordinate_id RESTRICT"
+DROP_COORDINATES_USER_ID_INDEX = "DROP INDEX IF EXISTS idx_coordinates_user_id RESTRICT;"
 
-CREATE_HISTORY_ID_INDEX = "CREATE INDEX idx_history_id ON medical_history(history_id);"
 DROP_HISTORY_ID_INDEX = "DROP INDEX IF EXISTS idx_history_id RESTRICT"
+DROP_MEDICAL_HISTORY_PATIENT_ID_INDEX = "DROP INDEX IF EXISTS idx_medical_history_patient_id RESTRICT;"
 
-CREATE_VISIT_ID_INDEX = "CREATE INDEX idx_visit_id ON medical_visits(visit_id);"
 DROP_VISIT_ID_INDEX = "DROP INDEX IF EXISTS idx_visit_id RESTRICT"
+DROP_MEDICAL_VISITS_PATIENT_ID_INDEX = "DROP INDEX IF EXISTS idx_medical_visits_patient_id RESTRICT;"
 
-CREATE_JTI_INDEX = "CREATE INDEX idx_jti ON token_blacklist(jti);"
+DROP_PARENTS_CHILD_ID_INDEX = "DROP INDEX IF EXISTS idx_parents_child_id RESTRICT;"
+
+# jti is already indexed by its UNIQUE constraint; idx_jti duplicated it and
+# is only dropped now.
 DROP_JTI_INDEX = "DROP INDEX IF EXISTS idx_jti RESTRICT;"
 CREATE_USER_BLACKLIST_INDEX = "CREATE INDEX idx_user_blacklist ON token_blacklist(user_id);"
 DROP_USER_BLACKLIST_INDEX = "DROP INDEX IF EXISTS idx_user_blacklist RESTRICT;"
+CREATE_TOKEN_BLACKLIST_EXPIRES_AT_INDEX = "CREATE INDEX idx_token_blacklist_expires_at ON token_blacklist(expires_at);"
+DROP_TOKEN_BLACKLIST_EXPIRES_AT_INDEX = "DROP INDEX IF EXISTS idx_token_blacklist_expires_at RESTRICT;"
 
-CREATE_MFA_CONFIG_INDEX = "CREATE INDEX idx_mfa_user_id ON mfa_config(user_id);"
 DROP_MFA_CONFIG_INDEX = "DROP INDEX IF EXISTS idx_mfa_user_id RESTRICT;"
 
-CREATE_USERS_TABLE = """
-CREATE TABLE IF NOT EXISTS users (
-    unique_id               SERIAL PRIMARY KEY,
-    user_id                 UUID NOT NULL DEFAULT uuid_generate_v4(),
-    medical_insurance_id    TEXT,
-    login                   TEXT NOT NULL DEFAULT '',
-    password_hash           TEXT NOT NULL DEFAULT '',
-    user_type               USER_TYPE NOT NULL DEFAULT 'PARENT',
-    first_name              TEXT NOT NULL,
-    last_name               TEXT NOT NULL,
-    phone_number            TEXT NOT NULL,
-    email                   TEXT NOT NULL,
-    gender                  TEXT,
-    city_of_birth           TEXT,
-    date_of_birth           DATE,
-    hidden                  BOOL DEFAULT FALSE,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    modified_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
-"""
-
 DROP_USERS_TABLE = "DROP TABLE IF EXISTS users CASCADE;"
 
-CREATE_PARENTS_TABLE = """
-CREATE TABLE IF NOT EXISTS parents (
-    parent_id       UUID NOT NULL,
-    child_id        UUID NOT NULL,
+DROP_PARENTS_TABLE = "DROP TABLE IF EXISTS parents CASCADE;"
+
+DROP_COORDINATES_TABLE = "DROP TABLE IF EXISTS coordinates CASCADE;"
+
+DROP_MEDICAL_HISTORY_TABLE = "DROP TABLE IF EXISTS medical_history CASCADE;"
+
+DROP_MEDICAL_VISITS_TABLE = "DROP TABLE IF EXISTS medical_visits CASCADE;"
+
+DROP_ESTABLISHMENTS_TABLE = "DROP TABLE IF EXISTS establishments CASCADE;"
+
+DROP_TOKEN_BLACKLIST_TABLE = "DROP TABLE IF EXISTS token_blacklist CASCADE;"
+
+# Optional layout of token_blacklist, partitioned by day of expiry so that
+# expired tokens are dropped a partition at a time (`db partition-tokens`).
+# Unique constraints must include the partition key: a token's jti always
+# comes with the same expires_at, so (jti, expires_at) is as unique as jti.
+CREATE_PARTITIONED_TOKEN_BLACKLIST_TABLE = """
+CREATE TABLE token_blacklist (
+    id              SERIAL,
+    jti             VARCHAR(36) NOT NULL,
+    token_type      VARCHAR(10) NOT NULL,
+    user_id         UUID NOT NULL,
+    revoked_at      TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at      TIMESTAMP WITH TIME ZONE NOT NULL,
     hidden          BOOL DEFAULT FALSE,
+    PRIMARY KEY (id, expires_at),
+    UNIQUE (jti, expires_at)
+) PARTITION BY RANGE (expires_at);
+"""
 
-    PRIMARY KEY(parent_id, child_id)
-);
+# Tokens expiring outside the daily partitions, e.g. further ahead than the
+# maintenance created them, land here instead of failing the logout.
+CREATE_TOKEN_BLACKLIST_DEFAULT_PARTITION = """
+CREATE TABLE IF NOT EXISTS token_blacklist_default PARTITION OF token_blacklist DEFAULT;
 """
 
-DROP_PARENTS_TABLE = "DROP TABLE IF EXISTS parents CASCADE;"
+DROP_MFA_CONFIG_TABLE = "DROP TABLE IF EXISTS mfa_config CASCADE;"
 
-CREATE_COORDINATES_TABLE = """
-CREATE TABLE IF NOT EXISTS coordinates (
-    unique_id           SERIAL PRIMARY KEY,
-    coordinate_id       UUID NOT NULL DEFAULT uuid_generate_v4(),
-    user_id             UUID NOT NULL,
-    street_address      TEXT NOT NULL,
-    apartment           TEXT,
-    postal_code         TEXT NOT NULL,
-    city                TEXT NOT NULL,
-    country             TEXT NOT NULL,
-    created_at          TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    modified_at         TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    hidden              BOOL DEFAULT FALSE
-);
+# "Current" projections of the append-only versioned tables. Each holds the
+# latest version of every entity and is kept up to date by an AFTER INSERT OR
+# UPDATE trigger on the versioned table, so it is always written in the same
+# transaction as the new version. Reads of the latest state can then do a
+# direct key lookup instead of resolving the latest version every time.
+
+DROP_USERS_CURRENT_TABLE = "DROP TABLE IF EXISTS users_current CASCADE;"
+
+DROP_USERS_CURRENT_FUNCTION = "DROP FUNCTION IF EXISTS sync_users_current() CASCADE;"
+
+REFRESH_USERS_CURRENT = """
+TRUNCATE users_current;
+INSERT INTO users_current (
+    user_id, unique_id, medical_insurance_id, login, password_hash,
+    user_type, first_name, last_name, phone_number, email, gender,
+    city_of_birth, date_of_birth, hidden, created_at, modified_at
+)
+SELECT DISTINCT ON (u.user_id)
+    u.user_id, u.unique_id,
+    COALESCE(u.medical_insurance_id, (
+        SELECT medical_insurance_id FROM users previous
+        WHERE previous.user_id = u.user_id
+            AND previous.medical_insurance_id IS NOT NULL
+        ORDER BY previous.unique_id DESC
+        LIMIT 1
+    )),
+    u.login, u.password_hash, u.user_type, u.first_name, u.last_name,
+    u.phone_number, u.email, u.gender, u.city_of_birth, u.date_of_birth,
+    u.hidden, u.created_at, u.modified_at
+FROM users u
+ORDER BY u.user_id, u.unique_id DESC;
 """
 
-DROP_COORDINATES_TABLE = "DROP TABLE IF EXISTS coordinates CASCADE;"
+DROP_COORDINATES_CURRENT_TABLE = "DROP TABLE IF EXISTS coordinates_current CASCADE;"
 
-CREATE_MEDICAL_HISTORY_TABLE = """
-CREATE TABLE IF NOT EXISTS medical_history (
-    unique_id           SERIAL PRIMARY KEY,
-    history_id          UUID NOT NULL DEFAULT uuid_generate_v4(),
-    patient_id          TEXT NOT NULL,
-    diagnostic          TEXT NOT NULL,
-    treatment           TEXT NOT NULL,
-    doctor_id           UUID NOT NULL,
-    start_date          DATE,
-    end_date            DATE,
-    created_at          TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    modified_at         TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    hidden              BOOL DEFAULT FALSE
-);
+DROP_COORDINATES_CURRENT_FUNCTION = "DROP FUNCTION IF EXISTS sync_coordinates_current() CASCADE;"
+
+REFRESH_COORDINATES_CURRENT = """
+TRUNCATE coordinates_current;
+INSERT INTO coordinates_current (
+    coordinate_id, unique_id, user_id, street_address, apartment,
+    postal_code, city, country, created_at, modified_at, hidden
+)
+SELECT DISTINCT ON (coordinate_id)
+    coordinate_id, unique_id, user_id, street_address, apartment,
+    postal_code, city, country, created_at, modified_at, hidden
+FROM coordinates
+ORDER BY coordinate_id, unique_id DESC;
 """
 
-DROP_MEDICAL_HISTORY_TABLE = "DROP TABLE IF EXISTS medical_history CASCADE;"
+DROP_MEDICAL_HISTORY_CURRENT_TABLE = "DROP TABLE IF EXISTS medical_history_current CASCADE;"
 
-CREATE_MEDICAL_VISITS_TABLE = """
-CREATE TABLE IF NOT EXISTS medical_visits (
-    unique_id               SERIAL PRIMARY KEY,
-    visit_id                UUID NOT NULL DEFAULT uuid_generate_v4(),
-    patient_id              TEXT NOT NULL,
-    establishment_id        UUID NOT NULL,
-    doctor_id               UUID NOT NULL,
-    visit_date              TIMESTAMP WITH TIME ZONE,
-    diagnostic_established  TEXT,
-    treatment               TEXT,
-    visit_summary           TEXT NOT NULL,
-    notes                   TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    modified_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    hidden                  BOOL DEFAULT FALSE,
-    FOREIGN KEY (establishment_id) REFERENCES establishments(establishment_id)
-);
+DROP_MEDICAL_HISTORY_CURRENT_FUNCTION = "DROP FUNCTION IF EXISTS sync_medical_history_current() CASCADE;"
+
+REFRESH_MEDICAL_HISTORY_CURRENT = """
+TRUNCATE medical_history_current;
+INSERT INTO medical_history_current (
+    history_id, unique_id, patient_id, diagnostic, treatment, doctor_id,
+    start_date, end_date, created_at, modified_at, hidden
+)
+SELECT DISTINCT ON (history_id)
+    history_id, unique_id, patient_id, diagnostic, treatment, doctor_id,
+    start_date, end_date, created_at, modified_at, hidden
+FROM medical_history
+ORDER BY history_id, unique_id DESC;
 """
 
-DROP_MEDICAL_VISITS_TABLE = "DROP TABLE IF EXISTS medical_visits CASCADE;"
+DROP_MEDICAL_VISITS_CURRENT_TABLE = "DROP TABLE IF EXISTS medical_visits_current CASCADE;"
 
-CREATE_ESTABLISHMENTS_TABLE = """
-CREATE TABLE IF NOT EXISTS establishments (
-    establishment_id        UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-    establishment_name      TEXT NOT NULL,
-    created_at              TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    hidden                  BOOL DEFAULT FALSE
-);
+DROP_MEDICAL_VISITS_CURRENT_FUNCTION = "DROP FUNCTION IF EXISTS sync_medical_visits_current() CASCADE;"
+
+REFRESH_MEDICAL_VISITS_CURRENT = """
+TRUNCATE medical_visits_current;
+INSERT INTO medical_visits_current (
+    visit_id, unique_id, patient_id, establishment_id, doctor_id,
+    visit_date, diagnostic_established, treatment, visit_summary, notes,
+    created_at, modified_at, hidden
+)
+SELECT DISTINCT ON (visit_id)
+    visit_id, unique_id, patient_id, establishment_id, doctor_id,
+    visit_date, diagnostic_established, treatment, visit_summary, notes,
+    created_at, modified_at, hidden
+FROM medical_visits
+ORDER BY visit_id, unique_id DESC;
 """
 
-DROP_ESTABLISHMENTS_TABLE = "DROP TABLE IF EXISTS establishments CASCADE;"
+DROP_USERS_CURRENT_MEDICAL_INSURANCE_ID_INDEX = "DROP INDEX IF EXISTS idx_users_current_medical_insurance_id RESTRICT;"
+DROP_USERS_CURRENT_EMAIL_INDEX = "DROP INDEX IF EXISTS idx_users_current_email RESTRICT;"
+DROP_USERS_CURRENT_DOCTOR_NAME_INDEX = "DROP INDEX IF EXISTS idx_users_current_doctor_name RESTRICT;"
+DROP_USERS_CURRENT_DOCTORS_INDEX = "DROP INDEX IF EXISTS idx_users_current_doctors RESTRICT;"
+DROP_COORDINATES_CURRENT_USER_ID_INDEX = "DROP INDEX IF EXISTS idx_coordinates_current_user_id RESTRICT;"
+DROP_MEDICAL_HISTORY_CURRENT_PATIENT_ID_INDEX = "DROP INDEX IF EXISTS idx_medical_history_current_patient_id RESTRICT;"
+DROP_MEDICAL_VISITS_CURRENT_PATIENT_ID_INDEX = "DROP INDEX IF EXISTS idx_medical_visits_current_patient_id RESTRICT;"
 
-CREATE_TOKEN_BLACKLIST_TABLE = """
-CREATE TABLE IF NOT EXISTS token_blacklist (
-    id              SERIAL PRIMARY KEY,
-    jti             VARCHAR(36) NOT NULL UNIQUE,
-    token_type      VARCHAR(10) NOT NULL,
-    user_id         UUID NOT NULL,
-    revoked_at      TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    expires_at      TIMESTAMP WITH TIME ZONE NOT NULL,
-    hidden          BOOL DEFAULT FALSE
-);
+DROP_USERS_MODIFIED_AT_INDEX = "DROP INDEX IF EXISTS idx_users_modified_at RESTRICT;"
+DROP_COORDINATES_MODIFIED_AT_INDEX = "DROP INDEX IF EXISTS idx_coordinates_modified_at RESTRICT;"
+DROP_MEDICAL_HISTORY_MODIFIED_AT_INDEX = "DROP INDEX IF EXISTS idx_medical_history_modified_at RESTRICT;"
+DROP_MEDICAL_VISITS_MODIFIED_AT_INDEX = "DROP INDEX IF EXISTS idx_medical_visits_modified_at RESTRICT;"
+
+DROP_USERS_VALID_PERIOD_FUNCTION = "DROP FUNCTION IF EXISTS set_users_valid_period() CASCADE;"
+
+REFRESH_USERS_VALID_PERIOD = """
+UPDATE users t
+SET valid_period = periods.valid_period
+FROM (
+    SELECT
+        unique_id,
+        tstzrange(modified_at, CASE WHEN next_modified_at IS NOT NULL
+                                    THEN GREATEST(modified_at, next_modified_at) END, '[)') AS valid_period
+    FROM (
+        SELECT unique_id, modified_at,
+               LEAD(modified_at) OVER (PARTITION BY user_id ORDER BY unique_id) AS next_modified_at
+        FROM users
+    ) versions
+) periods
+WHERE t.unique_id = periods.unique_id
+    AND t.valid_period IS DISTINCT FROM periods.valid_period;
 """
 
-DROP_TOKEN_BLACKLIST_TABLE = "DROP TABLE IF EXISTS token_blacklist CASCADE;"
+DROP_COORDINATES_VALID_PERIOD_FUNCTION = "DROP FUNCTION IF EXISTS set_coordinates_valid_period() CASCADE;"
 
-CREATE_MFA_CONFIG_TABLE = """
-CREATE TABLE IF NOT EXISTS mfa_config (
-    user_id         UUID PRIMARY KEY,
-    secret          TEXT NOT NULL,
-    enabled         BOOLEAN DEFAULT FALSE,
-    created_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    modified_at     TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    backup_codes    TEXT[] DEFAULT ARRAY[]::TEXT[],
-    hidden          BOOLEAN DEFAULT FALSE
+REFRESH_COORDINATES_VALID_PERIOD = """
+UPDATE coordinates t
+SET valid_period = periods.valid_period
+FROM (
+    SELECT
+        unique_id,
+        tstzrange(modified_at, CASE WHEN next_modified_at IS NOT NULL
+                                    THEN GREATEST(modified_at, next_modified_at) END, '[)') AS valid_period
+    FROM (
+        SELECT unique_id, modified_at,
+               LEAD(modified_at) OVER (PARTITION BY coordinate_id ORDER BY unique_id) AS next_modified_at
+        FROM coordinates
+    ) versions
+) periods
+WHERE t.unique_id = periods.unique_id
+    AND t.valid_period IS DISTINCT FROM periods.valid_period;
+"""
+
+DROP_MEDICAL_HISTORY_VALID_PERIOD_FUNCTION = "DROP FUNCTION IF EXISTS set_medical_history_valid_period() CASCADE;"
+
+REFRESH_MEDICAL_HISTORY_VALID_PERIOD = """
+UPDATE medical_history t
+SET valid_period = periods.valid_period
+FROM (
+    SELECT
+        unique_id,
+        tstzrange(modified_at, CASE WHEN next_modified_at IS NOT NULL
+                                    THEN GREATEST(modified_at, next_modified_at) END, '[)') AS valid_period
+    FROM (
+        SELECT unique_id, modified_at,
+               LEAD(modified_at) OVER (PARTITION BY history_id ORDER BY unique_id) AS next_modified_at
+        FROM medical_history
+    ) versions
+) periods
+WHERE t.unique_id = periods.unique_id
+    AND t.valid_period IS DISTINCT FROM periods.valid_period;
+"""
+
+DROP_MEDICAL_VISITS_VALID_PERIOD_FUNCTION = "DROP FUNCTION IF EXISTS set_medical_visits_valid_period() CASCADE;"
+
+REFRESH_MEDICAL_VISITS_VALID_PERIOD = """
+UPDATE medical_visits t
+SET valid_period = periods.valid_period
+FROM (
+    SELECT
+        unique_id,
+        tstzrange(modified_at, CASE WHEN next_modified_at IS NOT NULL
+                                    THEN GREATEST(modified_at, next_modified_at) END, '[)') AS valid_period
+    FROM (
+        SELECT unique_id, modified_at,
+               LEAD(modified_at) OVER (PARTITION BY visit_id ORDER BY unique_id) AS next_modified_at
+        FROM medical_visits
+    ) versions
+) periods
+WHERE t.unique_id = periods.unique_id
+    AND t.valid_period IS DISTINCT FROM periods.valid_period;
+"""
+
+DROP_USERS_VALID_PERIOD_INDEX = "DROP INDEX IF EXISTS idx_users_valid_period RESTRICT;"
+DROP_COORDINATES_VALID_PERIOD_INDEX = "DROP INDEX IF EXISTS idx_coordinates_valid_period RESTRICT;"
+DROP_MEDICAL_HISTORY_VALID_PERIOD_INDEX = "DROP INDEX IF EXISTS idx_medical_history_valid_period RESTRICT;"
+DROP_MEDICAL_VISITS_VALID_PERIOD_INDEX = "DROP INDEX IF EXISTS idx_medical_visits_valid_period RESTRICT;"
+
+DROP_ROW_VERSION_SEQUENCE = "DROP SEQUENCE IF EXISTS row_version_seq CASCADE;"
+
+DROP_ROW_VERSION_FUNCTION = "DROP FUNCTION IF EXISTS set_row_version() CASCADE;"
+
+DROP_TOKEN_REVOKED_FUNCTION = "DROP FUNCTION IF EXISTS notify_token_revoked() CASCADE;"
+
+CREATE_TOKEN_REVOKED_TRIGGER = """
+CREATE OR REPLACE TRIGGER token_blacklist_notify
+AFTER INSERT ON token_blacklist
+FOR EACH ROW EXECUTE FUNCTION notify_token_revoked();
+"""
+
+DROP_TOKEN_GENERATIONS_TABLE = "DROP TABLE IF EXISTS token_generations CASCADE;"
+
+DROP_TOKEN_GENERATION_FUNCTION = "DROP FUNCTION IF EXISTS notify_token_generation() CASCADE;"
+
+CREATE_SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version         INTEGER PRIMARY KEY,
+    name            TEXT NOT NULL,
+    checksum        TEXT NOT NULL,
+    applied_at      TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    execution_ms    INTEGER
 );
 """
 
-DROP_MFA_CONFIG_TABLE = "DROP TABLE IF EXISTS mfa_config CASCADE;"
+DROP_SCHEMA_VERSION_TABLE = "DROP TABLE IF EXISTS schema_version CASCADE;"
@@ -0,0 +1,119 @@
+import types
+import typing
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Collection, Sequence
+from pydantic import BaseModel
+
+_WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+           "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def http_date(value: date) -> str:
+    """
+    Same as werkzeug.http.http_date for dates and datetimes (naive ones
+    being UTC), without its round trip through email.utils: this runs for
+    every date of every response.
+    """
+    if not isinstance(value, datetime):
+        return (f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} "
+                f"{_MONTHS[value.month - 1]} {value.year:04d} 00:00:00 GMT")
+    if value.tzinfo is not None and value.utcoffset():
+        value = value.astimezone(timezone.utc)
+    return (f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} "
+            f"{_MONTHS[value.month - 1]} {value.year:04d} "
+            f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+
+def encode_datetime(value):
+    """A datetime (or its ISO 8601 form, as found in PostgreSQL JSON) as jsonify writes it."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return http_date(value)
+
+
+def encode_date(value):
+    """A date (or its ISO 8601 form) as jsonify writes it."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value) if "T" in value else date.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    return http_date(value)
+
+
+def _nullable(encode: Callable) -> Callable:
+    def encode_nullable(value):
+        return None if value is None else encode(value)
+    return encode_nullable
+
+
+def _list_of(encode: Callable) -> Callable:
+    def encode_list(values):
+        return None if values is None else [encode(value) for value in values]
+    return encode_list
+
+
+def _converter(annotation) -> Callable | None:
+    """Function encoding a value of the `annotation` type, None when it is already JSON-ready."""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union or origin is types.UnionType:
+        arguments = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return _converter(arguments[0]) if len(arguments) == 1 else None
+    if origin in (list, Sequence, typing.List):
+        item = _converter(typing.get_args(annotation)[0])
+        return _list_of(item) if item else None
+    if annotation is datetime:
+        return encode_datetime
+    if annotation is date:
+        return encode_date
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return _nullable(compile_encoder(annotation))
+    return None
+
+
+def compile_encoder(model: type[BaseModel],
+                    columns: Sequence[str] = None,
+                    exclude: Collection[str] = ()) -> Callable[[Any], dict]:
+    """
+    Compile the shape of a response model into a function turning a row
+    straight into the JSON-ready dict `jsonify(model(**row).model_dump())`
+    would have serialized, without building the model.
+
+    The row is a tuple whose columns are named by `columns`, or a mapping
+    keyed by field names (a row of json_build_object for instance). Nested
+    models are read from mappings. Fields missing from the row get their
+    default. Rows come from our own database: they are not validated,
+    inbound data still goes through the Pydantic models.
+
+    The function is generated once per model as a single dict display, so
+    encoding a row costs one lookup and at most one call per field.
+    """
+    namespace = {}
+    entries = []
+    for name, field in model.model_fields.items():
+        if name in exclude:
+            continue
+        if columns is not None and name in columns:
+            source = f"row[{list(columns).index(name)}]"
+        elif columns is None and field.is_required():
+            source = f"row[{name!r}]"
+        else:
+            namespace[f"default_{name}"] = field.get_default(call_default_factory=True)
+            source = f"default_{name}" if columns is not None \
+                else f"row.get({name!r}, default_{name})"
+
+        converter = _converter(field.annotation)
+        if converter is not None:
+            namespace[f"encode_{name}"] = converter
+            source = f"encode_{name}({source})"
+        entries.append(f"        {name!r}: {source},")
+
+    source = "def encode(row):\n    return {\n" + "\n".join(entries) + "\n    }\n"
+    exec(compile(source, f"<encoder {model.__name__}>", "exec"), namespace)
+    encode = namespace["encode"]
+    encode.__doc__ = f"Encode a row as a {model.__name__}."
+    return encode
@@ -1,26 +1,29 @@
 from typing import Dict, Any
+from functools import partial
 from psycopg2.errors import ForeignKeyViolation
 from ..models import Login
 from flask import current_app
 from ..db import Database
 from flask_jwt_extended import create_access_token
 import datetime
-from ..services.token_service import add_token_to_blacklist
+from ..services.token_service import add_token_to_blacklist, revoke_all_user_tokens
 from ..services.mfa_service import check_mfa_enabled
 
 
 def login(data: Login) -> tuple[Dict[str, Any], int]:
     db_instance: Database = current_app.config['DATABASE']
-    bcrypt = current_app.config['BCRYPT']
+    password_hasher = current_app.config['PASSWORD_HASHER']
     try:
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 select_user_query = """
-                    SELECT user_id, login, user_type, password_hash,
-                        first_name, last_name, medical_insurance_id
-                    FROM users
-                    WHERE email = %s AND hidden IS NOT TRUE
-                    ORDER BY modified_at DESC
+                    SELECT u.user_id, u.login, u.user_type, u.password_hash,
+                        u.first_name, u.last_name, u.medical_insurance_id,
+                        COALESCE(tg.generation, 0)
+                    FROM users_current u
+                    LEFT JOIN token_generations tg ON tg.user_id = u.user_id
+                    WHERE u.email = %s AND u.hidden IS NOT TRUE
+                    ORDER BY u.modified_at DESC
                     LIMIT 1;
                 """
                 cur.execute(select_user_query, (
@@ -28,65 +31,75 @@ def login(data: Login) -> tuple[Dict[str, Any], int]:
                 ))
                 user_row = cur.fetchone()
 
-                if not user_row:
-                    return {"status": "Wrong credentials"}, 401
+        if not user_row:
+            return {"status": "Wrong credentials"}, 401
 
-                user_id, login, user_type, password_hash, first_name, last_name, medical_insurance_id = user_row
+        user_id, login, user_type, password_hash, first_name, last_name, medical_insurance_id, generation = user_row
 
-                if bcrypt.check_password_hash(password_hash, data.password):
-                    mfa_enabled = check_mfa_enabled(user_id)
+        # Checked once the connection is back in the pool, by a worker
+        # process of the password hasher.
+        if password_hasher.check(password_hash, data.password):
+            # The password is known now: upgrade a hash made with another
+            # cost, without making the login wait for it.
+            if password_hasher.needs_rehash(password_hash):
+                password_hasher.rehash_async(data.password, partial(
+                    store_rehashed_password, db_instance, user_id, password_hash))
 
-                    token_payload = {
-                        'user_id': user_id,
-                        'login': login,
-                        'user_type': user_type,
-                        'name': f"{first_name} {last_name}",
-                        'medical_insurance_id': medical_insurance_id
+            mfa_enabled = check_mfa_enabled(user_id)
+
+            token_payload = {
+                'user_id': user_id,
+                'login': login,
+                'user_type': user_type,
+                'name': f"{first_name} {last_name}",
+                'medical_insurance_id': medical_insurance_id,
+                # Checked against the user's current generation.
+                'gen': generation
+            }
+
+            expires = datetime.timedelta(days=1)
+
+            if mfa_enabled:
+                temp_expires = datetime.timedelta(minutes=5)
+                access_token = create_access_token(
+                    identity=user_id,
+                    additional_claims={
+                        **token_payload, 'temp_auth': True,
+                        'requires_mfa': True},
+                    expires_delta=temp_expires
+                )
+
+                return {
+                    "status": "MFA Required",
+                    "temp_token": access_token,
+                    "user": {
+                        "user_id": user_id,
+                        "user_type": user_type,
+                        "name": f"{first_name} {last_name}",
+                        "medical_insurance_id": medical_insurance_id,
+                        "requires_mfa": True
                     }
+                }, 200
+            else:
+                access_token = create_access_token(
+                    identity=user_id,
+                    additional_claims=token_payload,
+                    expires_delta=expires
+                )
 
-                    expires = datetime.timedelta(days=1)
-
-                    if mfa_enabled:
-                        temp_expires = datetime.timedelta(minutes=5)
-                        access_token = create_access_token(
-                            identity=user_id,
-                            additional_claims={
-                                **token_payload, 'temp_auth': True,
-                                'requires_mfa': True},
-                            expires_delta=temp_expires
-                        )
-
-                        return {
-                            "status": "MFA Required",
-                            "temp_token": access_token,
-                            "user": {
-                                "user_id": user_id,
-                                "user_type": user_type,
-                                "name": f"{first_name} {last_name}",
-                                "medical_insurance_id": medical_insurance_id,
-                                "requires_mfa": True
-                            }
-                        }, 200
-                    else:
-                        access_token = create_access_token(
-                            identity=user_id,
-                            additional_claims=token_payload,
-                            expires_delta=expires
-                        )
-
-                        return {
-                            "status": "Success",
-                            "token": access_token,
-                            "user": {
-                                "user_id": user_id,
-                                "user_type": user_type,
-                                "name": f"{first_name} {last_name}",
-                                "medical_insurance_id": medical_insurance_id,
-                                "requires_mfa": False
-                            }
-                        }, 200
-                else:
-                    return {"status": "Wrong credentials"}, 401
+                return {
+                    "status": "Success",
+                    "token": access_token,
+                    "user": {
+                        "user_id": user_id,
+                        "user_type": user_type,
+                        "name": f"{first_name} {last_name}",
+                        "medical_insurance_id": medical_insurance_id,
+                        "requires_mfa": False
+                    }
+                }, 200
+        else:
+            return {"status": "Wrong credentials"}, 401
 
     except ForeignKeyViolation:
         raise ForeignKeyViolation("Invalid foreign key reference.")
@@ -94,6 +107,35 @@ def login(data: Login) -> tuple[Dict[str, Any], int]:
         raise e
 
 
+def store_rehashed_password(db_instance: Database, user_id: str, old_hash: str, new_hash: str) -> bool:
+    """
+    Replace the password hash of the user's current version, made with
+    another cost, by `new_hash` of the same password. Compare-and-swap: a
+    password changed in the meantime is left alone. The version isn't
+    copied, the password and the history of the user are unchanged.
+    """
+    with db_instance.get_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                query = """
+                    UPDATE users SET password_hash = %(new_hash)s
+                    WHERE unique_id = (
+                        SELECT unique_id FROM users_current WHERE user_id = %(user_id)s
+                    ) AND password_hash = %(old_hash)s
+                """
+                cur.execute(query, {
+                    "new_hash": new_hash,
+                    "user_id": user_id,
+                    "old_hash": old_hash,
+                })
+                stored = cur.rowcount == 1
+                conn.commit()
+                return stored
+        except Exception:
+            conn.rollback()
+            raise
+
+
 def logout(token_jti: str, user_id: str, expires_at: datetime.datetime) -> tuple[Dict[str, Any], int]:
     try:
         add_token_to_blacklist(token_jti, 'access', user_id, expires_at)
@@ -102,3 +144,13 @@ def logout(token_jti: str, user_id: str, expires_at: datetime.datetime) -> tuple
     except Exception as e:
         current_app.logger.error(f"Error during logout: {str(e)}")
         return {"status": "Error during logout", "error": str(e)}, 500
+
+
+def logout_everywhere(user_id: str) -> tuple[Dict[str, Any], int]:
+    try:
+        revoke_all_user_tokens(user_id)
+
+        return {"status": "Successfully logged out everywhere"}, 200
+    except Exception as e:
+        current_app.logger.error(f"Error during logout everywhere: {str(e)}")
+        return {"status": "Error during logout everywhere", "error": str(e)}, 500
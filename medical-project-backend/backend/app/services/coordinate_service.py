@@ -3,6 +3,7 @@ from psycopg2.errors import ForeignKeyViolation
 from ..models import CoordinateCreate, HistoryCreate, CoordinateUpdate, CoordinateUpdateResponse, CoordinateCreateResponse, PatientUpdateResponse, EmailPhoneUpdate
 from flask import current_app
 from ..db import Database
+from ..cache import charts_of_user, invalidate_patients
 
 
 def add_coordinates(user_id: str, data: CoordinateCreate) -> tuple[Dict[str, Any], int]:
@@ -26,7 +27,9 @@ def add_coordinates(user_id: str, data: CoordinateCreate) -> tuple[Dict[str, Any
                 ))
                 coordinate_id = cur.fetchone()[0]
 
+                charts = charts_of_user(cur, user_id)
                 conn.commit()
+                invalidate_patients(charts)
 
                 coordinate_response = CoordinateCreateResponse(
                     coordinate_id=coordinate_id,
@@ -48,7 +51,7 @@ def update_coordinates(coordinate_id: str, data: CoordinateUpdate) -> tuple[Dict
                 select_previous_coordinate_query = """
                     SELECT user_id, street_address, apartment,
                         postal_code, city, country, created_at
-                    FROM coordinates
+                    FROM coordinates_current
                     WHERE coordinate_id = %s
                 """
                 cur.execute(select_previous_coordinate_query, (
@@ -103,7 +106,9 @@ def update_coordinates(coordinate_id: str, data: CoordinateUpdate) -> tuple[Dict
                     coordinate_data["created_at"],
                 ))
 
+                charts = charts_of_user(cur, coordinate_data["user_id"])
                 conn.commit()
+                invalidate_patients(charts)
 
         coordinate_response = CoordinateUpdateResponse(
             coordinate_id=coordinate_id,
@@ -128,7 +133,7 @@ def update_email_phone(user_id: str, data: EmailPhoneUpdate) -> tuple[Dict[str,
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 select_created_at_query = """
-                    SELECT user_id, login, password_hash, user_type, first_name, last_name, phone_number, email, gender, city_of_birth, date_of_birth, created_at, medical_insurance_id FROM users
+                    SELECT user_id, login, password_hash, user_type, first_name, last_name, phone_number, email, gender, city_of_birth, date_of_birth, created_at, medical_insurance_id FROM users_current
                     WHERE user_id = %s
                 """
                 cur.execute(select_created_at_query, (
@@ -183,7 +188,9 @@ def update_email_phone(user_id: str, data: EmailPhoneUpdate) -> tuple[Dict[str,
                     patient_data["created_at"],
                 ))
 
+                charts = charts_of_user(cur, user_id)
                 conn.commit()
+                invalidate_patients(charts)
 
         patient_response = PatientUpdateResponse(
             user_id=user_id,
@@ -215,10 +222,15 @@ def hide_coordinates(coordinate_id: str) -> tuple[Dict[str, Any], int]:
                 hide_coordinate_query = """
                     UPDATE coordinates SET hidden = TRUE
                     WHERE coordinate_id = %s
+                    RETURNING user_id
                 """
                 cur.execute(hide_coordinate_query, (coordinate_id, ))
 
+                user_ids = {row[0] for row in cur.fetchall()}
+                charts = [chart for user_id in user_ids
+                          for chart in charts_of_user(cur, user_id)]
                 conn.commit()
+                invalidate_patients(charts)
 
                 return {"status": "success"}, 200
 
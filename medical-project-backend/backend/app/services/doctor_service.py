@@ -1,50 +1,86 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from flask import current_app
-from ..db import Database
+from werkzeug.datastructures import ETags
+from ..db import Database, READ
 from ..models import DoctorListResponse
+from ..utils.streaming import server_side_rows, prime
+from ..serialization import compile_encoder
+from ..utils.conditional import etag_matches
 from psycopg2.errors import ForeignKeyViolation
 
+# ETag of the listing, hashed from the row versions of the rows it shows.
+_DOCTORS_ETAG_QUERY = """
+    SELECT md5(string_agg(row_version::text, ',' ORDER BY row_version))
+    FROM users_current
+    WHERE user_type = 'DOCTOR' AND hidden IS NOT TRUE
+"""
 
-def get_all_doctors() -> tuple[Dict[str, Any], int]:
+_DOCTORS_QUERY = f"""
+    SELECT
+        user_id,
+        first_name,
+        last_name,
+        email,
+        phone_number,
+        modified_at,
+        ({_DOCTORS_ETAG_QUERY}) AS etag
+    FROM users_current
+    WHERE user_type = 'DOCTOR' and hidden IS NOT TRUE
+    ORDER BY user_id;
+"""
+_encode_doctor = compile_encoder(
+    DoctorListResponse,
+    columns=("user_id", "first_name", "last_name", "email", "phone_number"))
+
+
+def get_all_doctors(known_etags: Optional[ETags] = None) -> tuple[Dict[str, Any], int]:
     """
     Retrieve all users with DOCTOR user type.
 
+    Args:
+        known_etags: ETags of the request's If-None-Match. When the listing's
+            ETag is one of them, it isn't built and the status is 304.
+
     Returns:
-        tuple[Dict[str, Any], int]: A tuple containing response data and status code
+        tuple[Dict[str, Any], int]: A tuple containing response data, its
+            ETag and status code
     """
     db_instance: Database = current_app.config['DATABASE']
     try:
-        with db_instance.get_conn() as conn:
+        with db_instance.get_conn(intent=READ) as conn:
             with conn.cursor() as cur:
-                doctors_query = """
-                    SELECT DISTINCT ON (user_id)
-                        user_id,
-                        first_name,
-                        last_name,
-                        email,
-                        phone_number,
-                        modified_at
-                    FROM users
-                    WHERE user_type = 'DOCTOR' and hidden IS NOT TRUE
-                    ORDER BY user_id, modified_at DESC;
-                """
-                cur.execute(doctors_query)
-                doctor_rows = cur.fetchall()
-
-                doctors = []
-                for doctor in doctor_rows:
-                    doctors.append({
-                        "user_id": doctor[0],
-                        "first_name": doctor[1],
-                        "last_name": doctor[2],
-                        "email": doctor[3],
-                        "phone_number": doctor[4]
-                    })
-
-                doctors_response = [DoctorListResponse(
-                    **doctor).model_dump() for doctor in doctors]
-
-                return {"status": "success", "data": doctors_response}, 200
+                if known_etags:
+                    cur.execute(_DOCTORS_ETAG_QUERY)
+                    etag = cur.fetchone()[0]
+                    if etag_matches(known_etags, etag):
+                        return {"status": "not_modified", "etag": etag}, 304
+
+                cur.execute(_DOCTORS_QUERY)
+                rows = cur.fetchall()
+                doctors_response = [_encode_doctor(doctor)
+                                    for doctor in rows]
+                etag = rows[0][-1] if rows else None
+
+                return {"status": "success", "data": doctors_response, "etag": etag}, 200
+
+    except Exception as e:
+        return {"status": "error", "message": repr(e)}, 500
 
+
+def stream_all_doctors() -> tuple[Dict[str, Any], int]:
+    """
+    Same as get_all_doctors, but `data` is an iterator yielding the doctors
+    one at a time from a server-side cursor, for NDJSON responses.
+    """
+    db_instance: Database = current_app.config['DATABASE']
+
+    def doctors():
+        with db_instance.get_conn(intent=READ) as conn:
+            for doctor in server_side_rows(conn, "doctors", _DOCTORS_QUERY):
+                yield _encode_doctor(doctor)
+
+    try:
+        records = prime(doctors())
+        return {"status": "success", "data": records or iter(())}, 200
     except Exception as e:
         return {"status": "error", "message": repr(e)}, 500
@@ -1,47 +1,86 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from flask import current_app
-from ..db import Database
+from werkzeug.datastructures import ETags
+from ..db import Database, READ
 from ..models import EstablishmentListResponse
+from ..utils.streaming import server_side_rows, prime
+from ..serialization import compile_encoder
+from ..utils.conditional import etag_matches
 from psycopg2.errors import ForeignKeyViolation
 
+# ETag of the listing, hashed from the row versions of the rows it shows.
+_ESTABLISHMENTS_ETAG_QUERY = """
+    SELECT md5(string_agg(row_version::text, ',' ORDER BY row_version))
+    FROM establishments
+    WHERE hidden IS NOT TRUE
+"""
 
-def get_all_establishments() -> tuple[Dict[str, Any], int]:
+_ESTABLISHMENTS_QUERY = f"""
+    SELECT
+        establishment_id,
+        establishment_name,
+        created_at,
+        ({_ESTABLISHMENTS_ETAG_QUERY}) AS etag
+    FROM establishments
+    WHERE hidden IS NOT TRUE
+    ORDER BY establishment_name;
+"""
+_encode_establishment = compile_encoder(
+    EstablishmentListResponse,
+    columns=("establishment_id", "establishment_name", "created_at"))
+
+
+def get_all_establishments(known_etags: Optional[ETags] = None) -> tuple[Dict[str, Any], int]:
     """
     Retrieve all medical establishments.
 
+    Args:
+        known_etags: ETags of the request's If-None-Match. When the listing's
+            ETag is one of them, it isn't built and the status is 304.
+
     Returns:
-        tuple[Dict[str, Any], int]: A tuple containing response data and status code
+        tuple[Dict[str, Any], int]: A tuple containing response data, its
+            ETag and status code
     """
     db_instance: Database = current_app.config['DATABASE']
     try:
-        with db_instance.get_conn() as conn:
+        with db_instance.get_conn(intent=READ) as conn:
             with conn.cursor() as cur:
-                # Query to get all establishments
-                establishments_query = """
-                    SELECT
-                        establishment_id,
-                        establishment_name,
-                        created_at
-                    FROM establishments
-                    WHERE hidden IS NOT TRUE
-                    ORDER BY establishment_name;
-                """
-                cur.execute(establishments_query)
-                establishment_rows = cur.fetchall()
+                if known_etags:
+                    cur.execute(_ESTABLISHMENTS_ETAG_QUERY)
+                    etag = cur.fetchone()[0]
+                    if etag_matches(known_etags, etag):
+                        return {"status": "not_modified", "etag": etag}, 304
+
+                cur.execute(_ESTABLISHMENTS_QUERY)
+                rows = cur.fetchall()
+                establishments_response = [_encode_establishment(establishment)
+                                           for establishment in rows]
+                etag = rows[0][-1] if rows else None
+
+                return {"status": "success", "data": establishments_response, "etag": etag}, 200
 
-                establishments = []
-                for establishment in establishment_rows:
-                    establishments.append({
-                        "establishment_id": establishment[0],
-                        "establishment_name": establishment[1],
-                        "created_at": establishment[2]
-                    })
+    except Exception as e:
+        return {"status": "error", "message": repr(e)}, 500
 
-                establishments_response = [EstablishmentListResponse(
-                    **establishment).model_dump() for establishment in establishments]
 
-                return {"status": "success", "data": establishments_response}, 200
+def stream_all_establishments() -> tuple[Dict[str, Any], int]:
+    """
+    Same as get_all_establishments, but `data` is an iterator yielding the
+    establishments one at a time from a server-side cursor, for NDJSON
+    responses.
+    """
+    db_instance: Database = current_app.config['DATABASE']
+
+    def establishments():
+        with db_instance.get_conn(intent=READ) as conn:
+            for establishment in server_side_rows(
+                    conn, "establishments", _ESTABLISHMENTS_QUERY):
+                yield _encode_establishment(establishment)
 
+    try:
+        records = prime(establishments())
+        return {"status": "success", "data": records or iter(())}, 200
     except Exception as e:
         return {"status": "error", "message": repr(e)}, 500
 
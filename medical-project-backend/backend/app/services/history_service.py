@@ -3,6 +3,7 @@ from psycopg2.errors import ForeignKeyViolation
 from ..models import HistoryCreate, HistoryUpdate, MedicalHistoryUpdateResponse, HistoryCreateResponse
 from flask import current_app
 from ..db import Database
+from ..cache import invalidate_patients
 from ..utils.lookup_helpers import lookup_doctor_id
 
 
@@ -41,6 +42,7 @@ def add_history(medical_insurance_id: str, data: HistoryCreate) -> tuple[Dict[st
                 history_id = cur.fetchone()[0]
 
                 conn.commit()
+                invalidate_patients([medical_insurance_id])
 
                 history_response = HistoryCreateResponse(
                     history_id=history_id,
@@ -62,7 +64,7 @@ def update_history(history_id: str, data: HistoryUpdate) -> tuple[Dict[str, Any]
                 select_created_at_query = """
                     SELECT diagnostic, treatment, doctor_id,
                         start_date, end_date, created_at, patient_id
-                    FROM medical_history
+                    FROM medical_history_current
                     WHERE history_id = %s
                 """
                 cur.execute(select_created_at_query, (
@@ -118,6 +120,7 @@ def update_history(history_id: str, data: HistoryUpdate) -> tuple[Dict[str, Any]
                 ))
 
                 conn.commit()
+                invalidate_patients([history_data["patient_id"]])
 
         history_response = MedicalHistoryUpdateResponse(
             patient_id=history_data["patient_id"],
@@ -144,10 +147,13 @@ def hide_history(history_id: str) -> tuple[Dict[str, Any], int]:
                 hide_history_query = """
                     UPDATE medical_history SET hidden = TRUE
                     WHERE history_id = %s
+                    RETURNING patient_id
                 """
                 cur.execute(hide_history_query, (history_id, ))
 
+                patient_ids = [row[0] for row in cur.fetchall()]
                 conn.commit()
+                invalidate_patients(patient_ids)
 
                 return {"status": "success"}, 200
 
@@ -65,7 +65,7 @@ def setup_mfa(user_id: str) -> Tuple[Dict[str, Any], int]:
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 select_query = """
-                    SELECT email FROM users
+                    SELECT email FROM users_current
                     WHERE user_id = %s
                 """
                 cur.execute(select_query, (user_id,))
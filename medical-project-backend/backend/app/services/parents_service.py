@@ -3,6 +3,7 @@ from psycopg2.errors import ForeignKeyViolation
 from ..models import CoordinateCreate, HistoryCreate, CoordinateUpdate, CoordinateUpdateResponse, CoordinateCreateResponse, ParentCreate
 from flask import current_app
 from ..db import Database
+from ..cache import charts_of_user, invalidate_patients
 
 
 def add_parents(child_user_id: str, parent_user_id: str) -> tuple[Dict[str, Any], int]:
@@ -19,7 +20,9 @@ def add_parents(child_user_id: str, parent_user_id: str) -> tuple[Dict[str, Any]
                     parent_user_id
                 ))
 
+                charts = charts_of_user(cur, child_user_id)
                 conn.commit()
+                invalidate_patients(charts)
 
                 return {"status": "success"}, 201
 
@@ -35,7 +38,7 @@ def add_parents_alt(child_user_id: str, data: ParentCreate) -> tuple[Dict[str, A
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 check_existence_query = """
-                    SELECT EXISTS(SELECT 1 FROM users WHERE user_id=%s)
+                    SELECT EXISTS(SELECT 1 FROM users_current WHERE user_id=%s)
                 """
                 cur.execute(check_existence_query, (
                     child_user_id,
@@ -67,7 +70,9 @@ def add_parents_alt(child_user_id: str, data: ParentCreate) -> tuple[Dict[str, A
                     user_id,
                 ))
 
+                charts = charts_of_user(cur, child_user_id)
                 conn.commit()
+                invalidate_patients(charts)
 
                 return {"status": "success", "user_id": user_id}, 201
 
@@ -89,7 +94,9 @@ def hide_parents(child_user_id: str, parent_user_id: str) -> tuple[Dict[str, Any
                 cur.execute(hide_coordinate_query,
                             (child_user_id, parent_user_id))
 
+                charts = charts_of_user(cur, child_user_id)
                 conn.commit()
+                invalidate_patients(charts)
 
                 return {"status": "success"}, 200
 
@@ -1,21 +1,27 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from psycopg2.errors import ForeignKeyViolation
 from ..models import PatientCreate, PatientUpdate, PatientResponse, PatientUpdateResponse, PatientCreateResponse, CoordinateResponse, MedicalHistoryResponse, MedicalVisitResponse, ParentResponse
 from flask import current_app
-from ..db import Database
+from werkzeug.datastructures import ETags
+from ..db import Database, READ, WRITE
+from ..cache import charts_of_user, invalidate_patients
+from ..utils.version_replay import VersionState, replay_versions, diff_snapshots
+from ..utils.streaming import server_side_rows, prime
+from ..serialization import compile_encoder
+from ..utils.conditional import etag_matches
 from datetime import date, datetime
-import bcrypt
+from functools import lru_cache
+import hashlib
 
 
 def add_patient(data: PatientCreate) -> tuple[Dict[str, Any], int]:
     db_instance: Database = current_app.config['DATABASE']
     try:
+        # Hashed before checking out a connection, which would sit idle
+        # meanwhile.
+        password_hash = current_app.config['PASSWORD_HASHER'].hash(data.password)
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
-                password_bytes = (data.password).encode('utf-8')
-                salt = bcrypt.gensalt()
-                pwhash = bcrypt.hashpw(password_bytes, salt)
-                password_hash = pwhash.decode('utf8')
                 insert_user_query = """
                     INSERT INTO users (login, password_hash, user_type, first_name, last_name, phone_number, email, medical_insurance_id, gender, city_of_birth, date_of_birth)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
@@ -87,7 +93,7 @@ def update_patient(medical_insurance_id: str, data: PatientUpdate) -> tuple[Dict
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 select_created_at_query = """
-                    SELECT user_id, login, password_hash, user_type, first_name, last_name, phone_number, email, gender, city_of_birth, date_of_birth, created_at FROM users
+                    SELECT user_id, login, password_hash, user_type, first_name, last_name, phone_number, email, gender, city_of_birth, date_of_birth, created_at FROM users_current
                     WHERE medical_insurance_id = %s
                 """
                 cur.execute(select_created_at_query, (
@@ -159,7 +165,9 @@ def update_patient(medical_insurance_id: str, data: PatientUpdate) -> tuple[Dict
                     patient_data["created_at"],
                 ))
 
+                charts = charts_of_user(cur, patient_data["user_id"])
                 conn.commit()
+                invalidate_patients(charts)
 
         patient_response = PatientUpdateResponse(
             user_id=patient_data["user_id"],
@@ -183,262 +191,257 @@ def update_patient(medical_insurance_id: str, data: PatientUpdate) -> tuple[Dict
         raise e
 
 
-def get_patient(medical_insurance_id: str) -> tuple[Dict[str, Any], int]:
+# Lists of the patient document. Each is aggregated by a lateral subquery
+# of the patient query, as `document`, along with the row versions it is
+# built from, as `versions`: the query only joins the lists a projection
+# asks for. Each lateral subquery keeps the latest version of its rows,
+# and doctors are resolved to their latest version so that edits to a
+# doctor don't duplicate the history or visit entries.
+_PATIENT_LISTS = {
+    "coordinates": ("""
+        json_agg(json_build_object(
+            'id', c.coordinate_id,
+            'street_address', c.street_address,
+            'apartment', c.apartment,
+            'postal_code', c.postal_code,
+            'city', c.city,
+            'country', c.country
+        ) ORDER BY c.coordinate_id)
+    """, """
+        string_agg(c.row_version::text, ',' ORDER BY c.row_version)
+    """, """
+        FROM coordinates_current c
+        WHERE c.user_id = u.user_id AND c.hidden IS NOT TRUE
+    """),
+    "medical_history": ("""
+        json_agg(json_build_object(
+            'id', mh.history_id,
+            'diagnostic', mh.diagnostic,
+            'treatment', mh.treatment,
+            'doctor', json_build_object(
+                'id', d.user_id,
+                'login', d.login,
+                'user_type', d.user_type,
+                'first_name', d.first_name,
+                'last_name', d.last_name
+            ),
+            'start_date', mh.start_date,
+            'end_date', mh.end_date
+        ) ORDER BY mh.history_id)
+    """, """
+        string_agg(concat_ws(':', mh.row_version, d.row_version), ','
+                   ORDER BY mh.row_version)
+    """, """
+        FROM medical_history_current mh
+        JOIN users_current d ON d.user_id = mh.doctor_id
+        WHERE mh.patient_id = u.medical_insurance_id AND mh.hidden IS NOT TRUE
+    """),
+    "medical_visits": ("""
+        json_agg(json_build_object(
+            'id', mv.visit_id,
+            'patient_id', mv.patient_id,
+            'doctor', json_build_object(
+                'id', d.user_id,
+                'login', d.login,
+                'user_type', d.user_type,
+                'first_name', d.first_name,
+                'last_name', d.last_name
+            ),
+            'visit_date', mv.visit_date,
+            'diagnostic_established', mv.diagnostic_established,
+            'treatment', mv.treatment,
+            'visit_summary', mv.visit_summary,
+            'notes', mv.notes,
+            'created_at', mv.created_at,
+            'modified_at', mv.modified_at,
+            'establishment', json_build_object(
+                'establishment_id', e.establishment_id,
+                'establishment_name', e.establishment_name,
+                'created_at', e.created_at
+            )
+        ) ORDER BY mv.visit_id)
+    """, """
+        string_agg(concat_ws(':', mv.row_version, d.row_version, e.row_version), ','
+                   ORDER BY mv.row_version)
+    """, """
+        FROM medical_visits_current mv
+        LEFT JOIN users_current d ON d.user_id = mv.doctor_id
+        LEFT JOIN establishments e ON mv.establishment_id = e.establishment_id
+        WHERE mv.patient_id = u.medical_insurance_id AND mv.hidden IS NOT TRUE
+    """),
+    "parents": ("""
+        json_agg(json_build_object(
+            'parent', json_build_object(
+                'user_id', pu.user_id,
+                'login', pu.login,
+                'user_type', pu.user_type,
+                'first_name', pu.first_name,
+                'last_name', pu.last_name,
+                'phone_number', pu.phone_number,
+                'email', pu.email,
+                'created_at', pu.created_at,
+                'modified_at', pu.modified_at
+            )
+        ) ORDER BY p.parent_id)
+    """, """
+        string_agg(concat_ws(':', p.row_version, pu.row_version), ','
+                   ORDER BY p.row_version)
+    """, """
+        FROM parents p
+        JOIN users_current pu ON pu.user_id = p.parent_id
+        WHERE p.child_id = u.user_id AND p.hidden IS NOT TRUE
+    """),
+}
+
+# Members of the patient document, in the order of the response model.
+# Those that aren't lists are columns of the user's row.
+PATIENT_MEMBERS = tuple(PatientResponse.model_fields)
+
+
+def _patient_projection(fields: Optional[list[str]], include: Optional[list[str]]) -> tuple[str, ...]:
+    """
+    Members of the patient document a request asks for: the members named
+    by `fields` (every field of the user's row when absent) and the lists
+    named by `include`. Without either, the whole document.
+
+    Raises:
+        ValueError: On an unknown member or list.
+    """
+    unknown = [name for name in fields or () if name not in PATIENT_MEMBERS]
+    unknown += [name for name in include or () if name not in _PATIENT_LISTS]
+    if unknown:
+        raise ValueError(f"Unknown patient fields: {', '.join(unknown)}.")
+    if fields is None and include is None:
+        return PATIENT_MEMBERS
+    if fields is None:
+        fields = [name for name in PATIENT_MEMBERS if name not in _PATIENT_LISTS]
+    requested = set(fields) | set(include or ())
+    if not requested:
+        raise ValueError("At least one patient field is required.")
+    return tuple(name for name in PATIENT_MEMBERS if name in requested)
+
+
+@lru_cache(maxsize=64)
+def _patient_query(members: tuple[str, ...], document: bool = True) -> str:
+    """
+    The query of the patient document restricted to `members`, assembled by
+    PostgreSQL in a single round trip, and the row versions it is built
+    from. Without `document`, the row versions alone: the ETag probe.
+    """
+    lists = [name for name in members if name in _PATIENT_LISTS]
+    joins = []
+    for name in lists:
+        aggregate, versions, source = _PATIENT_LISTS[name]
+        columns = f"{aggregate.strip()} AS document, {versions.strip()} AS versions" \
+            if document else f"{versions.strip()} AS versions"
+        joins.append(f"LEFT JOIN LATERAL (SELECT {columns} {source.strip()}) {name} ON TRUE")
+
+    versions = ", ".join(["u.row_version::text"] + [f"{name}.versions" for name in lists])
+    columns = f"ARRAY[{versions}]"
+    if document:
+        entries = ", ".join(
+            f"'{name}', COALESCE({name}.document, '[]'::json)" if name in _PATIENT_LISTS
+            else f"'{name}', u.{name}"
+            for name in members)
+        columns = f"json_build_object({entries}), {columns}"
+    return f"""
+        SELECT {columns}
+        FROM (
+            SELECT *
+            FROM users_current
+            WHERE medical_insurance_id = %(medical_insurance_id)s AND hidden IS NOT TRUE
+            ORDER BY unique_id DESC
+            LIMIT 1
+        ) u
+        {" ".join(joins)}
+    """
+
+
+@lru_cache(maxsize=64)
+def _patient_encoder(members: tuple[str, ...]):
+    return compile_encoder(
+        PatientResponse, exclude=[name for name in PATIENT_MEMBERS if name not in members])
+
+
+def _patient_versions(members: tuple[str, ...], versions: list) -> dict:
+    """Row versions of the patient query, keyed by the part they come from."""
+    parts = ["patient"] + [name for name in members if name in _PATIENT_LISTS]
+    return dict(zip(parts, versions))
+
+
+def _patient_etag(members: tuple[str, ...], versions: dict) -> str:
+    """
+    ETag of a projection of the patient document: a hash of its members and
+    of the versions of the rows it is built from. The set of versions
+    changes with any insert, edit or hide of those rows, even when
+    concurrent transactions commit out of order.
+    """
+    parts = ["patient"] + [name for name in members if name in _PATIENT_LISTS]
+    value = ",".join(members) + "|" + "|".join(versions.get(part) or "" for part in parts)
+    return hashlib.md5(value.encode("utf-8")).hexdigest()
+
+
+def get_patient(medical_insurance_id: str, known_etags: Optional[ETags] = None,
+                fields: Optional[list[str]] = None,
+                include: Optional[list[str]] = None) -> tuple[Dict[str, Any], int]:
+    """
+    The current document of a patient and its ETag. When the ETag is one of
+    `known_etags` (the request's If-None-Match), the document isn't built
+    and a 304 status is returned instead.
+
+    `fields` and `include` project the document (see _patient_projection):
+    lists that aren't asked for aren't queried at all.
+    """
     db_instance: Database = current_app.config['DATABASE']
+    patient_cache = current_app.config['PATIENT_CACHE']
     try:
-        with db_instance.get_conn() as conn:
+        members = _patient_projection(fields, include)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
+    whole = members == PATIENT_MEMBERS
+    try:
+        # The version is read before the document is built: a write
+        # committed in between invalidates it and the document isn't cached.
+        # Only whole documents are cached, projections are read from them.
+        version = patient_cache.version(medical_insurance_id)
+        cached = patient_cache.get(medical_insurance_id, version)
+        if cached is not None:
+            etag = _patient_etag(members, cached["versions"])
+            if etag_matches(known_etags, etag):
+                return {"status": "not_modified", "etag": etag}, 304
+            patient = cached["data"] if whole \
+                else {name: cached["data"][name] for name in members}
+            return {"status": "success", "data": patient, "etag": etag}, 200
+
+        # Documents that get cached are read from the primary, a lagging
+        # replica could still return what a write just invalidated.
+        intent = WRITE if patient_cache.enabled and whole else READ
+        params = {"medical_insurance_id": medical_insurance_id}
+        with db_instance.get_conn(intent=intent) as conn:
             with conn.cursor() as cur:
-                patient_query = """
-                    SELECT
-                        medical_insurance_id,
-                        gender,
-                        city_of_birth,
-                        user_id,
-                        login,
-                        user_type,
-                        first_name,
-                        last_name,
-                        phone_number,
-                        email,
-                        modified_at,
-                        created_at,
-                        date_of_birth
-                    FROM users
-                    WHERE medical_insurance_id = %s AND hidden IS NOT TRUE
-                    ORDER BY unique_id DESC
-                    LIMIT 1;
-                """
-                cur.execute(patient_query, (medical_insurance_id,))
+                if known_etags:
+                    cur.execute(_patient_query(members, document=False), params)
+                    etag_row = cur.fetchone()
+                    if etag_row:
+                        etag = _patient_etag(
+                            members, _patient_versions(members, etag_row[0]))
+                        if etag_matches(known_etags, etag):
+                            return {"status": "not_modified", "etag": etag}, 304
+
+                cur.execute(_patient_query(members), params)
                 patient_row = cur.fetchone()
 
                 if not patient_row:
                     return {"status": "error", "message": "Patient not found."}, 404
 
-                patient_data = {
-                    "medical_insurance_id": patient_row[0],
-                    "gender": patient_row[1],
-                    "city_of_birth": patient_row[2],
-                    "user_id": patient_row[3],
-                    "login": patient_row[4],
-                    "user_type": patient_row[5],
-                    "first_name": patient_row[6],
-                    "last_name": patient_row[7],
-                    "phone_number": patient_row[8],
-                    "email": patient_row[9],
-                    "modified_at": patient_row[10],
-                    "created_at": patient_row[11],
-                    "date_of_birth": patient_row[12]
-                }
-
-                coordinates_query = """
-                    SELECT
-                        c.coordinate_id,
-                        c.street_address,
-                        c.apartment,
-                        c.postal_code,
-                        c.city,
-                        c.country,
-                        c.modified_at
-                    FROM (
-                        SELECT
-                            c.*,
-                            ROW_NUMBER() OVER (PARTITION BY c.coordinate_id ORDER BY c.unique_id DESC) AS rn
-                        FROM coordinates c
-                        WHERE c.user_id = %s AND c.hidden IS NOT TRUE
-                    ) c
-                    WHERE c.rn = 1
-                    ORDER BY c.coordinate_id;
-                """
-                cur.execute(coordinates_query,
-                            (patient_row[3],))  # user_id is at index 3
-                coordinates_rows = cur.fetchall()
-
-                coordinates = [
-                    {
-                        "id": coord[0],
-                        "street_address": coord[1],
-                        "apartment": coord[2],
-                        "postal_code": coord[3],
-                        "city": coord[4],
-                        "country": coord[5]
-                    }
-                    for coord in coordinates_rows
-                ]
-                # TODO: Join when theres multiple instance of a doctor_id
-                medical_history_query = """
-                    SELECT
-                        mh.history_id,
-                        mh.diagnostic,
-                        mh.treatment,
-                        d.user_id,
-                        d.login,
-                        d.user_type,
-                        d.first_name,
-                        d.last_name,
-                        mh.start_date,
-                        mh.end_date,
-                        mh.modified_at
-                    FROM (
-                        SELECT
-                            mh.*,
-                            ROW_NUMBER() OVER (PARTITION BY mh.history_id ORDER BY mh.unique_id DESC) AS rn
-                        FROM medical_history mh
-                        WHERE mh.patient_id = %s AND mh.hidden IS NOT TRUE
-                    ) mh
-                    JOIN users d ON mh.doctor_id = d.user_id
-                    WHERE mh.rn = 1;
-                """
-                cur.execute(medical_history_query, (medical_insurance_id,))
-                medical_history_rows = cur.fetchall()
-
-                medical_history = []
-                for mh in medical_history_rows:
-                    medical_history.append({
-                        "id": mh[0],
-                        "diagnostic": mh[1],
-                        "treatment": mh[2],
-                        "doctor": {
-                            "id": mh[3],
-                            "login": mh[4],
-                            "user_type": mh[5],
-                            "first_name": mh[6],
-                            "last_name": mh[7]
-                        },
-                        "start_date": mh[8],
-                        "end_date": mh[9]
-                    })
-
-                # TODO: Join when theres multiple instance of a doctor_id
-                medical_visits_query = """
-                    SELECT
-                        mv.visit_id,
-                        mv.patient_id,
-                        d.user_id,
-                        d.login,
-                        d.user_type,
-                        d.first_name,
-                        d.last_name,
-                        mv.visit_date,
-                        mv.diagnostic_established,
-                        mv.treatment,
-                        mv.visit_summary,
-                        mv.notes,
-                        mv.created_at,
-                        mv.modified_at,
-                        e.establishment_id,
-                        e.establishment_name,
-                        e.created_at as establishment_created_at
-                    FROM (
-                        SELECT
-                            mv.*,
-                            ROW_NUMBER() OVER (PARTITION BY mv.visit_id ORDER BY mv.unique_id DESC) AS rn
-                        FROM medical_visits mv
-                        WHERE mv.patient_id = %s AND mv.hidden IS NOT TRUE
-                    ) mv
-                    LEFT JOIN users d ON mv.doctor_id = d.user_id
-                    LEFT JOIN establishments e ON mv.establishment_id = e.establishment_id
-                    WHERE mv.rn = 1
-                    ORDER BY mv.visit_id;
-                """
-                cur.execute(medical_visits_query, (medical_insurance_id,))
-                medical_visits_rows = cur.fetchall()
-
-                medical_visits = [
-                    {
-                        "id": mv[0],
-                        "patient_id": mv[1],
-                        "doctor": {
-                            "id": mv[2],
-                            "login": mv[3],
-                            "user_type": mv[4],
-                            "first_name": mv[5],
-                            "last_name": mv[6]
-                        },
-                        "visit_date": mv[7].isoformat() if mv[7] else None,
-                        "diagnostic_established": mv[8],
-                        "treatment": mv[9],
-                        "visit_summary": mv[10],
-                        "notes": mv[11],
-                        "created_at": mv[12],
-                        "modified_at": mv[13],
-                        "establishment": {
-                            "establishment_id": mv[14],
-                            "establishment_name": mv[15],
-                            "created_at": mv[16]
-                        }
-                    }
-                    for mv in medical_visits_rows
-                ]
-
-                parents_query = """
-                    SELECT
-                        p.parent_id,
-                        u.login,
-                        u.user_type,
-                        u.first_name,
-                        u.last_name,
-                        u.phone_number,
-                        u.email,
-                        u.created_at,
-                        u.modified_at
-                    FROM parents p
-                    JOIN (
-                        SELECT
-                            *,
-                            ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY modified_at DESC) AS rn
-                        FROM users
-                    ) u ON p.parent_id = u.user_id AND u.rn = 1
-                    WHERE p.child_id = %s AND p.hidden IS NOT TRUE;
-                """
-                cur.execute(parents_query, (patient_data["user_id"],))
-                parents_rows = cur.fetchall()
-
-                parents = []
-                for parent in parents_rows:
-                    parents.append({
-                        "parent": {
-                            "user_id": parent[0],
-                            "login": parent[1],
-                            "user_type": parent[2],
-                            "first_name": parent[3],
-                            "last_name": parent[4],
-                            "phone_number": parent[5],
-                            "email": parent[6],
-                            "created_at": parent[7],
-                            "modified_at": parent[8]
-                        }
-                    })
-
-                coordinates_response = [CoordinateResponse(
-                    **coord) for coord in coordinates]
-                medical_history_response = [
-                    MedicalHistoryResponse(**mh) for mh in medical_history]
-                medical_visits_response = [
-                    MedicalVisitResponse(**mv) for mv in medical_visits]
-                parents_response = [ParentResponse(
-                    **parent) for parent in parents]
-
-                patient_response = PatientResponse(
-                    user_id=patient_data["user_id"],
-                    login=patient_data["login"],
-                    user_type=patient_data["user_type"],
-                    first_name=patient_data["first_name"],
-                    last_name=patient_data["last_name"],
-                    medical_insurance_id=medical_insurance_id,
-                    gender=patient_data["gender"],
-                    city_of_birth=patient_data["city_of_birth"],
-                    email=patient_data["email"],
-                    phone_number=patient_data["phone_number"],
-                    created_at=patient_data["created_at"],
-                    modified_at=patient_data["modified_at"],
-                    date_of_birth=patient_data["date_of_birth"],
-                    coordinates=coordinates_response,
-                    medical_history=medical_history_response,
-                    medical_visits=medical_visits_response,
-                    parents=parents_response
-                )
+                patient = _patient_encoder(members)(patient_row[0])
+                versions = _patient_versions(members, patient_row[1])
+                if whole:
+                    patient_cache.put(medical_insurance_id, version,
+                                      {"data": patient, "versions": versions})
 
-                return {"status": "success", "data": patient_response}, 200
+                return {"status": "success", "data": patient,
+                        "etag": _patient_etag(members, versions)}, 200
 
     except ForeignKeyViolation:
         return {"status": "error", "message": "Invalid foreign key reference."}, 400
@@ -446,263 +449,308 @@ def get_patient(medical_insurance_id: str) -> tuple[Dict[str, Any], int]:
         return {"status": "error", "message": repr(e)}, 500
 
 
-def get_patient_at_date(medical_insurance_id: str, date: date) -> tuple[Dict[str, Any], int]:
+# Encoder of the documents of get_patient_at_date, straight to the response
+# shape: rows come from our own tables and aren't validated again.
+_encode_patient = compile_encoder(PatientResponse)
+
+# Rows of each list of the patient document, built as in get_patient, for
+# stream_patient. Each is read through its own server-side cursor.
+_PATIENT_SECTIONS = {
+    "coordinates": (compile_encoder(CoordinateResponse), """
+        SELECT json_build_object(
+            'id', c.coordinate_id,
+            'street_address', c.street_address,
+            'apartment', c.apartment,
+            'postal_code', c.postal_code,
+            'city', c.city,
+            'country', c.country
+        )
+        FROM coordinates_current c
+        WHERE c.user_id = %(user_id)s AND c.hidden IS NOT TRUE
+        ORDER BY c.coordinate_id;
+    """),
+    "medical_history": (compile_encoder(MedicalHistoryResponse), """
+        SELECT json_build_object(
+            'id', mh.history_id,
+            'diagnostic', mh.diagnostic,
+            'treatment', mh.treatment,
+            'doctor', json_build_object(
+                'id', d.user_id,
+                'login', d.login,
+                'user_type', d.user_type,
+                'first_name', d.first_name,
+                'last_name', d.last_name
+            ),
+            'start_date', mh.start_date,
+            'end_date', mh.end_date
+        )
+        FROM medical_history_current mh
+        JOIN users_current d ON d.user_id = mh.doctor_id
+        WHERE mh.patient_id = %(medical_insurance_id)s AND mh.hidden IS NOT TRUE
+        ORDER BY mh.history_id;
+    """),
+    "medical_visits": (compile_encoder(MedicalVisitResponse), """
+        SELECT json_build_object(
+            'id', mv.visit_id,
+            'patient_id', mv.patient_id,
+            'doctor', json_build_object(
+                'id', d.user_id,
+                'login', d.login,
+                'user_type', d.user_type,
+                'first_name', d.first_name,
+                'last_name', d.last_name
+            ),
+            'visit_date', mv.visit_date,
+            'diagnostic_established', mv.diagnostic_established,
+            'treatment', mv.treatment,
+            'visit_summary', mv.visit_summary,
+            'notes', mv.notes,
+            'created_at', mv.created_at,
+            'modified_at', mv.modified_at,
+            'establishment', json_build_object(
+                'establishment_id', e.establishment_id,
+                'establishment_name', e.establishment_name,
+                'created_at', e.created_at
+            )
+        )
+        FROM medical_visits_current mv
+        LEFT JOIN users_current d ON d.user_id = mv.doctor_id
+        LEFT JOIN establishments e ON mv.establishment_id = e.establishment_id
+        WHERE mv.patient_id = %(medical_insurance_id)s AND mv.hidden IS NOT TRUE
+        ORDER BY mv.visit_id;
+    """),
+    "parents": (compile_encoder(ParentResponse), """
+        SELECT json_build_object(
+            'parent', json_build_object(
+                'user_id', pu.user_id,
+                'login', pu.login,
+                'user_type', pu.user_type,
+                'first_name', pu.first_name,
+                'last_name', pu.last_name,
+                'phone_number', pu.phone_number,
+                'email', pu.email,
+                'created_at', pu.created_at,
+                'modified_at', pu.modified_at
+            )
+        )
+        FROM parents p
+        JOIN users_current pu ON pu.user_id = p.parent_id
+        WHERE p.child_id = %(user_id)s AND p.hidden IS NOT TRUE
+        ORDER BY p.parent_id;
+    """),
+}
+
+_encode_patient_fields = compile_encoder(PatientResponse, exclude=_PATIENT_SECTIONS)
+
+
+def stream_patient(medical_insurance_id: str) -> tuple[Dict[str, Any], int]:
+    """
+    The document of get_patient as an iterator of records, for NDJSON
+    responses: `{"type": "patient", "data": ...}` with the patient's own
+    fields first, then one `{"type": <list>, "data": ...}` record per
+    coordinate, medical history, visit and parent, `type` being the name of
+    the list the item belongs to in the document.
+    """
     db_instance: Database = current_app.config['DATABASE']
-    try:
-        with db_instance.get_conn() as conn:
+
+    def records():
+        with db_instance.get_conn(intent=READ) as conn:
             with conn.cursor() as cur:
-                patient_query = """
-                    SELECT
-                        medical_insurance_id,
-                        gender,
-                        city_of_birth,
-                        user_id,
-                        login,
-                        user_type,
-                        first_name,
-                        last_name,
-                        phone_number,
-                        email,
-                        modified_at,
-                        created_at,
-                        date_of_birth
-                    FROM users
-                    WHERE medical_insurance_id = %s AND hidden IS NOT TRUE AND modified_at <= %s
-                    ORDER BY unique_id DESC
+                cur.execute("""
+                    SELECT json_build_object(
+                        'medical_insurance_id', u.medical_insurance_id,
+                        'gender', u.gender,
+                        'city_of_birth', u.city_of_birth,
+                        'user_id', u.user_id,
+                        'login', u.login,
+                        'user_type', u.user_type,
+                        'first_name', u.first_name,
+                        'last_name', u.last_name,
+                        'phone_number', u.phone_number,
+                        'email', u.email,
+                        'modified_at', u.modified_at,
+                        'created_at', u.created_at,
+                        'date_of_birth', u.date_of_birth
+                    )
+                    FROM users_current u
+                    WHERE u.medical_insurance_id = %s AND u.hidden IS NOT TRUE
+                    ORDER BY u.unique_id DESC
                     LIMIT 1;
-                """
-                cur.execute(patient_query, (medical_insurance_id, date))
-                patient_row = cur.fetchone()
+                """, (medical_insurance_id,))
+                row = cur.fetchone()
+            if row is None:
+                return
+            patient = row[0]
+            yield {"type": "patient", "data": _encode_patient_fields(patient)}
+
+            params = {
+                "user_id": patient["user_id"],
+                "medical_insurance_id": patient["medical_insurance_id"]
+            }
+            for section, (encode, query) in _PATIENT_SECTIONS.items():
+                for (item,) in server_side_rows(conn, section, query, params):
+                    yield {"type": section, "data": encode(item)}
 
-                if not patient_row:
-                    return {"status": "error", "message": "Patient not found."}, 404
+    try:
+        patient = prime(records())
+        if patient is None:
+            return {"status": "error", "message": "Patient not found."}, 404
+        return {"status": "success", "data": patient}, 200
+    except Exception as e:
+        return {"status": "error", "message": repr(e)}, 500
 
-                patient_data = {
-                    "medical_insurance_id": patient_row[0],
-                    "gender": patient_row[1],
-                    "city_of_birth": patient_row[2],
-                    "user_id": patient_row[3],
-                    "login": patient_row[4],
-                    "user_type": patient_row[5],
-                    "first_name": patient_row[6],
-                    "last_name": patient_row[7],
-                    "phone_number": patient_row[8],
-                    "email": patient_row[9],
-                    "modified_at": patient_row[10],
-                    "created_at": patient_row[11],
-                    "date_of_birth": patient_row[12]
-                }
 
-                coordinates_query = """
-                    SELECT
-                        c.coordinate_id,
-                        c.street_address,
-                        c.apartment,
-                        c.postal_code,
-                        c.city,
-                        c.country,
-                        c.modified_at
-                    FROM (
-                        SELECT
-                            c.*,
-                            ROW_NUMBER() OVER (PARTITION BY c.coordinate_id ORDER BY c.unique_id DESC) AS rn
-                        FROM coordinates c
-                        WHERE c.user_id = %s AND c.hidden IS NOT TRUE AND modified_at <= %s
-                    ) c
-                    WHERE c.rn = 1
-                    ORDER BY c.coordinate_id;
-                """
-                cur.execute(coordinates_query,
-                            (patient_row[3], date))  # user_id is at index 3
-                coordinates_rows = cur.fetchall()
-
-                coordinates = [
-                    {
-                        "id": coord[0],
-                        "street_address": coord[1],
-                        "apartment": coord[2],
-                        "postal_code": coord[3],
-                        "city": coord[4],
-                        "country": coord[5]
-                    }
-                    for coord in coordinates_rows
-                ]
-                # TODO: Join when theres multiple instance of a doctor_id
-                medical_history_query = """
-                    SELECT
-                        mh.history_id,
-                        mh.diagnostic,
-                        mh.treatment,
-                        d.user_id,
-                        d.login,
-                        d.user_type,
-                        d.first_name,
-                        d.last_name,
-                        mh.start_date,
-                        mh.end_date,
-                        mh.modified_at
-                    FROM (
-                        SELECT
-                            mh.*,
-                            ROW_NUMBER() OVER (PARTITION BY mh.history_id ORDER BY mh.unique_id DESC) AS rn
-                        FROM medical_history mh
-                        WHERE mh.patient_id = %s AND mh.hidden IS NOT TRUE AND modified_at = %s
-                    ) mh
-                    JOIN users d ON mh.doctor_id = d.user_id
-                    WHERE mh.rn = 1;
-                """
-                cur.execute(medical_history_query,
-                            (medical_insurance_id, date))
-                medical_history_rows = cur.fetchall()
-
-                medical_history = []
-                for mh in medical_history_rows:
-                    medical_history.append({
-                        "id": mh[0],
-                        "diagnostic": mh[1],
-                        "treatment": mh[2],
-                        "doctor": {
-                            "id": mh[3],
-                            "login": mh[4],
-                            "user_type": mh[5],
-                            "first_name": mh[6],
-                            "last_name": mh[7]
-                        },
-                        "start_date": mh[8],
-                        "end_date": mh[9]
-                    })
-
-                # TODO: Join when theres multiple instance of a doctor_id
-                medical_visits_query = """
-                    SELECT
-                        mv.visit_id,
-                        mv.patient_id,
-                        d.user_id,
-                        d.login,
-                        d.user_type,
-                        d.first_name,
-                        d.last_name,
-                        mv.visit_date,
-                        mv.diagnostic_established,
-                        mv.treatment,
-                        mv.visit_summary,
-                        mv.notes,
-                        mv.created_at,
-                        mv.modified_at,
-                        e.establishment_id,
-                        e.establishment_name,
-                        e.created_at as establishment_created_at
+def get_patient_at_date(medical_insurance_id: str, date: date) -> tuple[Dict[str, Any], int]:
+    db_instance: Database = current_app.config['DATABASE']
+    try:
+        with db_instance.get_conn(intent=READ) as conn:
+            with conn.cursor() as cur:
+                # Same document as get_patient, built from the versions whose
+                # valid period contains the requested instant: one
+                # idx_*_valid_period lookup per table instead of a scan of
+                # every older version. Should two versions of an entity still
+                # be open (concurrent writes), the latest one wins. Doctors
+                # and parents are resolved to their latest version, as in the
+                # version history.
+                patient_query = """
+                    SELECT json_build_object(
+                        'medical_insurance_id', cu.medical_insurance_id,
+                        'gender', u.gender,
+                        'city_of_birth', u.city_of_birth,
+                        'user_id', u.user_id,
+                        'login', u.login,
+                        'user_type', u.user_type,
+                        'first_name', u.first_name,
+                        'last_name', u.last_name,
+                        'phone_number', u.phone_number,
+                        'email', u.email,
+                        'modified_at', u.modified_at,
+                        'created_at', u.created_at,
+                        'date_of_birth', u.date_of_birth,
+                        'coordinates', COALESCE(c.coordinates, '[]'::json),
+                        'medical_history', COALESCE(mh.medical_history, '[]'::json),
+                        'medical_visits', COALESCE(mv.medical_visits, '[]'::json),
+                        'parents', COALESCE(p.parents, '[]'::json)
+                    )
                     FROM (
-                        SELECT
-                            mv.*,
-                            ROW_NUMBER() OVER (PARTITION BY mv.visit_id ORDER BY mv.unique_id DESC) AS rn
-                        FROM medical_visits mv
-                        WHERE mv.patient_id = %s AND mv.hidden IS NOT TRUE AND modified_at <= %s
-                    ) mv
-                    LEFT JOIN users d ON mv.doctor_id = d.user_id
-                    LEFT JOIN establishments e ON mv.establishment_id = e.establishment_id
-                    WHERE mv.rn = 1
-                    ORDER BY mv.visit_id;
-                """
-                cur.execute(medical_visits_query, (medical_insurance_id,))
-                medical_visits_rows = cur.fetchall()
-
-                medical_visits = [
-                    {
-                        "id": mv[0],
-                        "patient_id": mv[1],
-                        "doctor": {
-                            "id": mv[2],
-                            "login": mv[3],
-                            "user_type": mv[4],
-                            "first_name": mv[5],
-                            "last_name": mv[6]
-                        },
-                        "visit_date": mv[7].isoformat() if mv[7] else None,
-                        "diagnostic_established": mv[8],
-                        "treatment": mv[9],
-                        "visit_summary": mv[10],
-                        "notes": mv[11],
-                        "created_at": mv[12],
-                        "modified_at": mv[13],
-                        "establishment": {
-                            "establishment_id": mv[14],
-                            "establishment_name": mv[15],
-                            "created_at": mv[16]
-                        }
-                    }
-                    for mv in medical_visits_rows
-                ]
-
-                parents_query = """
-                    SELECT
-                        p.parent_id,
-                        u.login,
-                        u.user_type,
-                        u.first_name,
-                        u.last_name,
-                        u.phone_number,
-                        u.email,
-                        u.created_at,
-                        u.modified_at
-                    FROM parents p
-                    JOIN (
-                        SELECT
-                            *,
-                            ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY modified_at DESC) AS rn
+                        SELECT user_id, medical_insurance_id
+                        FROM users_current
+                        WHERE medical_insurance_id = %(medical_insurance_id)s AND hidden IS NOT TRUE
+                        ORDER BY unique_id DESC
+                        LIMIT 1
+                    ) cu
+                    JOIN LATERAL (
+                        SELECT *
                         FROM users
-                    ) u ON p.parent_id = u.user_id AND u.rn = 1
-                    WHERE p.child_id = %s AND p.hidden IS NOT TRUE AND modified_at = %s;
+                        WHERE user_id = cu.user_id AND hidden IS NOT TRUE
+                            AND valid_period @> %(at)s::timestamptz
+                        ORDER BY unique_id DESC
+                        LIMIT 1
+                    ) u ON TRUE
+                    LEFT JOIN LATERAL (
+                        SELECT json_agg(json_build_object(
+                            'id', c.coordinate_id,
+                            'street_address', c.street_address,
+                            'apartment', c.apartment,
+                            'postal_code', c.postal_code,
+                            'city', c.city,
+                            'country', c.country
+                        ) ORDER BY c.coordinate_id) AS coordinates
+                        FROM (
+                            SELECT DISTINCT ON (coordinate_id) *
+                            FROM coordinates
+                            WHERE user_id = u.user_id AND hidden IS NOT TRUE
+                                AND valid_period @> %(at)s::timestamptz
+                            ORDER BY coordinate_id, unique_id DESC
+                        ) c
+                    ) c ON TRUE
+                    LEFT JOIN LATERAL (
+                        SELECT json_agg(json_build_object(
+                            'id', mh.history_id,
+                            'diagnostic', mh.diagnostic,
+                            'treatment', mh.treatment,
+                            'doctor', json_build_object(
+                                'id', d.user_id,
+                                'login', d.login,
+                                'user_type', d.user_type,
+                                'first_name', d.first_name,
+                                'last_name', d.last_name
+                            ),
+                            'start_date', mh.start_date,
+                            'end_date', mh.end_date
+                        ) ORDER BY mh.history_id) AS medical_history
+                        FROM (
+                            SELECT DISTINCT ON (history_id) *
+                            FROM medical_history
+                            WHERE patient_id = cu.medical_insurance_id AND hidden IS NOT TRUE
+                                AND valid_period @> %(at)s::timestamptz
+                            ORDER BY history_id, unique_id DESC
+                        ) mh
+                        JOIN users_current d ON d.user_id = mh.doctor_id
+                    ) mh ON TRUE
+                    LEFT JOIN LATERAL (
+                        SELECT json_agg(json_build_object(
+                            'id', mv.visit_id,
+                            'patient_id', mv.patient_id,
+                            'doctor', json_build_object(
+                                'id', d.user_id,
+                                'login', d.login,
+                                'user_type', d.user_type,
+                                'first_name', d.first_name,
+                                'last_name', d.last_name
+                            ),
+                            'visit_date', mv.visit_date,
+                            'diagnostic_established', mv.diagnostic_established,
+                            'treatment', mv.treatment,
+                            'visit_summary', mv.visit_summary,
+                            'notes', mv.notes,
+                            'created_at', mv.created_at,
+                            'modified_at', mv.modified_at,
+                            'establishment', json_build_object(
+                                'establishment_id', e.establishment_id,
+                                'establishment_name', e.establishment_name,
+                                'created_at', e.created_at
+                            )
+                        ) ORDER BY mv.visit_id) AS medical_visits
+                        FROM (
+                            SELECT DISTINCT ON (visit_id) *
+                            FROM medical_visits
+                            WHERE patient_id = cu.medical_insurance_id AND hidden IS NOT TRUE
+                                AND valid_period @> %(at)s::timestamptz
+                            ORDER BY visit_id, unique_id DESC
+                        ) mv
+                        LEFT JOIN users_current d ON d.user_id = mv.doctor_id
+                        LEFT JOIN establishments e ON mv.establishment_id = e.establishment_id
+                    ) mv ON TRUE
+                    LEFT JOIN LATERAL (
+                        SELECT json_agg(json_build_object(
+                            'parent', json_build_object(
+                                'user_id', pu.user_id,
+                                'login', pu.login,
+                                'user_type', pu.user_type,
+                                'first_name', pu.first_name,
+                                'last_name', pu.last_name,
+                                'phone_number', pu.phone_number,
+                                'email', pu.email,
+                                'created_at', pu.created_at,
+                                'modified_at', pu.modified_at
+                            )
+                        ) ORDER BY p.parent_id) AS parents
+                        FROM parents p
+                        JOIN users_current pu ON pu.user_id = p.parent_id
+                        WHERE p.child_id = u.user_id AND p.hidden IS NOT TRUE
+                    ) p ON TRUE;
                 """
-                cur.execute(parents_query, (patient_data["user_id"], date))
-                parents_rows = cur.fetchall()
+                cur.execute(patient_query, {
+                    "medical_insurance_id": medical_insurance_id,
+                    "at": date
+                })
+                patient_row = cur.fetchone()
 
-                parents = []
-                for parent in parents_rows:
-                    parents.append({
-                        "parent": {
-                            "user_id": parent[0],
-                            "login": parent[1],
-                            "user_type": parent[2],
-                            "first_name": parent[3],
-                            "last_name": parent[4],
-                            "phone_number": parent[5],
-                            "email": parent[6],
-                            "created_at": parent[7],
-                            "modified_at": parent[8]
-                        }
-                    })
-
-                coordinates_response = [CoordinateResponse(
-                    **coord) for coord in coordinates]
-                medical_history_response = [
-                    MedicalHistoryResponse(**mh) for mh in medical_history]
-                medical_visits_response = [
-                    MedicalVisitResponse(**mv) for mv in medical_visits]
-                parents_response = [ParentResponse(
-                    **parent) for parent in parents]
-
-                patient_response = PatientResponse(
-                    user_id=patient_data["user_id"],
-                    login=patient_data["login"],
-                    user_type=patient_data["user_type"],
-                    first_name=patient_data["first_name"],
-                    last_name=patient_data["last_name"],
-                    medical_insurance_id=medical_insurance_id,
-                    gender=patient_data["gender"],
-                    city_of_birth=patient_data["city_of_birth"],
-                    email=patient_data["email"],
-                    phone_number=patient_data["phone_number"],
-                    created_at=patient_data["created_at"],
-                    modified_at=patient_data["modified_at"],
-                    date_of_birth=patient_data["date_of_birth"],
-                    coordinates=coordinates_response,
-                    medical_history=medical_history_response,
-                    medical_visits=medical_visits_response,
-                    parents=parents_response
-                )
+                if not patient_row:
+                    return {"status": "error", "message": "Patient not found."}, 404
 
-                return {"status": "success", "data": patient_response}, 200
+                return {"status": "success", "data": _encode_patient(patient_row[0])}, 200
 
     except ForeignKeyViolation:
         return {"status": "error", "message": "Invalid foreign key reference."}, 400
@@ -721,6 +769,7 @@ def hide_patient(medical_insurance_id: str) -> tuple[Dict[str, Any], int]:
                 cur.execute(hide_patient_query, (medical_insurance_id, ))
 
                 conn.commit()
+                invalidate_patients([medical_insurance_id])
 
                 return {"status": "success"}, 200
 
@@ -730,284 +779,438 @@ def hide_patient(medical_insurance_id: str) -> tuple[Dict[str, Any], int]:
         return {"error": str(e)}, 500
 
 
-def get_patient_version_history(medical_insurance_id: str) -> tuple[Dict[str, Any], int]:
+# Version rows replayed by get_patient_version_history. modified_at comes
+# first and unique_id last: together they order the versions of a table.
+_VERSION_TABLES = {
+    "users": {
+        "columns": """
+            u.modified_at, u.medical_insurance_id, u.gender, u.city_of_birth,
+            u.user_id, u.login, u.user_type, u.first_name, u.last_name,
+            u.phone_number, u.email, u.created_at, u.date_of_birth, u.unique_id
+        """,
+        "from": "users u",
+        "alias": "u",
+        "key": "medical_insurance_id",
+        "entity": "medical_insurance_id",
+    },
+    "coordinates": {
+        "columns": """
+            c.modified_at, c.coordinate_id, c.street_address, c.apartment,
+            c.postal_code, c.city, c.country, c.unique_id
+        """,
+        "from": "coordinates c",
+        "alias": "c",
+        "key": "user_id",
+        "entity": "coordinate_id",
+    },
+    "medical_history": {
+        "columns": """
+            mh.modified_at, mh.history_id, mh.diagnostic, mh.treatment,
+            d.user_id, d.login, d.user_type, d.first_name, d.last_name,
+            mh.start_date, mh.end_date, mh.unique_id
+        """,
+        "from": """
+            medical_history mh
+            JOIN users_current d ON mh.doctor_id = d.user_id
+        """,
+        "alias": "mh",
+        "key": "patient_id",
+        "entity": "history_id",
+    },
+    "medical_visits": {
+        "columns": """
+            mv.modified_at, mv.visit_id, mv.patient_id, d.user_id, d.login,
+            d.user_type, d.first_name, d.last_name, mv.visit_date,
+            mv.diagnostic_established, mv.treatment, mv.visit_summary,
+            mv.notes, mv.created_at, e.establishment_id, e.establishment_name,
+            e.created_at as establishment_created_at, mv.unique_id
+        """,
+        "from": """
+            medical_visits mv
+            LEFT JOIN users_current d ON mv.doctor_id = d.user_id
+            LEFT JOIN establishments e ON mv.establishment_id = e.establishment_id
+        """,
+        "alias": "mv",
+        "key": "patient_id",
+        "entity": "visit_id",
+    },
+}
+
+# Current parents of a patient, shown in every snapshot of its history.
+_PARENTS_QUERY = """
+    SELECT
+        p.parent_id,
+        u.login,
+        u.user_type,
+        u.first_name,
+        u.last_name,
+        u.phone_number,
+        u.email,
+        u.created_at,
+        u.modified_at
+    FROM parents p
+    JOIN users_current u ON p.parent_id = u.user_id
+    WHERE p.child_id = %s AND p.hidden IS NOT TRUE
+    ORDER BY p.parent_id;
+"""
+
+# First instants of a patient's history within [since, until]. Each branch
+# is a bounded range scan of an idx_*_modified_at index.
+_VERSION_INSTANTS_QUERY = """
+    SELECT DISTINCT modified_at FROM (
+        (SELECT modified_at FROM users
+         WHERE medical_insurance_id = %(medical_insurance_id)s AND hidden IS NOT TRUE
+           AND modified_at >= %(since)s::timestamptz AND modified_at <= %(until)s::timestamptz
+         ORDER BY modified_at LIMIT %(limit)s)
+        UNION ALL
+        (SELECT modified_at FROM coordinates
+         WHERE user_id = %(user_id)s AND hidden IS NOT TRUE
+           AND modified_at >= %(since)s::timestamptz AND modified_at <= %(until)s::timestamptz
+         ORDER BY modified_at LIMIT %(limit)s)
+        UNION ALL
+        (SELECT modified_at FROM medical_history
+         WHERE patient_id = %(medical_insurance_id)s AND hidden IS NOT TRUE
+           AND modified_at >= %(since)s::timestamptz AND modified_at <= %(until)s::timestamptz
+         ORDER BY modified_at LIMIT %(limit)s)
+        UNION ALL
+        (SELECT modified_at FROM medical_visits
+         WHERE patient_id = %(medical_insurance_id)s AND hidden IS NOT TRUE
+           AND modified_at >= %(since)s::timestamptz AND modified_at <= %(until)s::timestamptz
+         ORDER BY modified_at LIMIT %(limit)s)
+    ) instants
+    ORDER BY modified_at
+    LIMIT %(limit)s;
+"""
+
+
+def _versions_query(table: str, key, since: datetime = None, until: datetime = None) -> tuple[str, list]:
+    """
+    Query of the version rows of `table` for the replay, ordered by time:
+    every version between `since` and `until`, preceded by the version of
+    each entity that was current at `since`.
+    """
+    spec = _VERSION_TABLES[table]
+    alias = spec["alias"]
+    conditions = f"{alias}.{spec['key']} = %s AND {alias}.hidden IS NOT TRUE"
+
+    window = f"SELECT {spec['columns']} FROM {spec['from']} WHERE {conditions}"
+    params = [key]
+    if since is not None:
+        window += f" AND {alias}.modified_at >= %s"
+        params.append(since)
+    if until is not None:
+        window += f" AND {alias}.modified_at <= %s"
+        params.append(until)
+
+    if since is None:
+        query = f"{window} ORDER BY {alias}.modified_at, {alias}.unique_id;"
+    else:
+        initial = f"""
+            SELECT DISTINCT ON ({alias}.{spec['entity']}) {spec['columns']}
+            FROM {spec['from']}
+            WHERE {conditions} AND {alias}.modified_at < %s
+            ORDER BY {alias}.{spec['entity']}, {alias}.modified_at DESC, {alias}.unique_id DESC
+        """
+        query = f"""
+            SELECT * FROM (({initial}) UNION ALL ({window})) versions
+            ORDER BY modified_at, unique_id;
+        """
+        params = [key, since] + params
+
+    return query, params
+
+
+def _fetch_versions(cursor, table: str, key, since: datetime = None, until: datetime = None) -> list:
+    cursor.execute(*_versions_query(table, key, since, until))
+    return cursor.fetchall()
+
+
+def get_patient_version_history(medical_insurance_id: str,
+                                diff: bool = False,
+                                since: datetime = None,
+                                until: datetime = None,
+                                limit: int = None) -> tuple[Dict[str, Any], int]:
     """
     Get the complete version history of a patient, showing the full patient record 
     at each point in time when a change was made to any part of the patient's data.
 
+    Every version row of the patient is fetched once, ordered by time, then
+    replayed in memory: the number of queries doesn't depend on the number
+    of versions.
+
+    With `diff`, only the first snapshot is returned in full, followed by
+    the operations turning each snapshot into the next one (see
+    diff_snapshots).
+
+    `since` and `until` (both inclusive) restrict the history to a time
+    window, and `limit` to its first versions. `next_since` is then the
+    timestamp of the first version left out, None when there is none.
+
     Returns:
         A dictionary with a list of patient snapshots in chronological order.
     """
     db_instance: Database = current_app.config['DATABASE']
+    next_since = None
     try:
-        with db_instance.get_conn() as conn:
+        with db_instance.get_conn(intent=READ) as conn:
             with conn.cursor() as cur:
-                patient_check_query = """
-                    SELECT COUNT(*) FROM users
-                    WHERE medical_insurance_id = %s AND hidden IS NOT TRUE
-                """
-                cur.execute(patient_check_query, (medical_insurance_id,))
-                count = cur.fetchone()[0]
-
-                if count == 0:
-                    return {"status": "error", "message": "Patient not found."}, 404
-
-                cur.execute("""
-                    SELECT user_id FROM users
-                    WHERE medical_insurance_id = %s AND hidden IS NOT TRUE
-                    ORDER BY modified_at DESC
-                    LIMIT 1
-                """, (medical_insurance_id,))
-                user_id = cur.fetchone()[0]
-
-                timestamps_query = """
-                    SELECT modified_at AS timestamp FROM users
-                    WHERE medical_insurance_id = %s AND hidden IS NOT TRUE
-
-                    UNION
+                if since is None and until is None and limit is None:
+                    user_rows = _fetch_versions(cur, "users", medical_insurance_id)
+                    if not user_rows:
+                        return {"status": "error", "message": "Patient not found."}, 404
+                    user_id = user_rows[-1][4]
+                    window = (None, None)
+                else:
+                    cur.execute("""
+                        SELECT user_id FROM users_current
+                        WHERE medical_insurance_id = %s AND hidden IS NOT TRUE
+                        ORDER BY unique_id DESC
+                        LIMIT 1;
+                    """, (medical_insurance_id,))
+                    row = cur.fetchone()
+                    if row is None:
+                        return {"status": "error", "message": "Patient not found."}, 404
+                    user_id = row[0]
+
+                    window = (since, until)
+                    if limit is not None:
+                        cur.execute(_VERSION_INSTANTS_QUERY, {
+                            "medical_insurance_id": medical_insurance_id,
+                            "user_id": user_id,
+                            "since": since or "-infinity",
+                            "until": until or "infinity",
+                            "limit": limit + 1
+                        })
+                        instants = [row[0] for row in cur.fetchall()]
+                        if len(instants) > limit:
+                            next_since = instants[limit]
+                            instants = instants[:limit]
+                        window = (instants[0], instants[-1]) if instants else None
+
+                    if window is None:
+                        empty = {"base": None, "changes": []} if diff else {}
+                        return {"status": "success", "data": empty, "next_since": None}, 200
+                    user_rows = _fetch_versions(
+                        cur, "users", medical_insurance_id, *window)
+
+                coordinates_rows = _fetch_versions(
+                    cur, "coordinates", user_id, *window)
+                medical_history_rows = _fetch_versions(
+                    cur, "medical_history", medical_insurance_id, *window)
+                medical_visits_rows = _fetch_versions(
+                    cur, "medical_visits", medical_insurance_id, *window)
+
+                cur.execute(_PARENTS_QUERY, (user_id,))
+                parents_rows = cur.fetchall()
 
-                    SELECT modified_at FROM coordinates
-                    WHERE user_id = %s AND hidden IS NOT TRUE
+        # Parents aren't versioned: every snapshot shows the current ones.
+        parents = [_parent_version(row) for row in parents_rows]
 
-                    UNION
+        snapshots = _replay_patient_history(
+            user_rows, coordinates_rows, medical_history_rows,
+            medical_visits_rows, parents, since=window[0])
 
-                    SELECT modified_at FROM medical_history
-                    WHERE patient_id = %s AND hidden IS NOT TRUE
+        if not diff:
+            return {"status": "success", "data": dict(snapshots), "next_since": next_since}, 200
 
-                    UNION
+        entries = _snapshot_changes(snapshots)
+        return {"status": "success", "data": {
+            "base": next(entries, None),
+            "changes": list(entries)
+        }, "next_since": next_since}, 200
 
-                    SELECT modified_at FROM medical_visits
-                    WHERE patient_id = %s AND hidden IS NOT TRUE
+    except Exception as e:
+        return {"status": "error", "message": repr(e)}, 500
 
-                    ORDER BY timestamp
-                """
-                cur.execute(timestamps_query, (medical_insurance_id, user_id,
-                            medical_insurance_id, medical_insurance_id))
-                timestamp_rows = cur.fetchall()
 
-                timestamps = sorted(set(row[0] for row in timestamp_rows))
+def stream_patient_version_history(medical_insurance_id: str,
+                                   diff: bool = False) -> tuple[Dict[str, Any], int]:
+    """
+    The complete version history of a patient as an iterator of records,
+    for NDJSON responses: `{"timestamp", "snapshot"}` for each version, or
+    with `diff` the first one followed by `{"timestamp", "ops"}` records.
 
-                version_map = {}
+    The version rows are read through server-side cursors and replayed as
+    they arrive, so neither the rows nor the snapshots are ever all in
+    memory at once.
+    """
+    db_instance: Database = current_app.config['DATABASE']
 
-                for timestamp in timestamps:
-                    snapshot = _build_patient_record_at_timestamp(
-                        cur, medical_insurance_id, user_id, timestamp)
-                    if snapshot:
-                        ts_key = timestamp.isoformat()
-                        version_map[ts_key] = snapshot
+    def records():
+        with db_instance.get_conn(intent=READ) as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT user_id FROM users_current
+                    WHERE medical_insurance_id = %s AND hidden IS NOT TRUE
+                    ORDER BY unique_id DESC
+                    LIMIT 1;
+                """, (medical_insurance_id,))
+                row = cur.fetchone()
+                if row is None:
+                    return
+                user_id = row[0]
+
+                cur.execute(_PARENTS_QUERY, (user_id,))
+                parents = [_parent_version(row) for row in cur.fetchall()]
+
+            keys = {
+                "users": medical_insurance_id,
+                "coordinates": user_id,
+                "medical_history": medical_insurance_id,
+                "medical_visits": medical_insurance_id,
+            }
+            snapshots = _replay_patient_history(*(
+                server_side_rows(conn, f"{table}_versions", *_versions_query(table, key))
+                for table, key in keys.items()), parents)
 
-                return {"status": "success", "data": version_map}, 200
+            if diff:
+                yield from _snapshot_changes(snapshots)
+            else:
+                for timestamp, snapshot in snapshots:
+                    yield {"timestamp": timestamp, "snapshot": snapshot}
 
+    try:
+        history = prime(records())
+        if history is None:
+            return {"status": "error", "message": "Patient not found."}, 404
+        return {"status": "success", "data": history}, 200
     except Exception as e:
         return {"status": "error", "message": repr(e)}, 500
 
 
-def _build_patient_record_at_timestamp(cursor, medical_insurance_id: str, user_id: str, timestamp: datetime) -> Dict[str, Any]:
+def _replay_patient_history(user_rows, coordinates_rows, medical_history_rows,
+                            medical_visits_rows, parents: list, since: datetime = None):
     """
-    Helper function to build a complete patient record as it existed at a specific timestamp.
-    Returns the patient record in a format compatible with PatientVersionSnapshot model.
+    (timestamp, snapshot) pairs of a patient's history, in time order, from
+    the version rows of each table. The rows may be lists or server-side
+    cursors: they are only read as the replay needs them.
     """
-    user_query = """
-        SELECT
-            medical_insurance_id,
-            gender,
-            city_of_birth,
-            user_id,
-            login,
-            user_type,
-            first_name,
-            last_name,
-            phone_number,
-            email,
-            modified_at,
-            created_at,
-            date_of_birth
-        FROM users
-        WHERE medical_insurance_id = %s AND modified_at <= %s AND hidden IS NOT TRUE
-        ORDER BY modified_at DESC
-        LIMIT 1;
+    return (
+        (timestamp.isoformat(), _patient_snapshot(state, parents, timestamp))
+        for timestamp, state in replay_versions(
+            ((row[0], "users", None, row) for row in user_rows),
+            ((row[0], "coordinates", row[1], _coordinate_version(row))
+             for row in coordinates_rows),
+            ((row[0], "medical_history", row[1], _medical_history_version(row))
+             for row in medical_history_rows),
+            ((row[0], "medical_visits", row[1], _medical_visit_version(row))
+             for row in medical_visits_rows),
+            since=since))
+
+
+def _snapshot_changes(snapshots):
     """
-    cursor.execute(user_query, (medical_insurance_id, timestamp))
-    user_row = cursor.fetchone()
+    The diff format of a history: the first snapshot as
+    `{"timestamp", "snapshot"}`, then the operations turning each snapshot
+    into the next one as `{"timestamp", "ops"}`.
+    """
+    previous = None
+    for timestamp, snapshot in snapshots:
+        if previous is None:
+            yield {"timestamp": timestamp, "snapshot": snapshot}
+        else:
+            yield {"timestamp": timestamp, "ops": diff_snapshots(previous, snapshot)}
+        previous = snapshot
 
-    if not user_row:
-        return {
-            "error": "No user row for given id",
-        }
 
-    coordinates_query = """
-        SELECT DISTINCT ON (coordinate_id)
-            coordinate_id,
-            street_address,
-            apartment,
-            postal_code,
-            city,
-            country
-        FROM coordinates
-        WHERE user_id = %s AND modified_at <= %s AND hidden IS NOT TRUE
-        ORDER BY coordinate_id, modified_at DESC;
+def _patient_snapshot(state: VersionState, parents: list, timestamp: datetime) -> Dict[str, Any]:
     """
-    cursor.execute(coordinates_query, (user_id, timestamp))
-    coordinates_rows = cursor.fetchall()
-
-    coordinates = [
-        {
-            "id": coord[0],
-            "street_address": coord[1],
-            "apartment": coord[2],
-            "postal_code": coord[3],
-            "city": coord[4],
-            "country": coord[5]
-        }
-        for coord in coordinates_rows
-    ]
-
-    medical_history_query = """
-        SELECT DISTINCT ON (mh.history_id)
-            mh.history_id,
-            mh.diagnostic,
-            mh.treatment,
-            d.user_id,
-            d.login,
-            d.user_type,
-            d.first_name,
-            d.last_name,
-            mh.start_date,
-            mh.end_date
-        FROM medical_history mh
-        JOIN users d ON mh.doctor_id = d.user_id
-        WHERE mh.patient_id = %s AND mh.modified_at <= %s AND mh.hidden IS NOT TRUE
-        ORDER BY mh.history_id, mh.modified_at DESC;
-    """
-    cursor.execute(medical_history_query, (medical_insurance_id, timestamp))
-    medical_history_rows = cursor.fetchall()
-
-    medical_history = []
-    for mh in medical_history_rows:
-        medical_history.append({
-            "id": mh[0],
-            "diagnostic": mh[1],
-            "treatment": mh[2],
-            "doctor": {
-                "id": mh[3],
-                "login": mh[4],
-                "user_type": mh[5],
-                "first_name": mh[6],
-                "last_name": mh[7]
-            },
-            "start_date": mh[8],
-            "end_date": mh[9]
-        })
-
-    medical_visits_query = """
-        SELECT DISTINCT ON (mv.visit_id)
-            mv.visit_id,
-            mv.patient_id,
-            d.user_id,
-            d.login,
-            d.user_type,
-            d.first_name,
-            d.last_name,
-            mv.visit_date,
-            mv.diagnostic_established,
-            mv.treatment,
-            mv.visit_summary,
-            mv.notes,
-            mv.created_at,
-            e.establishment_id,
-            e.establishment_name,
-            e.created_at as establishment_created_at
-        FROM medical_visits mv
-        LEFT JOIN users d ON mv.doctor_id = d.user_id
-        LEFT JOIN establishments e ON mv.establishment_id = e.establishment_id
-        WHERE mv.patient_id = %s AND mv.modified_at <= %s AND mv.hidden IS NOT TRUE
-        ORDER BY mv.visit_id, mv.modified_at DESC;
+    Build the patient record as it existed at `timestamp` from the replayed
+    versions. Returns the patient record in a format compatible with
+    PatientVersionSnapshot model.
     """
-    cursor.execute(medical_visits_query, (medical_insurance_id, timestamp))
-    medical_visits_rows = cursor.fetchall()
-
-    medical_visits = [
-        {
-            "id": mv[0],
-            "patient_id": mv[1],
-            "doctor": {
-                "id": mv[2],
-                "login": mv[3],
-                "user_type": mv[4],
-                "first_name": mv[5],
-                "last_name": mv[6]
-            },
-            "visit_date": mv[7].isoformat() if mv[7] else None,
-            "diagnostic_established": mv[8],
-            "treatment": mv[9],
-            "visit_summary": mv[10],
-            "notes": mv[11],
-            "created_at": mv[12],
-            "establishment": {
-                "establishment_id": mv[13],
-                "establishment_name": mv[14],
-                "created_at": mv[15]
-            }
+    user_row = state.get("users", None)
+    if not user_row:
+        return {
+            "error": "No user row for given id",
         }
-        for mv in medical_visits_rows
-    ]
-
-    parents_query = """
-                    SELECT
-                        p.parent_id,
-                        u.login,
-                        u.user_type,
-                        u.first_name,
-                        u.last_name,
-                        u.phone_number,
-                        u.email,
-                        u.created_at,
-                        u.modified_at
-                    FROM parents p
-                    JOIN (
-                        SELECT
-                            *,
-                            ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY modified_at DESC) AS rn
-                        FROM users
-                    ) u ON p.parent_id = u.user_id AND u.rn = 1
-                    WHERE p.child_id = %s AND p.hidden IS NOT TRUE;
-    """
-    cursor.execute(parents_query, (user_id,))
-    parents_rows = cursor.fetchall()
-
-    parents = []
-    for parent in parents_rows:
-        parents.append({
-            "parent": {
-                "user_id": parent[0],
-                "login": parent[1],
-                "user_type": parent[2],
-                "first_name": parent[3],
-                "last_name": parent[4],
-                "phone_number": parent[5],
-                "email": parent[6],
-                "created_at": parent[7],
-                "modified_at": parent[8]
-            }
-        })
 
     return {
-        "user_id": user_row[3],
-        "login": user_row[4],
-        "user_type": user_row[5],
-        "first_name": user_row[6],
-        "last_name": user_row[7],
-        "phone_number": user_row[8],
-        "email": user_row[9],
-        "medical_insurance_id": user_row[0],
-        "gender": user_row[1],
-        "city_of_birth": user_row[2],
+        "user_id": user_row[4],
+        "login": user_row[5],
+        "user_type": user_row[6],
+        "first_name": user_row[7],
+        "last_name": user_row[8],
+        "phone_number": user_row[9],
+        "email": user_row[10],
+        "medical_insurance_id": user_row[1],
+        "gender": user_row[2],
+        "city_of_birth": user_row[3],
         "date_of_birth": user_row[12],
         "created_at": user_row[11],
-        "modified_at": user_row[10],
-        "coordinates": coordinates,
-        "medical_history": medical_history,
-        "medical_visits": medical_visits,
+        "modified_at": user_row[0],
+        "coordinates": state.values("coordinates"),
+        "medical_history": state.values("medical_history"),
+        "medical_visits": state.values("medical_visits"),
         "parents": parents,
         "snapshot_timestamp": timestamp
     }
+
+
+def _coordinate_version(row) -> Dict[str, Any]:
+    return {
+        "id": row[1],
+        "street_address": row[2],
+        "apartment": row[3],
+        "postal_code": row[4],
+        "city": row[5],
+        "country": row[6]
+    }
+
+
+def _medical_history_version(row) -> Dict[str, Any]:
+    return {
+        "id": row[1],
+        "diagnostic": row[2],
+        "treatment": row[3],
+        "doctor": {
+            "id": row[4],
+            "login": row[5],
+            "user_type": row[6],
+            "first_name": row[7],
+            "last_name": row[8]
+        },
+        "start_date": row[9],
+        "end_date": row[10]
+    }
+
+
+def _medical_visit_version(row) -> Dict[str, Any]:
+    return {
+        "id": row[1],
+        "patient_id": row[2],
+        "doctor": {
+            "id": row[3],
+            "login": row[4],
+            "user_type": row[5],
+            "first_name": row[6],
+            "last_name": row[7]
+        },
+        "visit_date": row[8].isoformat() if row[8] else None,
+        "diagnostic_established": row[9],
+        "treatment": row[10],
+        "visit_summary": row[11],
+        "notes": row[12],
+        "created_at": row[13],
+        "establishment": {
+            "establishment_id": row[14],
+            "establishment_name": row[15],
+            "created_at": row[16]
+        }
+    }
+
+
+def _parent_version(row) -> Dict[str, Any]:
+    return {
+        "parent": {
+            "user_id": row[0],
+            "login": row[1],
+            "user_type": row[2],
+            "first_name": row[3],
+            "last_name": row[4],
+            "phone_number": row[5],
+            "email": row[6],
+            "created_at": row[7],
+            "modified_at": row[8]
+        }
+    }
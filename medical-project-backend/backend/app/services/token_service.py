@@ -1,7 +1,14 @@
 from typing import Dict, Any
 from flask import current_app
 from ..db import Database
-from datetime import datetime
+from ..schemas import (
+    CREATE_PARTITIONED_TOKEN_BLACKLIST_TABLE,
+    CREATE_TOKEN_BLACKLIST_DEFAULT_PARTITION,
+    CREATE_USER_BLACKLIST_INDEX,
+    CREATE_TOKEN_BLACKLIST_EXPIRES_AT_INDEX,
+    CREATE_TOKEN_REVOKED_TRIGGER,
+)
+from datetime import datetime, date, timedelta, timezone
 
 
 def add_token_to_blacklist(jti: str, token_type: str, user_id: str, expires_at: datetime) -> None:
@@ -19,10 +26,15 @@ def add_token_to_blacklist(jti: str, token_type: str, user_id: str, expires_at:
                 query = """
                     INSERT INTO token_blacklist (jti, token_type, user_id, expires_at)
                     VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (jti) DO NOTHING
+                    ON CONFLICT DO NOTHING
                 """
                 cur.execute(query, (jti, token_type, user_id, expires_at))
                 conn.commit()
+                # Other workers learn about it from the notification of the
+                # insert, this one right away.
+                revocation_cache = current_app.config.get('REVOCATION_CACHE')
+                if revocation_cache is not None:
+                    revocation_cache.add(jti, expires_at.timestamp())
                 return
     except Exception as e:
         current_app.logger.error(f"Error adding token to blacklist: {str(e)}")
@@ -41,6 +53,14 @@ def is_token_blacklisted(jti: str) -> bool:
         else:
             return False
 
+    # Revocations are cached by each worker, the database is only queried
+    # while the cache can't vouch for being up to date.
+    revocation_cache = current_app.config.get('REVOCATION_CACHE')
+    if revocation_cache is not None:
+        revoked = revocation_cache.is_revoked(jti)
+        if revoked is not None:
+            return revoked
+
     # Normal database check
     try:
         with db_instance.get_conn() as conn:
@@ -57,48 +77,257 @@ def is_token_blacklisted(jti: str) -> bool:
         return True  # Fail secure
 
 
-def revoke_all_user_tokens(user_id: str) -> None:
+def is_token_generation_revoked(user_id: str, generation: int) -> bool:
+    """
+    Whether the token, issued for `generation` of the user's tokens, was
+    revoked since by revoke_all_user_tokens.
+    """
+    revocation_cache = current_app.config.get('REVOCATION_CACHE')
+    if revocation_cache is not None:
+        current_generation = revocation_cache.generation(user_id)
+        if current_generation is not None:
+            return generation < current_generation
+
     db_instance: Database = current_app.config['DATABASE']
     try:
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 query = """
-                    SELECT jti, token_type, expires_at FROM token_blacklist
-                    WHERE user_id = %s AND expires_at > NOW()
+                    SELECT generation FROM token_generations
+                    WHERE user_id = %s
                 """
                 cur.execute(query, (user_id,))
+                result = cur.fetchone()
+                return result is not None and generation < result[0]
+    except Exception as e:
+        current_app.logger.error(f"Error checking token generation: {str(e)}")
+        return True  # Fail secure
+
+
+def revoke_all_user_tokens(user_id: str) -> int:
+    """
+    Revoke every token of the user, including those never blacklisted, by
+    bumping the generation their `gen` claim is checked against. Returns
+    the new generation, that of the tokens issued from now on.
+    """
+    db_instance: Database = current_app.config['DATABASE']
+    try:
+        with db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
                 query = """
-                    UPDATE token_blacklist
-                    SET revoked_at = NOW()
-                    WHERE user_id = %s AND expires_at > NOW()
+                    INSERT INTO token_generations (user_id, generation)
+                    VALUES (%s, 1)
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET generation = token_generations.generation + 1,
+                        updated_at = NOW()
+                    RETURNING generation
                 """
                 cur.execute(query, (user_id,))
+                generation = cur.fetchone()[0]
                 conn.commit()
-                return
+                revocation_cache = current_app.config.get('REVOCATION_CACHE')
+                if revocation_cache is not None:
+                    revocation_cache.set_generation(user_id, generation)
+                return generation
     except Exception as e:
         current_app.logger.error(f"Error revoking all user tokens: {str(e)}")
         raise e
 
 
-def cleanup_expired_tokens() -> None:
+def cleanup_expired_tokens() -> int:
     """
-    Remove expired tokens from the blacklist to keep the table size manageable
-    Should be run periodically (e.g., via a cron job)
+    Remove expired tokens from the blacklist to keep the table size manageable.
+    Run periodically by the maintenance scheduler (see app/maintenance.py).
     """
     db_instance: Database = current_app.config['DATABASE']
     try:
-        with db_instance.get_conn() as conn:
-            with conn.cursor() as cur:
-                query = """
-                    DELETE FROM token_blacklist
-                    WHERE expires_at < NOW()
-                """
-                cur.execute(query)
-                removed_count = cur.rowcount
-                conn.commit()
-                current_app.logger.info(
-                    f"Removed {removed_count} expired tokens from blacklist")
-                return removed_count
+        removed_count = purge_expired_tokens(db_instance)
+        current_app.logger.info(
+            f"Removed {removed_count} expired tokens from blacklist")
+        return removed_count
     except Exception as e:
         current_app.logger.error(f"Error cleaning up expired tokens: {str(e)}")
         raise e
+
+
+def purge_expired_tokens(db_instance: Database, batch_size: int = 1000) -> int:
+    """
+    Delete the expired tokens of the blacklist, `batch_size` rows per
+    transaction so that neither locks nor WAL pile up, and rows locked by
+    another purge are skipped. Returns the number of rows deleted.
+    """
+    query = """
+        DELETE FROM token_blacklist t
+        USING (
+            SELECT id, expires_at FROM token_blacklist
+            WHERE expires_at < NOW()
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) expired
+        WHERE t.id = expired.id AND t.expires_at = expired.expires_at
+    """
+    removed_count = 0
+    with db_instance.get_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                while True:
+                    cur.execute(query, (batch_size,))
+                    deleted = cur.rowcount
+                    conn.commit()
+                    removed_count += deleted
+                    if deleted < batch_size:
+                        return removed_count
+        except Exception:
+            conn.rollback()
+            raise
+
+
+TOKEN_PARTITIONED_QUERY = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('token_blacklist')
+    );
+"""
+
+TOKEN_PARTITIONS_QUERY = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass('token_blacklist');
+"""
+
+
+def _token_partition(day: date) -> str:
+    return f"token_blacklist_p{day:%Y%m%d}"
+
+
+def _create_token_partitions(cur, first_day: date, last_day: date) -> tuple[list[str], int]:
+    """
+    Create the daily partitions from `first_day` to `last_day`, and the
+    default partition. Returns the names of the daily partitions and the
+    number of tokens moved out of the default one.
+    """
+    cur.execute(CREATE_TOKEN_BLACKLIST_DEFAULT_PARTITION)
+    # A partition can't be created while the default partition holds rows
+    # of its range: they are set aside and inserted again once it exists.
+    cur.execute("""
+        CREATE TEMPORARY TABLE moved_tokens (LIKE token_blacklist) ON COMMIT DROP
+    """)
+    cur.execute("""
+        WITH moved AS (
+            DELETE FROM token_blacklist_default
+            WHERE expires_at >= %s::TIMESTAMPTZ AND expires_at < %s::TIMESTAMPTZ
+            RETURNING *
+        )
+        INSERT INTO moved_tokens SELECT * FROM moved
+    """, (f"{first_day.isoformat()} 00:00:00+00",
+          f"{(last_day + timedelta(days=1)).isoformat()} 00:00:00+00"))
+    moved = cur.rowcount
+
+    created = []
+    day = first_day
+    while day <= last_day:
+        name = _token_partition(day)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} PARTITION OF token_blacklist
+            FOR VALUES FROM ('{day.isoformat()} 00:00:00+00')
+                       TO ('{(day + timedelta(days=1)).isoformat()} 00:00:00+00')
+        """)
+        created.append(name)
+        day += timedelta(days=1)
+
+    if moved:
+        cur.execute("INSERT INTO token_blacklist SELECT * FROM moved_tokens")
+    return created, moved
+
+
+def maintain_token_partitions(db_instance: Database, ahead_days: int = 32) -> dict:
+    """
+    When token_blacklist is partitioned by day of expiry, create the
+    partitions of the next `ahead_days` days (tokens are blacklisted until
+    they expire, at most a refresh token lifetime away), moving into them
+    the tokens the default partition received meanwhile, and drop those
+    whose tokens all expired. Does nothing on the regular table.
+    """
+    with db_instance.get_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(TOKEN_PARTITIONED_QUERY)
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    return {"partitioned": False, "created": 0, "moved": 0, "dropped": 0}
+
+                today = datetime.now(timezone.utc).date()
+                cur.execute(TOKEN_PARTITIONS_QUERY)
+                existing = {row[0] for row in cur.fetchall()}
+                created, moved = _create_token_partitions(
+                    cur, today, today + timedelta(days=ahead_days))
+
+                dropped = 0
+                for name in sorted(existing):
+                    try:
+                        day = datetime.strptime(
+                            name[len("token_blacklist_p"):], "%Y%m%d").date()
+                    except ValueError:
+                        continue
+                    # Every token of the partition expired before today.
+                    if day < today:
+                        cur.execute(f"DROP TABLE {name}")
+                        dropped += 1
+                conn.commit()
+                return {"partitioned": True,
+                        "created": len(set(created) - existing),
+                        "moved": moved,
+                        "dropped": dropped}
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def partition_token_blacklist(db_instance: Database, ahead_days: int = 32) -> int:
+    """
+    Convert token_blacklist to the table partitioned by day of expiry, in a
+    single transaction. Expired tokens are left behind; the others are
+    copied over. Returns the number of tokens copied.
+    """
+    with db_instance.get_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(TOKEN_PARTITIONED_QUERY)
+                if cur.fetchone()[0]:
+                    raise ValueError("token_blacklist is already partitioned.")
+
+                cur.execute("SET LOCAL lock_timeout = '5s'")
+                cur.execute("LOCK TABLE token_blacklist IN ACCESS EXCLUSIVE MODE")
+                cur.execute("""
+                    CREATE TEMPORARY TABLE unexpired_tokens ON COMMIT DROP AS
+                    SELECT jti, token_type, user_id, revoked_at, expires_at, hidden
+                    FROM token_blacklist
+                    WHERE expires_at >= NOW()
+                """)
+                cur.execute("SELECT MAX(expires_at) FROM unexpired_tokens")
+                last_expiry = cur.fetchone()[0]
+
+                cur.execute("DROP TABLE token_blacklist CASCADE")
+                cur.execute(CREATE_PARTITIONED_TOKEN_BLACKLIST_TABLE)
+                today = datetime.now(timezone.utc).date()
+                last_day = today + timedelta(days=ahead_days)
+                if last_expiry is not None:
+                    last_day = max(last_day, last_expiry.astimezone(timezone.utc).date())
+                _create_token_partitions(cur, today, last_day)
+
+                cur.execute("""
+                    INSERT INTO token_blacklist
+                        (jti, token_type, user_id, revoked_at, expires_at, hidden)
+                    SELECT jti, token_type, user_id, revoked_at, expires_at, hidden
+                    FROM unexpired_tokens
+                """)
+                copied = cur.rowcount
+                cur.execute(CREATE_USER_BLACKLIST_INDEX)
+                cur.execute(CREATE_TOKEN_BLACKLIST_EXPIRES_AT_INDEX)
+                cur.execute(CREATE_TOKEN_REVOKED_TRIGGER)
+                conn.commit()
+                return copied
+        except Exception:
+            conn.rollback()
+            raise
@@ -2,19 +2,19 @@ from typing import Dict, Any
 from psycopg2.errors import ForeignKeyViolation
 from ..models import UserCreate, UserUpdate, UserResponse, UserUpdateResponse, UserResponse, UserCreateResponse, CredentialsUpdate
 from flask import current_app
-from ..db import Database
-import bcrypt
+from ..db import Database, READ
+from ..cache import charts_of_user, invalidate_patients
+from ..serialization import compile_encoder
 
 
 def add_user(data: UserCreate) -> tuple[Dict[str, Any], int]:
     db_instance: Database = current_app.config['DATABASE']
     try:
+        # Hashed before checking out a connection, which would sit idle
+        # meanwhile.
+        password_hash = current_app.config['PASSWORD_HASHER'].hash(data.password)
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
-                password_bytes = (data.password).encode('utf-8')
-                salt = bcrypt.gensalt()
-                pwhash = bcrypt.hashpw(password_bytes, salt)
-                password_hash = pwhash.decode('utf8')
                 insert_user_query = """
                     INSERT INTO users (login, password_hash, user_type, first_name, last_name, phone_number, email)
                     VALUES (%s, %s, %s, %s, %s, %s, %s)
@@ -50,7 +50,7 @@ def update_user(user_id: str, data: UserUpdate) -> tuple[Dict[str, Any], int]:
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 select_created_at_query = """
-                    SELECT user_id, login, password_hash, user_type, first_name, last_name, phone_number, email, created_at FROM users
+                    SELECT user_id, login, password_hash, user_type, first_name, last_name, phone_number, email, created_at FROM users_current
                     WHERE user_id = %s
                 """
                 cur.execute(select_created_at_query, (
@@ -104,7 +104,9 @@ def update_user(user_id: str, data: UserUpdate) -> tuple[Dict[str, Any], int]:
                     user_data["created_at"],
                 ))
 
+                charts = charts_of_user(cur, user_id)
                 conn.commit()
+                invalidate_patients(charts)
 
         user_response = UserUpdateResponse(
             user_id=user_id,
@@ -126,11 +128,14 @@ def update_user(user_id: str, data: UserUpdate) -> tuple[Dict[str, Any], int]:
 
 def update_user_credentials(user_id: str, data: CredentialsUpdate) -> tuple[Dict[str, Any], int]:
     db_instance: Database = current_app.config['DATABASE']
+    # Outside of the try: a saturated hasher is answered with 429, not 500.
+    password_hash = current_app.config['PASSWORD_HASHER'].hash(data.password) \
+        if data.password != "" else None
     try:
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 select_created_at_query = """
-                    SELECT user_id, login, password_hash, user_type, first_name, last_name, phone_number, email, created_at, medical_insurance_id FROM users
+                    SELECT user_id, login, password_hash, user_type, first_name, last_name, phone_number, email, created_at, medical_insurance_id FROM users_current
                     WHERE user_id = %s
                 """
                 cur.execute(select_created_at_query, (
@@ -157,11 +162,7 @@ def update_user_credentials(user_id: str, data: CredentialsUpdate) -> tuple[Dict
                 if data.login != "":
                     user_data["login"] = data.login
 
-                if data.password != "":
-                    password_bytes = (data.password).encode('utf-8')
-                    salt = bcrypt.gensalt()
-                    pwhash = bcrypt.hashpw(password_bytes, salt)
-                    password_hash = pwhash.decode('utf8')
+                if password_hash is not None:
                     user_data["password_hash"] = password_hash
 
                 insert_patient_query = """
@@ -181,7 +182,9 @@ def update_user_credentials(user_id: str, data: CredentialsUpdate) -> tuple[Dict
                     user_data["medical_insurance_id"],
                 ))
 
+                charts = charts_of_user(cur, user_id)
                 conn.commit()
+                invalidate_patients(charts)
 
         return {"status": "success"}, 201
 
@@ -191,13 +194,19 @@ def update_user_credentials(user_id: str, data: CredentialsUpdate) -> tuple[Dict
         return {"error": str(e)}, 500
 
 
+_encode_user = compile_encoder(UserResponse, columns=(
+    "user_id", "login", "user_type", "first_name", "last_name",
+    "phone_number", "email", "modified_at", "created_at"))
+
+
 def get_user(user_id: str) -> tuple[Dict[str, Any], int]:
     db_instance: Database = current_app.config['DATABASE']
     try:
-        with db_instance.get_conn() as conn:
+        with db_instance.get_conn(intent=READ) as conn:
             with conn.cursor() as cur:
                 patient_query = """
                     SELECT
+                        user_id,
                         login,
                         user_type,
                         first_name,
@@ -206,10 +215,8 @@ def get_user(user_id: str) -> tuple[Dict[str, Any], int]:
                         email,
                         modified_at,
                         created_at
-                    FROM users
-                    WHERE user_id = %s AND hidden IS NOT TRUE
-                    ORDER BY modified_at DESC
-                    LIMIT 1;
+                    FROM users_current
+                    WHERE user_id = %s AND hidden IS NOT TRUE;
                 """
                 cur.execute(patient_query, (user_id,))
                 user_row = cur.fetchone()
@@ -217,30 +224,7 @@ def get_user(user_id: str) -> tuple[Dict[str, Any], int]:
                 if not user_row:
                     return {"status": "error", "message": "User not found."}, 404
 
-                user_data = {
-                    "login": user_row[0],
-                    "user_type": user_row[1],
-                    "first_name": user_row[2],
-                    "last_name": user_row[3],
-                    "phone_number": user_row[4],
-                    "email": user_row[5],
-                    "modified_at": user_row[6],
-                    "created_at": user_row[7]
-                }
-
-                user_response = UserResponse(
-                    user_id=user_id,
-                    login=user_data["login"],
-                    user_type=user_data["user_type"],
-                    first_name=user_data["first_name"],
-                    last_name=user_data["last_name"],
-                    email=user_data["email"],
-                    phone_number=user_data["phone_number"],
-                    created_at=user_data["created_at"],
-                    modified_at=user_data["modified_at"],
-                )
-
-                return {"status": "success", "data": user_response}, 200
+                return {"status": "success", "data": _encode_user(user_row)}, 200
 
     except ForeignKeyViolation:
         return {"status": "error", "message": "Invalid foreign key reference."}, 400
@@ -257,7 +241,9 @@ def hide_user(user_id: str) -> tuple[Dict[str, Any], int]:
                     UPDATE users SET hidden = TRUE WHERE user_id = %s
                 """
                 cur.execute(hide_user_query, (user_id, ))
+                charts = charts_of_user(cur, user_id)
                 conn.commit()
+                invalidate_patients(charts)
 
                 return {"status": "success"}, 200
 
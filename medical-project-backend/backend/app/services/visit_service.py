@@ -3,6 +3,7 @@ from psycopg2.errors import ForeignKeyViolation
 from ..models import VisitCreate, VisitUpdate, VisitUpdateResponse, VisitCreateResponse
 from flask import current_app
 from ..db import Database
+from ..cache import invalidate_patients
 from ..utils.lookup_helpers import lookup_doctor_id, lookup_establishment_id
 
 
@@ -62,6 +63,7 @@ def add_visit(medical_insurance_id: str, data: VisitCreate) -> tuple[Dict[str, A
                     }, 400
 
                 conn.commit()
+                invalidate_patients([medical_insurance_id])
 
                 visit_response = VisitCreateResponse(
                     visit_id=visit_id,
@@ -84,7 +86,7 @@ def update_visit(visit_id: str, data: VisitUpdate) -> tuple[Dict[str, Any], int]
                     SELECT establishment_id, doctor_id, visit_date,
                         diagnostic_established, treatment, visit_summary,
                         notes, created_at, patient_id
-                    FROM medical_visits
+                    FROM medical_visits_current
                     WHERE visit_id = %s
                 """
                 cur.execute(select_created_at_query, (
@@ -152,6 +154,7 @@ def update_visit(visit_id: str, data: VisitUpdate) -> tuple[Dict[str, Any], int]
                 ))
 
                 conn.commit()
+                invalidate_patients([visit_data["patient_id"]])
 
         visit_response = VisitUpdateResponse(
             patient_id=visit_data["patient_id"],
@@ -181,10 +184,13 @@ def hide_visit(visit_id: str) -> tuple[Dict[str, Any], int]:
                 hide_visit_query = """
                     UPDATE medical_visits SET hidden = TRUE
                     WHERE visit_id = %s
+                    RETURNING patient_id
                 """
                 cur.execute(hide_visit_query, (visit_id, ))
 
+                patient_ids = [row[0] for row in cur.fetchall()]
                 conn.commit()
+                invalidate_patients(patient_ids)
 
                 return {"status": "success"}, 200
 
@@ -0,0 +1,24 @@
+from typing import Optional
+from flask import Response
+from werkzeug.datastructures import ETags
+
+
+def etag_matches(known_etags: Optional[ETags], etag: Optional[str]) -> bool:
+    """
+    Whether `etag` is one of the ETags the client sent in If-None-Match,
+    compared weakly as RFC 9110 requires for that header.
+    """
+    return bool(known_etags) and etag is not None and known_etags.contains_weak(etag)
+
+
+def not_modified(etag: str) -> Response:
+    """Empty 304 response for a representation the client already has."""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def with_etag(response: Response, etag: Optional[str]) -> Response:
+    if etag is not None:
+        response.set_etag(etag)
+    return response
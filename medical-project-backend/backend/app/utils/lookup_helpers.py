@@ -21,8 +21,8 @@ def lookup_doctor_id(first_name: Optional[str] = None, last_name: Optional[str]
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 query = """
-                    SELECT user_id 
-                    FROM users 
+                    SELECT user_id
+                    FROM users_current
                     WHERE user_id = %s AND user_type = 'DOCTOR'
                     LIMIT 1
                 """
@@ -36,10 +36,10 @@ def lookup_doctor_id(first_name: Optional[str] = None, last_name: Optional[str]
         with db_instance.get_conn() as conn:
             with conn.cursor() as cur:
                 query = """
-                    SELECT DISTINCT ON (user_id) user_id
-                    FROM users
+                    SELECT user_id
+                    FROM users_current
                     WHERE first_name = %s AND last_name = %s AND user_type = 'DOCTOR'
-                    ORDER BY user_id, modified_at DESC
+                    ORDER BY user_id
                     LIMIT 1
                 """
                 cur.execute(query, (first_name, last_name))
@@ -0,0 +1,76 @@
+import itertools
+import os
+from typing import Iterator, Optional
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Rows fetched per round trip by server-side cursors, and bytes of NDJSON
+# buffered before a chunk is sent: both bound the memory of a stream
+# whatever its length.
+STREAM_BATCH_SIZE = int(os.getenv("INF6150_STREAM_BATCH_SIZE", "500"))
+STREAM_CHUNK_SIZE = int(os.getenv("INF6150_STREAM_CHUNK_SIZE", "65536"))
+
+
+def wants_ndjson() -> bool:
+    """Whether the client asked for NDJSON rather than a JSON document."""
+    return request.accept_mimetypes.best_match(
+        ["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def server_side_rows(conn, name: str, query: str, params=None) -> Iterator[tuple]:
+    """
+    Rows of `query`, fetched STREAM_BATCH_SIZE at a time through a named
+    (server-side) cursor instead of all at once. Several of them can be
+    consumed side by side on the same connection as long as their names
+    differ.
+    """
+    with conn.cursor(name=name) as cur:
+        cur.itersize = STREAM_BATCH_SIZE
+        cur.execute(query, params)
+        yield from cur
+
+
+def prime(records: Iterator) -> Optional[Iterator]:
+    """
+    Run a record generator up to its first record, so that its connection
+    is checked out and its first query run while an error can still be
+    answered with a proper status code. Returns None when there is no
+    record at all.
+    """
+    try:
+        first = next(records)
+    except StopIteration:
+        return None
+    return itertools.chain([first], records)
+
+
+def ndjson_response(records: Iterator, status: int = 200) -> Response:
+    """
+    Stream `records` as NDJSON, one JSON document per line, serialized by
+    the app's JSON provider like jsonify does. Since the status is sent
+    before the body, an error in the middle of the stream is reported as a
+    last `{"error": ...}` line.
+    """
+    def lines():
+        chunk = []
+        size = 0
+        try:
+            for index, record in enumerate(records):
+                line = current_app.json.dumps(record) + "\n"
+                chunk.append(line)
+                size += len(line)
+                # The first record goes out on its own for a short time to
+                # first byte.
+                if index == 0 or size >= STREAM_CHUNK_SIZE:
+                    yield "".join(chunk)
+                    chunk = []
+                    size = 0
+        except Exception as e:
+            current_app.logger.exception("Streaming %s failed", request.path)
+            chunk.append(current_app.json.dumps({"error": repr(e)}) + "\n")
+        if chunk:
+            yield "".join(chunk)
+
+    return Response(stream_with_context(lines()), status=status,
+                    mimetype=NDJSON_MIMETYPE)
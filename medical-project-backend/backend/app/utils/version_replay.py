@@ -0,0 +1,127 @@
+import heapq
+from itertools import groupby
+from operator import itemgetter
+
+
+class VersionState:
+    """
+    State of the entities of a record at one point of a replay: the latest
+    version of each entity, by table and key.
+
+    `values` returns the same list for as long as its table doesn't change,
+    so unchanged parts are shared between snapshots instead of rebuilt.
+    Callers must therefore not modify the lists it returns.
+    """
+
+    def __init__(self):
+        self._entities = {}
+        self._sorted = {}
+
+    def apply(self, table: str, key, value):
+        self._entities.setdefault(table, {})[key] = value
+        self._sorted.pop(table, None)
+
+    def get(self, table: str, key, default=None):
+        return self._entities.get(table, {}).get(key, default)
+
+    def values(self, table: str) -> list:
+        """Latest version of every entity of `table`, ordered by key."""
+        values = self._sorted.get(table)
+        if values is None:
+            entities = self._entities.get(table, {})
+            values = [entities[key] for key in sorted(entities)]
+            self._sorted[table] = values
+        return values
+
+
+def replay_versions(*version_streams, since=None):
+    """
+    Replay version rows in time order.
+
+    Each stream is an iterable of (modified_at, table, key, value) tuples,
+    ordered by modified_at and, for rows of the same instant, from the oldest
+    version to the newest. Yields (modified_at, state) once every version of
+    that instant has been applied, the same VersionState being updated in
+    place from one instant to the next.
+
+    Versions older than `since` only build up the initial state: no
+    snapshot is yielded for their instants.
+    """
+    state = VersionState()
+    versions = heapq.merge(*version_streams, key=itemgetter(0))
+    for timestamp, instant_versions in groupby(versions, key=itemgetter(0)):
+        for _, table, key, value in instant_versions:
+            state.apply(table, key, value)
+        if since is None or timestamp >= since:
+            yield timestamp, state
+
+
+def _pointer_token(key) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _entity_key(entity):
+    """Id of a sub-entity of a snapshot, None when it has none."""
+    if not isinstance(entity, dict):
+        return None
+    if "id" in entity:
+        return entity["id"]
+    if isinstance(entity.get("parent"), dict):
+        return entity["parent"].get("user_id")
+    return None
+
+
+def _diff_entities(previous: list, current: list, path: str) -> list[dict]:
+    previous_keys = [_entity_key(entity) for entity in previous]
+    current_keys = [_entity_key(entity) for entity in current]
+    if None in previous_keys or None in current_keys \
+            or len(set(previous_keys)) != len(previous_keys) \
+            or len(set(current_keys)) != len(current_keys):
+        # Not a list of entities: no finer diff than the whole list.
+        return [] if previous == current else [
+            {"op": "replace", "path": path, "value": current}]
+
+    ops = []
+    previous_by_key = dict(zip(previous_keys, previous))
+    for key, entity in zip(current_keys, current):
+        pointer = f"{path}/{_pointer_token(key)}"
+        old = previous_by_key.pop(key, None)
+        if old is None:
+            ops.append({"op": "add", "path": pointer, "value": entity})
+        elif old is not entity:
+            ops.extend(diff_snapshots(old, entity, pointer))
+    for key in previous_by_key:
+        ops.append({"op": "remove", "path": f"{path}/{_pointer_token(key)}"})
+    return ops
+
+
+def diff_snapshots(previous: dict, current: dict, path: str = "") -> list[dict]:
+    """
+    JSON-Patch-like operations turning the `previous` snapshot into `current`.
+
+    Fields are addressed as in RFC 6902 (`/first_name`,
+    `/medical_visits/<id>/doctor/first_name`) except that list items are
+    addressed by their id instead of their position, so that inserting an
+    entity doesn't shift the others. Values that are the same object in
+    both snapshots, like the lists shared by VersionState, are skipped
+    without being compared.
+    """
+    ops = []
+    for key, value in current.items():
+        pointer = f"{path}/{_pointer_token(key)}"
+        if key not in previous:
+            ops.append({"op": "add", "path": pointer, "value": value})
+            continue
+        old = previous[key]
+        if old is value:
+            continue
+        if isinstance(old, dict) and isinstance(value, dict):
+            ops.extend(diff_snapshots(old, value, pointer))
+        elif isinstance(old, list) and isinstance(value, list):
+            ops.extend(_diff_entities(old, value, pointer))
+        elif old != value:
+            ops.append({"op": "replace", "path": pointer, "value": value})
+    for key in previous:
+        if key not in current:
+            ops.append({"op": "remove", "path": f"{path}/{_pointer_token(key)}"})
+    return ops
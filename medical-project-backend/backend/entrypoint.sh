@@ -1,10 +1,8 @@
 #!/bin/bash
 set -e
 
-python ./main.py db drop
+python ./main.py db migrate
 
-python ./main.py db init
-
-python ./main.py db add
+python ./main.py db add --if-empty
 
 exec python ./main.py serve
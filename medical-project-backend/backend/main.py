@@ -3,11 +3,24 @@ import typer
 from app import create_app
 from app.config import Config
 from app.db import Database
+from app.query_plans import explain_hot_queries
+from app.maintenance import create_maintenance_scheduler, token_partition_ahead_days
+from app.data_generator import DatasetGenerator, GENERATED_TABLES
 from pathlib import Path
 import os
 from dotenv import load_dotenv
 import sys
 from tests.test_framework import TestFramework
+from tests.benchmark import (Benchmark, HttpTransport, InProcessTransport, compare,
+                             load_results, parse_mix, parse_query_budgets, print_results,
+                             save_results, benchmark_serialization,
+                             print_serialization_results, benchmark_hashing,
+                             print_hashing_results)
+from app.json_provider import JSON_PROVIDERS
+from app.hashing import bcrypt_rounds
+from app.services.doctor_service import get_all_doctors
+from app.services.patient_service import get_patient, get_patient_version_history
+from app.services.token_service import partition_token_blacklist
 import requests
 from datetime import datetime
 
@@ -37,12 +50,34 @@ def serve_test(config_file: str = "config.toml"):
 
 
 @app.command()
-def db(command: str = typer.Argument(..., help="Database command: init, drop, add"),
+def db(command: str = typer.Argument(..., help="Database command: init, migrate, drop, add, generate, refresh, explain, maintenance, partition-tokens"),
        test_data: str = typer.Option(
         "All", "--test-data", "-t"),
-        config_file: str = "config.toml"):
+        config_file: str = "config.toml",
+        table: str = typer.Option(
+            None, "--table",
+            help="add: table to load the test data file into (default: file name)"),
+        if_empty: bool = typer.Option(
+            False, "--if-empty",
+            help="add: only add test data to a database without users"),
+        patients: int = typer.Option(
+            1000, "--patients",
+            help="generate: number of patients"),
+        seed: int = typer.Option(
+            6150, "--seed",
+            help="generate: random seed, the same seed gives the same data"),
+        output: str = typer.Option(
+            "generated", "--output",
+            help="generate: directory of the generated NDJSON files"),
+        load: bool = typer.Option(
+            False, "--load",
+            help="generate: load the generated files into the database"),
+        no_seqscan: bool = typer.Option(
+            False, "--no-seqscan",
+            help="explain: discourage sequential scans, for small databases")):
     """
-    Perform database operations: init, drop, add <testData>.
+    Perform database operations: init, migrate, drop, add <testData>, generate, refresh, explain,
+    maintenance, partition-tokens.
     """
 
     load_dotenv()
@@ -63,10 +98,10 @@ def db(command: str = typer.Argument(..., help="Database command: init, drop, ad
     db_instance = Database(user, password, host, port, database)
 
     try:
-        if command == "init":
-            db_instance.initialize_extensions()
-            db_instance.initialize_tables()
-            db_instance.initialize_indexes()
+        if command in ("init", "migrate"):
+            # On an empty database, applying every migration creates the
+            # schema and records it in schema_version.
+            db_instance.migrate()
         elif command == "drop":
             # confirmation = typer.confirm(
             #     "Are you sure you want to drop all tables?")
@@ -75,13 +110,18 @@ def db(command: str = typer.Argument(..., help="Database command: init, drop, ad
             db_instance.drop_tables()
             # else:
             # typer.echo("Drop operation cancelled.")
+        elif command == "add" and if_empty and not db_instance.is_empty():
+            typer.echo("Database already has data. Skipping test data.")
         elif command == "add":
             if test_data and test_data != "All":
                 data_path = Path(test_data)
                 if not data_path.exists():
                     typer.echo(f"Test data file '{test_data}' does not exist.")
                     sys.exit(1)
-                db_instance.add_test_data(str(data_path))
+                db_instance.add_test_data(
+                    str(data_path), table,
+                    progress=lambda name, rows: typer.echo(
+                        f"  {name}: {rows} rows loaded..."))
             elif test_data and test_data == "All":
                 data_dir = Path('data')
                 test_files = [
@@ -103,15 +143,192 @@ def db(command: str = typer.Argument(..., help="Database command: init, drop, ad
                             "does not exist. Skipping."
                         )
                 typer.echo("All available test data files have been added.")
+        elif command == "generate":
+            generator = DatasetGenerator(patients, seed=seed)
+            counts = generator.generate(
+                output, progress=lambda done: typer.echo(
+                    f"  {done}/{patients} patients generated..."))
+            for name in GENERATED_TABLES:
+                typer.echo(f"{name}: {counts[name]} rows")
+            if load:
+                for name in GENERATED_TABLES:
+                    db_instance.add_test_data(
+                        str(Path(output) / f"{name}.ndjson"), name,
+                        progress=lambda table_name, rows: typer.echo(
+                            f"  {table_name}: {rows} rows loaded..."))
+            else:
+                typer.echo(f"Generated files are in '{output}'. Load them with "
+                           f"'db generate --load' or 'db add -t <file>'.")
+        elif command == "refresh":
+            db_instance.refresh_current_tables()
+        elif command == "explain":
+            results = explain_hot_queries(db_instance, no_seqscan)
+            for result in results:
+                if result["status"] == "skipped":
+                    typer.echo(f"[SKIP]    {result['name']}: {result['reason']}")
+                    continue
+                label = "[OK]" if result["status"] == "ok" else "[MISSING]"
+                indexes = ", ".join(result["indexes"]) or "none"
+                typer.echo(f"{label:<10}{result['name']}: expected "
+                           f"{result['expected_index']}, uses {indexes}"
+                           f" (cost {result['total_cost']})")
+                if result["seq_scans"]:
+                    typer.echo(f"{'':<10}sequential scan on "
+                               f"{', '.join(result['seq_scans'])}")
+            if any(result["status"] == "missing" for result in results):
+                # Lets CI fail on a plan regression.
+                typer.echo("Some hot queries don't use their expected index.")
+                raise typer.Exit(code=1)
+        elif command == "maintenance":
+            scheduler = create_maintenance_scheduler(db_instance)
+            for name in scheduler.tasks:
+                result = scheduler.run(name)
+                if result is None:
+                    typer.echo(f"{name}: already running elsewhere, skipped")
+                else:
+                    typer.echo(f"{name}: {result}")
+        elif command == "partition-tokens":
+            copied = partition_token_blacklist(
+                db_instance, token_partition_ahead_days())
+            typer.echo(f"token_blacklist is partitioned by day of expiry "
+                       f"({copied} unexpired tokens copied).")
         else:
             typer.echo(f"Unknown command '{command}'. "
-                       " Use 'init', 'drop', or 'add'.")
+                       " Use 'init', 'migrate', 'drop', 'add', 'generate', 'refresh', 'explain',"
+                       " 'maintenance' or 'partition-tokens'.")
+            raise typer.Exit(code=1)
+    except typer.Exit:
+        raise
     except Exception as e:
+        # A failed migration must stop entrypoint.sh before the server starts.
         typer.echo(f"An error occurred: {e}")
+        raise typer.Exit(code=1)
     finally:
         db_instance.close_pool()
 
 
+@app.command()
+def bench(url: str = typer.Option(
+              None, "--url",
+              help="Benchmark a running server (e.g. http://localhost:5000) instead of the app in-process"),
+          users: int = typer.Option(10, "--users", help="Concurrent virtual users"),
+          duration: float = typer.Option(30, "--duration", help="Seconds of measured load"),
+          warmup: float = typer.Option(2, "--warmup", help="Seconds of load before measuring"),
+          mix: str = typer.Option(
+              None, "--mix",
+              help="Operation weights, e.g. 'patient_get=10,visit_post=2'"),
+          email: str = typer.Option("carol.williams@example.com", "--email"),
+          password: str = typer.Option("password5", "--password"),
+          patient_ids: str = typer.Option(
+              None, "--patient-ids", help="Comma separated medical insurance ids"),
+          generated_patients: int = typer.Option(
+              0, "--generated-patients",
+              help="Use the first N patients of 'db generate' instead"),
+          output: str = typer.Option(None, "--output", help="Save the results as JSON"),
+          baseline: str = typer.Option(
+              None, "--baseline", help="Results JSON of a previous run to compare with"),
+          max_regression: float = typer.Option(
+              0.2, "--max-regression", help="Allowed relative p95 increase over the baseline"),
+          query_budget: str = typer.Option(
+              None, "--query-budget",
+              help="Maximum queries per request, e.g. 'patient_get=2,doctors_list=2'"),
+          use_test_db: bool = typer.Option(True, "--test-db/--no-test-db"),
+          config_file: str = "config.toml"):
+    """
+    Load test the API and report latency percentiles per endpoint. Exits
+    with an error when a regression over the baseline is found.
+    """
+    if url:
+        def transport_factory():
+            return HttpTransport(url)
+    else:
+        flask_app = create_app(config_file, use_test_db=use_test_db)
+
+        def transport_factory():
+            return InProcessTransport(flask_app)
+
+    if generated_patients:
+        ids = [f"GEN{index:09d}" for index in range(generated_patients)]
+    elif patient_ids:
+        ids = [patient_id.strip() for patient_id in patient_ids.split(",")]
+    else:
+        ids = None
+
+    benchmark = Benchmark(transport_factory, email, password,
+                          users=users,
+                          duration=duration,
+                          warmup=warmup,
+                          mix=parse_mix(mix) if mix else None,
+                          patient_ids=ids)
+    results = benchmark.run()
+    print_results(results)
+
+    if output:
+        save_results(results, output)
+        typer.echo(f"Results saved to '{output}'.")
+
+    regressions = compare(results,
+                          load_results(baseline) if baseline else {},
+                          max_regression,
+                          query_budgets=parse_query_budgets(query_budget) if query_budget else None)
+    if regressions:
+        for regression in regressions:
+            typer.echo(f"REGRESSION {regression}")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def bench_json(patient_id: str = typer.Option("INS123456", "--patient-id"),
+               number: int = typer.Option(
+                   200, "--number", help="Serializations per payload and provider"),
+               use_test_db: bool = typer.Option(True, "--test-db/--no-test-db"),
+               config_file: str = "config.toml"):
+    """
+    Compare the JSON providers on the payloads of the patient, doctors and
+    version history endpoints.
+    """
+    flask_app = create_app(config_file, use_test_db=use_test_db)
+    with flask_app.test_request_context():
+        payloads = {}
+        for name, (result, status) in {
+            "get_patient": get_patient(patient_id),
+            "get_all_doctors": get_all_doctors(),
+            "version_history": get_patient_version_history(patient_id),
+        }.items():
+            if status != 200:
+                typer.echo(f"{name} failed: {result.get('message')}")
+                raise typer.Exit(code=1)
+            payloads[name] = result["data"]
+
+        providers = {name: provider(flask_app)
+                     for name, provider in reversed(JSON_PROVIDERS.items())}
+        results = benchmark_serialization(providers, payloads, number)
+    print_serialization_results(results, list(providers))
+
+
+@app.command()
+def bench_hashing(workers: str = typer.Option(
+                      None, "--workers",
+                      help="Comma separated hasher process counts, 0 hashes on the request threads "
+                           "(default: 0, 1 and the CPU count)"),
+                  users: int = typer.Option(8, "--users", help="Concurrent logins"),
+                  duration: float = typer.Option(5, "--duration", help="Seconds per configuration"),
+                  rounds: int = typer.Option(
+                      None, "--rounds", help="bcrypt cost factor (default: INF6150_BCRYPT_ROUNDS)")):
+    """
+    Measure password checks per second and per core with and without the
+    hasher process pool.
+    """
+    load_dotenv()
+    rounds = rounds or bcrypt_rounds()
+    if workers:
+        worker_counts = [int(count) for count in workers.split(",")]
+    else:
+        worker_counts = sorted({0, 1, os.cpu_count() or 1})
+    results = benchmark_hashing(rounds, worker_counts, users, duration)
+    print_hashing_results(results, rounds)
+
+
 @app.command()
 def test(cleanup: bool = typer.Option(False, "--cleanup", help="Clean up the database after tests")):
     """
@@ -80,6 +80,27 @@ def register_tests(suite, test_framework):
             raise AssertionError(
                 f"Expected 404 for non-existent route, got {response.status_code}")
 
+    @suite.test
+    def test_api_health_reports_pool_stats(test_framework):
+        """Test that the health check exposes the connection pool counters."""
+        response = requests.get(
+            f"http://localhost:{test_framework.api_port}/api/health"
+        )
+
+        if response.status_code != 200:
+            raise AssertionError(
+                f"Health check failed: {response.status_code}, {response.text}")
+
+        pool = response.json().get("pool", {})
+        for key in ["size", "in_use", "waiting", "checkouts", "wait_ms_avg", "checkout_ms_avg"]:
+            if key not in pool:
+                raise AssertionError(
+                    f"Expected '{key}' in pool stats, got {pool}")
+
+        if pool["checkouts"] < 1:
+            raise AssertionError(
+                f"Expected at least one recorded checkout, got {pool['checkouts']}")
+
     @suite.test
     def test_api_users_create(test_framework):
         """Test creating a new user(admin-only operation)."""
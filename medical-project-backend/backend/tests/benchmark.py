@@ -0,0 +1,516 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from datetime import date, datetime, timezone
+from rich.console import Console
+from rich.table import Table
+import requests
+
+# Default share of each operation in the request mix.
+DEFAULT_MIX = {
+    "login": 1,
+    "patient_get": 10,
+    "version_history": 2,
+    "visit_post": 2,
+    "visit_put": 2,
+    "doctors_list": 3,
+}
+
+# Patients of the sample data in data/users.json.
+DEFAULT_PATIENT_IDS = ["INS123456", "INS654321", "INS789012"]
+
+
+def parse_mix(value: str) -> dict:
+    """Parse a mix given as `name=weight,name=weight`."""
+    mix = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise ValueError(
+                f"Unknown operation '{name}'. Known operations: {', '.join(DEFAULT_MIX)}.")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("The mix must give a positive weight to an operation.")
+    return mix
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_query_budgets(value: str) -> dict:
+    """Parse query budgets given as `name=max_queries,name=max_queries`."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, budget = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise ValueError(
+                f"Unknown operation '{name}'. Known operations: {', '.join(DEFAULT_MIX)}.")
+        budgets[name] = int(budget)
+    return budgets
+
+
+class Response:
+    def __init__(self, status_code: int, payload, query_count: int = None):
+        self.status_code = status_code
+        self.payload = payload
+        # X-Query-Count of the response, when the server reports it.
+        self.query_count = query_count
+
+
+def _query_count(headers):
+    value = headers.get("X-Query-Count")
+    return int(value) if value is not None else None
+
+
+class HttpTransport:
+    """Sends the requests to a running server, e.g. `main.py serve-test`."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method: str, path: str, token: str = None, body: dict = None) -> Response:
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.session.request(
+            method, self.base_url + path, headers=headers, json=body, timeout=60)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return Response(response.status_code, payload, _query_count(response.headers))
+
+
+class InProcessTransport:
+    """Calls the Flask application directly through its test client."""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method: str, path: str, token: str = None, body: dict = None) -> Response:
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.client.open(
+            path, method=method, headers=headers, json=body)
+        return Response(response.status_code, response.get_json(silent=True),
+                        _query_count(response.headers))
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.status_codes = {}
+        self.query_counts = []
+
+    def record(self, latency: float, status_code: int, ok: bool, query_count: int = None):
+        self.latencies.append(latency)
+        if query_count is not None:
+            self.query_counts.append(query_count)
+        self.status_codes[status_code] = self.status_codes.get(
+            status_code, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def merge(self, other: "EndpointStats"):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        self.query_counts.extend(other.query_counts)
+        for status_code, count in other.status_codes.items():
+            self.status_codes[status_code] = self.status_codes.get(
+                status_code, 0) + count
+
+    def summary(self, elapsed: float) -> dict:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0.0,
+            "throughput": count / elapsed if elapsed else 0.0,
+            "mean_ms": sum(latencies) / count * 1000 if count else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": latencies[-1] * 1000 if count else 0.0,
+            "status_codes": {str(code): n for code, n in sorted(self.status_codes.items())},
+            "queries_mean": (sum(self.query_counts) / len(self.query_counts)
+                             if self.query_counts else None),
+            "queries_max": max(self.query_counts) if self.query_counts else None,
+        }
+
+
+class VirtualUser(threading.Thread):
+    """Replays the weighted mix of operations until the deadline."""
+
+    def __init__(self, benchmark: "Benchmark", index: int, deadline: float, warmup_until: float):
+        super().__init__(name=f"virtual-user-{index}", daemon=True)
+        self.benchmark = benchmark
+        self.transport = benchmark.transport_factory()
+        self.rng = random.Random(benchmark.seed + index)
+        self.deadline = deadline
+        self.warmup_until = warmup_until
+        self.stats = {}
+        self.token = None
+        self.visits = []
+        self.failure = None
+
+    def run(self):
+        try:
+            self.token = self.benchmark.login(self.transport)
+            operations = list(self.benchmark.mix)
+            weights = [self.benchmark.mix[name] for name in operations]
+            while time.perf_counter() < self.deadline:
+                name = self.rng.choices(operations, weights)[0]
+                self._run_operation(name)
+        except Exception as e:
+            self.failure = e
+
+    def _run_operation(self, name: str):
+        benchmark = self.benchmark
+        patient_id = self.rng.choice(benchmark.patient_ids)
+
+        if name == "login":
+            method, path, body, token = "POST", "/api/auth/login", benchmark.credentials, None
+        elif name == "patient_get":
+            method, path, body, token = "GET", f"/api/patients/{patient_id}", None, self.token
+        elif name == "version_history":
+            method, path, body, token = "GET", f"/api/patients/{patient_id}/version_history", None, self.token
+        elif name == "doctors_list":
+            method, path, body, token = "GET", "/api/doctors", None, self.token
+        elif name == "visit_post" or not self.visits:
+            name = "visit_post"
+            method, path, body, token = "POST", f"/api/patients/{patient_id}/visits", self._visit_body(), self.token
+        else:
+            patient_id, visit_id = self.rng.choice(self.visits)
+            method, path, body, token = "PUT", f"/api/patients/{patient_id}/visits/{visit_id}", self._visit_body(), self.token
+
+        start = time.perf_counter()
+        try:
+            response = self.transport.request(method, path, token, body)
+            status_code = response.status_code
+        except Exception:
+            response = None
+            status_code = 0
+        end = time.perf_counter()
+
+        if name == "visit_post" and response is not None and response.status_code == 201:
+            self.visits.append((patient_id, response.payload["visit_id"]))
+
+        if start >= self.warmup_until:
+            self.stats.setdefault(name, EndpointStats()).record(
+                end - start, status_code, 200 <= status_code < 300,
+                response.query_count if response is not None else None)
+
+    def _visit_body(self) -> dict:
+        return {
+            "establishment_id": self.rng.choice(self.benchmark.establishment_ids),
+            "doctor_id": self.rng.choice(self.benchmark.doctor_ids),
+            "visit_date": date.today().isoformat(),
+            "diagnostic": "Benchmark diagnostic",
+            "treatment": "Benchmark treatment",
+            "summary": "Benchmark visit",
+            "notes": f"Benchmark run {self.rng.randint(1, 10**6)}"
+        }
+
+
+class Benchmark:
+    """
+    Load test of the API with concurrent virtual users.
+
+    Each virtual user is a thread that logs in, then picks operations from
+    the weighted `mix` until `duration` seconds are over. Latencies recorded
+    during the first `warmup` seconds are discarded.
+
+    Args:
+        transport_factory: Creates the transport of a virtual user, either
+            HttpTransport or InProcessTransport.
+        email, password: Credentials of an ADMIN or DOCTOR account.
+        users: Number of concurrent virtual users.
+        duration: Seconds of measured load, after the warmup.
+        warmup: Seconds of load before measurements start.
+        mix: Weight of each operation, see DEFAULT_MIX.
+        patient_ids: Medical insurance ids of the patients to read and write.
+        seed: Seed of the operation and patient choices.
+    """
+
+    def __init__(self,
+                 transport_factory,
+                 email: str,
+                 password: str,
+                 users: int = 10,
+                 duration: float = 30.0,
+                 warmup: float = 2.0,
+                 mix: dict = None,
+                 patient_ids: list[str] = None,
+                 seed: int = 6150):
+        self.transport_factory = transport_factory
+        self.credentials = {"email": email, "password": password}
+        self.users = users
+        self.duration = duration
+        self.warmup = warmup
+        self.mix = mix or DEFAULT_MIX
+        self.patient_ids = patient_ids or DEFAULT_PATIENT_IDS
+        self.seed = seed
+        self.doctor_ids = []
+        self.establishment_ids = []
+
+    def login(self, transport) -> str:
+        response = transport.request("POST", "/api/auth/login", body=self.credentials)
+        if response.status_code != 200 or "token" not in (response.payload or {}):
+            raise RuntimeError(
+                f"Login failed with status code {response.status_code}: {response.payload}")
+        return response.payload["token"]
+
+    def _load_reference_data(self):
+        transport = self.transport_factory()
+        token = self.login(transport)
+        doctors = transport.request("GET", "/api/doctors", token)
+        establishments = transport.request("GET", "/api/establishments", token)
+        if doctors.status_code != 200 or establishments.status_code != 200:
+            raise RuntimeError("Could not load the doctors and establishments.")
+        self.doctor_ids = [doctor["user_id"] for doctor in doctors.payload["data"]]
+        self.establishment_ids = [establishment["establishment_id"]
+                                  for establishment in establishments.payload["data"]]
+        if not self.doctor_ids or not self.establishment_ids:
+            raise RuntimeError("The database has no doctor or establishment.")
+
+    def run(self) -> dict:
+        """Run the benchmark and return the results, ready to be saved as JSON."""
+        self._load_reference_data()
+
+        start = time.perf_counter()
+        warmup_until = start + self.warmup
+        deadline = warmup_until + self.duration
+        virtual_users = [VirtualUser(self, index, deadline, warmup_until)
+                         for index in range(self.users)]
+        for virtual_user in virtual_users:
+            virtual_user.start()
+        for virtual_user in virtual_users:
+            virtual_user.join()
+        elapsed = max(time.perf_counter() - warmup_until, 1e-9)
+
+        failures = [repr(vu.failure) for vu in virtual_users if vu.failure]
+        endpoints = {}
+        total = EndpointStats()
+        for virtual_user in virtual_users:
+            for name, stats in virtual_user.stats.items():
+                endpoints.setdefault(name, EndpointStats()).merge(stats)
+                total.merge(stats)
+
+        return {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "users": self.users,
+                "duration": self.duration,
+                "warmup": self.warmup,
+                "mix": self.mix,
+                "patients": len(self.patient_ids),
+                "seed": self.seed,
+                "virtual_user_failures": failures,
+            },
+            "endpoints": {name: stats.summary(elapsed)
+                          for name, stats in sorted(endpoints.items())},
+            "total": total.summary(elapsed),
+        }
+
+
+def compare(results: dict, baseline: dict, max_regression: float = 0.2,
+            max_error_rate: float = 0.01, query_budgets: dict = None) -> list[str]:
+    """
+    Compare results with a baseline run and return the regressions found:
+    a p95 latency more than `max_regression` (relative) above the baseline,
+    an error rate above `max_error_rate`, or an operation issuing more
+    queries than its budget in `query_budgets` (or than in the baseline).
+    """
+    regressions = []
+    for name, current in results["endpoints"].items():
+        if current["error_rate"] > max_error_rate:
+            regressions.append(
+                f"{name}: error rate {current['error_rate']:.1%} above {max_error_rate:.1%}")
+
+        previous = baseline.get("endpoints", {}).get(name) or {}
+        budget = (query_budgets or {}).get(name, previous.get("queries_max"))
+        if budget is not None and current.get("queries_max") is not None \
+                and current["queries_max"] > budget:
+            regressions.append(
+                f"{name}: {current['queries_max']} queries per request, budget is {budget}")
+
+        if not previous or not previous["p95_ms"]:
+            continue
+        limit = previous["p95_ms"] * (1 + max_regression)
+        if current["p95_ms"] > limit:
+            regressions.append(
+                f"{name}: p95 {current['p95_ms']:.1f}ms above {limit:.1f}ms "
+                f"(baseline {previous['p95_ms']:.1f}ms + {max_regression:.0%})")
+
+    if results["meta"]["virtual_user_failures"]:
+        regressions.append(
+            f"{len(results['meta']['virtual_user_failures'])} virtual user(s) failed: "
+            f"{results['meta']['virtual_user_failures'][0]}")
+    return regressions
+
+
+def print_results(results: dict, console: Console = None):
+    console = console or Console()
+    table = Table(title="Benchmark results")
+    table.add_column("Endpoint", style="cyan")
+    for column in ["Requests", "Errors", "Req/s", "p50 ms", "p95 ms", "p99 ms", "Max ms", "Queries"]:
+        table.add_column(column, justify="right")
+
+    rows = list(results["endpoints"].items()) + [("total", results["total"])]
+    for name, stats in rows:
+        table.add_row(
+            name,
+            str(stats["requests"]),
+            str(stats["errors"]),
+            f"{stats['throughput']:.1f}",
+            f"{stats['p50_ms']:.1f}",
+            f"{stats['p95_ms']:.1f}",
+            f"{stats['p99_ms']:.1f}",
+            f"{stats['max_ms']:.1f}",
+            "-" if stats.get("queries_max") is None
+            else f"{stats['queries_mean']:.1f} (max {stats['queries_max']})",
+        )
+    console.print(table)
+
+
+def save_results(results: dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def benchmark_serialization(providers: dict, payloads: dict, number: int = 200) -> dict:
+    """Mean time in ms each JSON provider takes to build the response of each payload."""
+    results = {}
+    for payload_name, payload in payloads.items():
+        results[payload_name] = {"bytes": len(next(iter(providers.values())).response(payload).get_data())}
+        for provider_name, provider in providers.items():
+            provider.response(payload)
+            start = time.perf_counter()
+            for _ in range(number):
+                provider.response(payload)
+            results[payload_name][provider_name] = (time.perf_counter() - start) / number * 1000
+    return results
+
+
+def print_serialization_results(results: dict, providers: list[str], console: Console = None):
+    console = console or Console()
+    table = Table(title="Serialization results")
+    table.add_column("Payload", style="cyan")
+    table.add_column("Bytes", justify="right")
+    for provider in providers:
+        table.add_column(f"{provider} ms", justify="right")
+    table.add_column("Speedup", justify="right")
+
+    for name, stats in results.items():
+        table.add_row(
+            name,
+            str(stats["bytes"]),
+            *(f"{stats[provider]:.3f}" for provider in providers),
+            f"{stats[providers[0]] / stats[providers[-1]]:.1f}x",
+        )
+    console.print(table)
+
+
+def benchmark_hashing(rounds: int, worker_counts: list[int], users: int = 8,
+                      duration: float = 5.0) -> dict:
+    """
+    Password checks per second of `users` concurrent logins for each number
+    of hasher processes (0 checks on the request threads), with the latency
+    of the checks and how late a 5 ms timer of the serving process fires.
+    """
+    from app.hashing import PasswordHasher, hash_password
+
+    password = "benchmark-password"
+    password_hash = hash_password(password, rounds)
+    results = {}
+    for workers in worker_counts:
+        hasher = PasswordHasher(workers, max_queue=users, rounds=rounds,
+                                timeout=max(duration * 4, 30))
+        try:
+            # Starts the processes before measuring.
+            warmup = [threading.Thread(target=hasher.check, args=(password_hash, password))
+                      for _ in range(max(workers, 1))]
+            for thread in warmup:
+                thread.start()
+            for thread in warmup:
+                thread.join()
+
+            latencies = []
+            stalls = []
+            lock = threading.Lock()
+            deadline = time.perf_counter() + duration
+
+            def login():
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    hasher.check(password_hash, password)
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+
+            def timer():
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    time.sleep(0.005)
+                    stalls.append(time.perf_counter() - start - 0.005)
+
+            threads = [threading.Thread(target=login) for _ in range(users)]
+            threads.append(threading.Thread(target=timer))
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            hasher.close()
+
+        latencies.sort()
+        stalls.sort()
+        cores = workers or min(users, os.cpu_count() or 1)
+        if workers == 0:
+            label = "request threads"
+        else:
+            label = f"{workers} worker" + ("s" if workers > 1 else "")
+        results[label] = {
+            "workers": workers,
+            "logins_per_s": len(latencies) / elapsed,
+            "per_core": len(latencies) / elapsed / cores,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "stall_p95_ms": percentile(stalls, 95) * 1000,
+        }
+    return results
+
+
+def print_hashing_results(results: dict, rounds: int, console: Console = None):
+    console = console or Console()
+    table = Table(title=f"Password check results (bcrypt cost {rounds})")
+    table.add_column("Hashing on", style="cyan")
+    table.add_column("Logins/s", justify="right")
+    table.add_column("Per core", justify="right")
+    table.add_column("p50 ms", justify="right")
+    table.add_column("p95 ms", justify="right")
+    table.add_column("Timer lag p95 ms", justify="right")
+    for name, stats in results.items():
+        table.add_row(
+            name,
+            f"{stats['logins_per_s']:.1f}",
+            f"{stats['per_core']:.1f}",
+            f"{stats['p50_ms']:.1f}",
+            f"{stats['p95_ms']:.1f}",
+            f"{stats['stall_p95_ms']:.2f}",
+        )
+    console.print(table)
@@ -0,0 +1,119 @@
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from app.bulk_loader import BulkLoader, iter_records
+
+
+def register_tests(suite, test_framework):
+    """Register bulk loader tests with the provided test suite"""
+
+    def write_file(directory, name, content):
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def load_establishments(test_framework, records):
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_file(directory, "establishments.ndjson",
+                              "\n".join(json.dumps(record) for record in records))
+            return BulkLoader(test_framework.db_instance, batch_size=2, workers=1).load(path)
+
+    def fetch_establishments(test_framework, establishment_ids):
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT establishment_id, establishment_name, created_at
+                    FROM establishments WHERE establishment_id = ANY(%s::UUID[]);
+                """, (establishment_ids,))
+                rows = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+            conn.rollback()
+        return rows
+
+    def delete_establishments(test_framework, establishment_ids):
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM establishments WHERE establishment_id = ANY(%s::UUID[]);",
+                            (establishment_ids,))
+            conn.commit()
+
+    @suite.test
+    def test_iter_records_reads_json_arrays(test_framework):
+        """Test that the records of a JSON array are read across chunk boundaries"""
+        records = [
+            {"name": "a, [b]", "nested": {"values": [1, 2, {"c": "]"}]}},
+            {"name": "quote \" and brace }", "empty": []},
+            {"name": "unicode é ✓", "value": None},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_file(directory, "records.json",
+                              "\n  [\n" + " ,\n".join(json.dumps(r) for r in records) + "\n]\n")
+            test_framework.assert_equals(records, list(iter_records(path, chunk_size=7)))
+
+            path = write_file(directory, "empty.json", " [ ] ")
+            test_framework.assert_equals([], list(iter_records(path)))
+
+            path = write_file(directory, "truncated.json", json.dumps(records)[:-5])
+            try:
+                list(iter_records(path, chunk_size=7))
+                test_framework.assert_true(False, "A truncated array should be rejected")
+            except ValueError:
+                pass
+
+    @suite.test
+    def test_iter_records_reads_ndjson(test_framework):
+        """Test that NDJSON records are read line by line, blank lines skipped"""
+        records = [{"name": "first", "tab": "a\tb"}, {"name": "second", "newline": "a\nb"}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_file(directory, "records.ndjson",
+                              "\n" + json.dumps(records[0]) + "\n\n" + json.dumps(records[1]) + "\n")
+            test_framework.assert_equals(records, list(iter_records(path)))
+
+            path = write_file(directory, "invalid.ndjson", json.dumps(records[0]) + "\n{invalid\n")
+            try:
+                list(iter_records(path))
+                test_framework.assert_true(False, "An invalid line should be rejected")
+            except ValueError as e:
+                test_framework.assert_true(":2:" in str(e), f"The line should be reported: {e}")
+
+    @suite.test
+    def test_copy_keeps_special_characters(test_framework):
+        """Test that values looking like NULL or holding separators are loaded as is"""
+        names = ["\\N", "tab\there", "say \"hi\"", "line\nbreak", "comma, here", "back\\slash"]
+        records = [{"establishment_id": str(uuid.uuid4()), "establishment_name": name}
+                   for name in names]
+        establishment_ids = [record["establishment_id"] for record in records]
+        try:
+            test_framework.assert_equals(len(records), load_establishments(test_framework, records))
+            rows = fetch_establishments(test_framework, establishment_ids)
+            for record in records:
+                test_framework.assert_equals(record["establishment_name"],
+                                             rows[record["establishment_id"]][0])
+        finally:
+            delete_establishments(test_framework, establishment_ids)
+
+    @suite.test
+    def test_missing_timestamps_get_the_load_time(test_framework):
+        """Test that each record keeps its own timestamps, whatever the first record has"""
+        created_at = datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        establishment_ids = [str(uuid.uuid4()) for _ in range(4)]
+        # Without, with, with, without: the first record of each batch differs.
+        records = [{"establishment_id": establishment_id, "establishment_name": "Timestamped"}
+                   for establishment_id in establishment_ids]
+        records[1]["created_at"] = created_at.isoformat()
+        records[2]["created_at"] = created_at.isoformat()
+        try:
+            started = datetime.now(timezone.utc)
+            load_establishments(test_framework, records)
+            rows = fetch_establishments(test_framework, establishment_ids)
+            test_framework.assert_equals(created_at, rows[establishment_ids[1]][1])
+            test_framework.assert_equals(created_at, rows[establishment_ids[2]][1])
+            for establishment_id in (establishment_ids[0], establishment_ids[3]):
+                loaded_at = rows[establishment_id][1]
+                test_framework.assert_true(
+                    loaded_at is not None and loaded_at >= started - timedelta(seconds=5),
+                    f"A record without created_at should get the load time, got {loaded_at}")
+        finally:
+            delete_establishments(test_framework, establishment_ids)
@@ -0,0 +1,150 @@
+import time
+import requests
+from app.cache import MemoryCache
+
+
+def register_tests(suite, test_framework):
+    """Register patient cache tests with the provided test suite"""
+
+    @suite.setup
+    def setup_cache_tests(test_framework):
+        """Setup tokens for the cache tests"""
+        try:
+            test_framework.admin_token = test_framework.login_and_get_token(
+                email="carol.williams@example.com",
+                password="password5"
+            )
+        except Exception as e:
+            raise AssertionError(f"Failed to obtain test tokens: {str(e)}")
+
+    def url(test_framework, path):
+        return f"http://localhost:{test_framework.api_port}/api{path}"
+
+    def headers(test_framework):
+        return {"Authorization": f"Bearer {test_framework.admin_token}"}
+
+    def get_patient(test_framework, medical_insurance_id):
+        response = requests.get(url(test_framework, f"/patients/{medical_insurance_id}"),
+                                headers=headers(test_framework))
+        test_framework.assert_equals(200, response.status_code)
+        return response
+
+    @suite.test
+    def test_memory_cache_evicts_least_recently_used(test_framework):
+        """Test that the memory cache keeps its most recently used entries"""
+        cache = MemoryCache(max_entries=2, ttl=0)
+        for key in ("a", "b"):
+            cache.put(key, cache.version(key), key.upper())
+        test_framework.assert_equals("A", cache.get("a", cache.version("a")))
+        cache.put("c", cache.version("c"), "C")
+
+        test_framework.assert_equals(None, cache.get("b", cache.version("b")))
+        test_framework.assert_equals("A", cache.get("a", cache.version("a")))
+        test_framework.assert_equals("C", cache.get("c", cache.version("c")))
+        test_framework.assert_equals(1, cache.stats()["evictions"])
+
+    @suite.test
+    def test_memory_cache_drops_documents_read_before_a_write(test_framework):
+        """Test that a document built before an invalidation is not cached"""
+        cache = MemoryCache(max_entries=10, ttl=0)
+        version = cache.version("a")
+        cache.invalidate("a")
+        cache.put("a", version, "stale")
+        test_framework.assert_equals(None, cache.get("a", cache.version("a")))
+
+        version = cache.version("a")
+        cache.put("a", version, "fresh")
+        cache.clear()
+        test_framework.assert_equals(None, cache.get("a", cache.version("a")))
+
+    @suite.test
+    def test_memory_cache_expires_entries(test_framework):
+        """Test that entries expire after the TTL"""
+        cache = MemoryCache(max_entries=10, ttl=0.05)
+        cache.put("a", cache.version("a"), "A")
+        test_framework.assert_equals("A", cache.get("a", cache.version("a")))
+        time.sleep(0.1)
+        test_framework.assert_equals(None, cache.get("a", cache.version("a")))
+
+    @suite.test
+    def test_cached_patient_skips_the_database(test_framework):
+        """Test that a cached chart is served without its query"""
+        first = get_patient(test_framework, "INS789012")
+        second = get_patient(test_framework, "INS789012")
+        test_framework.assert_equals(first.json(), second.json())
+        test_framework.assert_true(
+            int(second.headers["X-Query-Count"]) < int(first.headers["X-Query-Count"]),
+            "The second read should be served by the cache")
+
+    @suite.test
+    def test_writes_invalidate_the_patient(test_framework):
+        """Test that visits, coordinates and hidden visits show up in a cached chart"""
+        patient = get_patient(test_framework, "INS789012").json()
+        doctors = requests.get(url(test_framework, "/doctors"),
+                               headers=headers(test_framework)).json()["data"]
+        establishments = requests.get(url(test_framework, "/establishments"),
+                                      headers=headers(test_framework)).json()["data"]
+
+        response = requests.post(url(test_framework, "/patients/INS789012/visits"),
+                                 headers=headers(test_framework), json={
+            "establishment_id": establishments[0]["establishment_id"],
+            "doctor_id": doctors[0]["user_id"],
+            "visit_date": "2024-05-01",
+            "diagnostic": "Cache diagnostic",
+            "treatment": "Cache treatment",
+            "summary": "Cache visit",
+            "notes": "Cache notes"
+        })
+        test_framework.assert_equals(201, response.status_code)
+        visits = get_patient(test_framework, "INS789012").json()["medical_visits"]
+        visit = [v for v in visits if v["visit_summary"] == "Cache visit"]
+        test_framework.assert_equals(1, len(visit), "The new visit should be in the chart")
+
+        response = requests.delete(url(test_framework, f"/visits/{visit[0]['id']}"),
+                                   headers=headers(test_framework))
+        test_framework.assert_equals(200, response.status_code)
+        visits = get_patient(test_framework, "INS789012").json()["medical_visits"]
+        test_framework.assert_false(any(v["id"] == visit[0]["id"] for v in visits),
+                                    "The hidden visit should be gone from the chart")
+
+        response = requests.post(
+            url(test_framework, f"/users/{patient['user_id']}/coordinates"),
+            headers=headers(test_framework), json={
+                "street_address": "1 Cache Street",
+                "postal_code": "H0H 0H0",
+                "city": "Montreal",
+                "country": "Canada"
+            })
+        test_framework.assert_equals(201, response.status_code)
+        coordinates = get_patient(test_framework, "INS789012").json()["coordinates"]
+        test_framework.assert_true(
+            any(c["street_address"] == "1 Cache Street" for c in coordinates),
+            "The new coordinates should be in the chart")
+
+    @suite.test
+    def test_doctor_update_invalidates_their_patients(test_framework):
+        """Test that renaming a doctor shows in the charts of their patients"""
+        chart = get_patient(test_framework, "INS123456").json()
+        doctor_id = next(v["doctor"]["id"] for v in chart["medical_visits"] if v["doctor"])
+        user = requests.get(url(test_framework, f"/users/{doctor_id}"),
+                            headers=headers(test_framework)).json()
+
+        def rename(first_name):
+            response = requests.put(url(test_framework, f"/users/{doctor_id}"),
+                                    headers=headers(test_framework), json={
+                "login": user["login"],
+                "first_name": first_name,
+                "last_name": user["last_name"],
+                "phone_number": user["phone_number"],
+                "email": user["email"]
+            })
+            test_framework.assert_equals(201, response.status_code)
+
+        rename("Cached")
+        try:
+            chart = get_patient(test_framework, "INS123456").json()
+            names = {v["doctor"]["first_name"] for v in chart["medical_visits"]
+                     if v["doctor"] and v["doctor"]["id"] == doctor_id}
+            test_framework.assert_equals({"Cached"}, names)
+        finally:
+            rename(user["first_name"])
@@ -0,0 +1,93 @@
+import json
+import tempfile
+from datetime import date
+from pathlib import Path
+from app.bulk_loader import iter_records
+from app.data_generator import DatasetGenerator, GENERATED_TABLES
+
+
+def register_tests(suite, test_framework):
+    """Register dataset generator tests with the provided test suite"""
+
+    def generate(directory, seed: int = 42) -> dict:
+        return DatasetGenerator(60, seed=seed, heavy_ratio=0.05, max_versions=50).generate(directory)
+
+    def read(directory, table: str) -> list:
+        return list(iter_records(str(Path(directory) / f"{table}.ndjson")))
+
+    @suite.test
+    def test_same_seed_gives_the_same_files(test_framework):
+        """Test that generating twice with the same seed writes byte-identical files"""
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second, \
+                tempfile.TemporaryDirectory() as other:
+            counts = generate(first)
+            test_framework.assert_equals(counts, generate(second))
+            for table in GENERATED_TABLES:
+                test_framework.assert_equals(
+                    (Path(first) / f"{table}.ndjson").read_bytes(),
+                    (Path(second) / f"{table}.ndjson").read_bytes(),
+                    f"{table}.ndjson differs between two runs with the same seed")
+
+            generate(other, seed=43)
+            test_framework.assert_true(
+                (Path(first) / "users.ndjson").read_bytes() != (Path(other) / "users.ndjson").read_bytes(),
+                "Another seed should give other data")
+
+    @suite.test
+    def test_generated_references_exist(test_framework):
+        """Test that visits, history entries and parents refer to generated rows"""
+        with tempfile.TemporaryDirectory() as directory:
+            counts = generate(directory)
+            for table in GENERATED_TABLES:
+                test_framework.assert_true(counts[table] > 0, f"No {table} generated")
+
+            users = read(directory, "users")
+            user_types = {user["user_id"]: user["user_type"] for user in users}
+            doctor_ids = {user_id for user_id, user_type in user_types.items() if user_type == "DOCTOR"}
+            insurance_ids = {user["medical_insurance_id"] for user in users
+                             if user["user_type"] == "PATIENT"}
+            establishment_ids = {establishment["establishment_id"]
+                                 for establishment in read(directory, "establishments")}
+
+            for visit in read(directory, "medical_visits"):
+                test_framework.assert_true(visit["doctor_id"] in doctor_ids,
+                                           f"Unknown doctor in {json.dumps(visit)}")
+                test_framework.assert_true(visit["establishment_id"] in establishment_ids,
+                                           f"Unknown establishment in {json.dumps(visit)}")
+                test_framework.assert_true(visit["patient_id"] in insurance_ids,
+                                           f"Unknown patient in {json.dumps(visit)}")
+            for entry in read(directory, "medical_history"):
+                test_framework.assert_true(entry["doctor_id"] in doctor_ids,
+                                           f"Unknown doctor in {json.dumps(entry)}")
+                test_framework.assert_true(entry["patient_id"] in insurance_ids,
+                                           f"Unknown patient in {json.dumps(entry)}")
+            for parent in read(directory, "parents"):
+                test_framework.assert_equals("PARENT", user_types.get(parent["parent_id"]))
+                test_framework.assert_equals("PATIENT", user_types.get(parent["child_id"]))
+
+    @suite.test
+    def test_doctors_and_parents_are_adults(test_framework):
+        """Test that doctors and parents are born at least 25 years before the generated period ends"""
+        with tempfile.TemporaryDirectory() as directory:
+            generate(directory)
+            for user in read(directory, "users"):
+                if user["user_type"] in ("DOCTOR", "PARENT"):
+                    test_framework.assert_true(
+                        date.fromisoformat(user["date_of_birth"]) < date(2000, 1, 1),
+                        f"{user['login']} is born on {user['date_of_birth']}")
+
+    @suite.test
+    def test_parents_are_older_than_their_children(test_framework):
+        """Test that parents are born at least 16 years before their child"""
+        with tempfile.TemporaryDirectory() as directory:
+            generate(directory)
+            births = {user["user_id"]: date.fromisoformat(user["date_of_birth"])
+                      for user in read(directory, "users")}
+            parents = read(directory, "parents")
+            test_framework.assert_true(len(parents) > 0, "No parents generated")
+            for parent in parents:
+                parent_birth = births[parent["parent_id"]]
+                child_birth = births[parent["child_id"]]
+                test_framework.assert_true(
+                    (child_birth - parent_birth).days >= 16 * 365,
+                    f"Parent born on {parent_birth}, child on {child_birth}")
@@ -0,0 +1,108 @@
+import requests
+from tests.query_budget_tests import AUTH_QUERIES
+
+
+def register_tests(suite, test_framework):
+    """Register conditional request (ETag) tests with the provided test suite"""
+
+    @suite.setup
+    def setup_etag_tests(test_framework):
+        """Setup tokens for the ETag tests"""
+        try:
+            test_framework.admin_token = test_framework.login_and_get_token(
+                email="carol.williams@example.com",
+                password="password5"
+            )
+        except Exception as e:
+            raise AssertionError(f"Failed to obtain test tokens: {str(e)}")
+
+    def url(test_framework, path):
+        return f"http://localhost:{test_framework.api_port}/api{path}"
+
+    def get(test_framework, path, etag=None):
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        return requests.get(url(test_framework, path), headers=headers)
+
+    @suite.test
+    def test_listings_answer_not_modified(test_framework):
+        """Test that unchanged listings are answered with 304 from the probe query alone"""
+        for path in ("/doctors", "/establishments"):
+            response = get(test_framework, path)
+            test_framework.assert_equals(200, response.status_code)
+            etag = response.headers.get("ETag")
+            test_framework.assert_true(etag is not None, f"{path} should have an ETag")
+
+            response = get(test_framework, path, etag)
+            test_framework.assert_equals(304, response.status_code)
+            test_framework.assert_equals(etag, response.headers.get("ETag"))
+            test_framework.assert_equals(b"", response.content)
+            test_framework.assert_query_budget(response, AUTH_QUERIES + 1)
+
+            response = get(test_framework, path, '"stale", W/' + etag)
+            test_framework.assert_equals(304, response.status_code)
+
+            response = get(test_framework, path, '"stale"')
+            test_framework.assert_equals(200, response.status_code)
+            test_framework.assert_equals(etag, response.headers.get("ETag"))
+
+    @suite.test
+    def test_patient_answers_not_modified(test_framework):
+        """Test that an unchanged patient is answered with 304"""
+        response = get(test_framework, "/patients/INS123456")
+        test_framework.assert_equals(200, response.status_code)
+        etag = response.headers["ETag"]
+
+        response = get(test_framework, "/patients/INS123456", etag)
+        test_framework.assert_equals(304, response.status_code)
+        test_framework.assert_equals(etag, response.headers.get("ETag"))
+
+        response = get(test_framework, "/patients/INS123456?fields=first_name", etag)
+        test_framework.assert_equals(200, response.status_code)
+        projected_etag = response.headers["ETag"]
+        test_framework.assert_true(projected_etag != etag,
+                                   "A projection should have its own ETag")
+        response = get(test_framework, "/patients/INS123456?fields=first_name", projected_etag)
+        test_framework.assert_equals(304, response.status_code)
+
+        response = get(test_framework, "/patients/INS123456?from_date=01-01-2100")
+        test_framework.assert_equals(None, response.headers.get("ETag"))
+
+    @suite.test
+    def test_patient_etag_changes_with_its_rows(test_framework):
+        """Test that adding and hiding a visit both change the patient's ETag"""
+        etag = get(test_framework, "/patients/INS789012").headers["ETag"]
+        doctors = get(test_framework, "/doctors").json()["data"]
+        establishments = get(test_framework, "/establishments").json()["data"]
+
+        response = requests.post(
+            url(test_framework, "/patients/INS789012/visits"),
+            headers={"Authorization": f"Bearer {test_framework.admin_token}"},
+            json={
+                "establishment_id": establishments[0]["establishment_id"],
+                "doctor_id": doctors[0]["user_id"],
+                "visit_date": "2024-06-01",
+                "diagnostic": "ETag diagnostic",
+                "treatment": "ETag treatment",
+                "summary": "ETag visit",
+                "notes": "ETag notes"
+            })
+        test_framework.assert_equals(201, response.status_code)
+
+        response = get(test_framework, "/patients/INS789012", etag)
+        test_framework.assert_equals(200, response.status_code)
+        added_etag = response.headers["ETag"]
+        test_framework.assert_true(added_etag != etag, "A new visit should change the ETag")
+        visit = next(v for v in response.json()["medical_visits"]
+                     if v["visit_summary"] == "ETag visit")
+
+        response = requests.delete(
+            url(test_framework, f"/visits/{visit['id']}"),
+            headers={"Authorization": f"Bearer {test_framework.admin_token}"})
+        test_framework.assert_equals(200, response.status_code)
+
+        response = get(test_framework, "/patients/INS789012", added_etag)
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_true(response.headers["ETag"] != added_etag,
+                                   "Hiding the visit should change the ETag")
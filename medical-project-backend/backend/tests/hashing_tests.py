@@ -0,0 +1,150 @@
+import threading
+import time
+import uuid
+import requests
+from app.hashing import (PasswordHasher, PasswordHasherBusy, bcrypt_rounds, check_password,
+                         hash_parameters, hash_password)
+from app.services.auth_service import store_rehashed_password
+
+
+def register_tests(suite, test_framework):
+    """Register password hasher tests with the provided test suite"""
+
+    def current_hash(test_framework, user_id):
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT password_hash, (SELECT COUNT(*) FROM users WHERE user_id = %(user_id)s)
+                    FROM users_current WHERE user_id = %(user_id)s;
+                """, {"user_id": user_id})
+                row = cur.fetchone()
+            conn.rollback()
+        return row
+
+    @suite.test
+    def test_hasher_checks_its_hashes(test_framework):
+        """Test that hashes made by the worker processes check out"""
+        hasher = PasswordHasher(1, max_queue=2, rounds=4)
+        try:
+            password_hash = hasher.hash("correct horse")
+            test_framework.assert_true(password_hash.startswith("$2b$04$"),
+                                       "The hash should use the configured cost")
+            test_framework.assert_true(hasher.check(password_hash, "correct horse"))
+            test_framework.assert_false(hasher.check(password_hash, "wrong horse"))
+            test_framework.assert_false(hasher.check("", "correct horse"))
+            test_framework.assert_equals(4, hasher.stats()["completed"])
+        finally:
+            hasher.close()
+
+    @suite.test
+    def test_saturated_hasher_rejects(test_framework):
+        """Test that an operation beyond the queue limit is rejected rather than queued"""
+        hasher = PasswordHasher(0, max_queue=0, rounds=12)
+        thread = threading.Thread(target=hasher.hash, args=("slow password",))
+        thread.start()
+        try:
+            deadline = time.monotonic() + 5
+            while hasher.stats()["in_progress"] == 0 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            try:
+                hasher.hash("another password")
+                test_framework.assert_true(False, "The saturated hasher should reject")
+            except PasswordHasherBusy as e:
+                test_framework.assert_equals(1, e.retry_after)
+            test_framework.assert_equals(1, hasher.stats()["rejected"])
+        finally:
+            thread.join()
+
+    @suite.test
+    def test_timed_out_operation_keeps_its_slot(test_framework):
+        """Test that an operation that timed out holds its slot until its process is done"""
+        hasher = PasswordHasher(1, max_queue=0, rounds=14, timeout=30)
+        try:
+            # Started first, so that the next operation runs at once.
+            hasher.check(hash_password("warm up", 4), "warm up")
+            hasher.timeout = 0.05
+            try:
+                hasher.hash("slow password")
+                test_framework.assert_true(False, "The operation should time out")
+            except PasswordHasherBusy:
+                pass
+            stats = hasher.stats()
+            test_framework.assert_equals(1, stats["timeouts"])
+            test_framework.assert_equals(1, stats["in_progress"])
+
+            try:
+                hasher.check(hash_password("fast", 4), "fast")
+                test_framework.assert_true(False, "The hash still running should hold the slot")
+            except PasswordHasherBusy:
+                pass
+            test_framework.assert_equals(1, hasher.stats()["rejected"])
+
+            deadline = time.monotonic() + 30
+            while hasher.stats()["in_progress"] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            test_framework.assert_equals(0, hasher.stats()["in_progress"])
+            hasher.timeout = 30
+            test_framework.assert_true(hasher.check(hash_password("fast", 4), "fast"))
+        finally:
+            hasher.close()
+
+    @suite.test
+    def test_hash_parameters_drive_rehashing(test_framework):
+        """Test that only hashes made with another cost need a rehash"""
+        hasher = PasswordHasher(0, rounds=5)
+        test_framework.assert_equals(
+            {"algorithm": "bcrypt", "variant": "2b", "rounds": 4},
+            hash_parameters(hash_password("password", 4)))
+        test_framework.assert_equals(None, hash_parameters(""))
+        test_framework.assert_true(hasher.needs_rehash(hash_password("password", 4)))
+        test_framework.assert_false(hasher.needs_rehash(hasher.hash("password")))
+        test_framework.assert_false(hasher.needs_rehash("not a bcrypt hash"))
+
+    @suite.test
+    def test_login_upgrades_the_hash_cost(test_framework):
+        """Test that a login rehashes a password hashed with another cost, in place"""
+        admin_token = test_framework.login_and_get_token(
+            email="carol.williams@example.com",
+            password="password5"
+        )
+        email = f"rehash.{uuid.uuid4().hex[:8]}@example.com"
+        response = requests.post(
+            f"http://localhost:{test_framework.api_port}/api/users",
+            headers={"Authorization": f"Bearer {admin_token}"},
+            json={
+                "login": email,
+                "password": "rehash me",
+                "user_type": "PATIENT",
+                "first_name": "Re",
+                "last_name": "Hash",
+                "phone_number": "555-123-4567",
+                "email": email
+            }
+        )
+        test_framework.assert_equals(201, response.status_code)
+        user_id = response.json()["user_id"]
+
+        old_hash = hash_password("rehash me", 4)
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE users SET password_hash = %s WHERE user_id = %s;",
+                            (old_hash, user_id))
+            conn.commit()
+        _, versions = current_hash(test_framework, user_id)
+
+        test_framework.login_and_get_token(email=email, password="rehash me")
+        deadline = time.monotonic() + 10
+        while current_hash(test_framework, user_id)[0] == old_hash \
+                and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        new_hash, new_versions = current_hash(test_framework, user_id)
+        test_framework.assert_equals(bcrypt_rounds(), hash_parameters(new_hash)["rounds"])
+        test_framework.assert_true(check_password(new_hash, "rehash me"))
+        test_framework.assert_equals(versions, new_versions)
+        test_framework.login_and_get_token(email=email, password="rehash me")
+
+        # A hash replaced in the meantime is left alone.
+        test_framework.assert_false(store_rehashed_password(
+            test_framework.db_instance, user_id, old_hash, hash_password("rehash me", 4)))
+        test_framework.assert_equals(new_hash, current_hash(test_framework, user_id)[0])
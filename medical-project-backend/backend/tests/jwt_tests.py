@@ -1,3 +1,4 @@
+import uuid
 import requests
 
 
@@ -89,6 +90,53 @@ def register_tests(suite, test_framework):
             url=f"http://localhost:{test_framework.api_port}/api/patients/INS123456"
         )
 
+    @suite.test
+    def test_logout_everywhere(test_framework):
+        """Test that logging out everywhere revokes every token of the user, and only theirs."""
+        admin_token = test_framework.login_and_get_token(
+            email="carol.williams@example.com",
+            password="password5"
+        )
+        email = f"everywhere.{uuid.uuid4().hex[:8]}@example.com"
+        response = requests.post(
+            f"http://localhost:{test_framework.api_port}/api/users",
+            headers={"Authorization": f"Bearer {admin_token}"},
+            json={
+                "login": email,
+                "password": "everywhere",
+                "user_type": "PATIENT",
+                "first_name": "Every",
+                "last_name": "Where",
+                "phone_number": "555-123-4567",
+                "email": email
+            }
+        )
+        test_framework.assert_equals(201, response.status_code)
+
+        def mfa_status(token):
+            return requests.get(
+                f"http://localhost:{test_framework.api_port}/api/mfa/status",
+                headers={"Authorization": f"Bearer {token}"}
+            ).status_code
+
+        tokens = [test_framework.login_and_get_token(email=email, password="everywhere")
+                  for _ in range(2)]
+        test_framework.assert_equals([200, 200], [mfa_status(token) for token in tokens])
+
+        response = requests.post(
+            f"http://localhost:{test_framework.api_port}/api/auth/logout-everywhere",
+            headers={"Authorization": f"Bearer {tokens[0]}"}
+        )
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_equals([401, 401], [mfa_status(token) for token in tokens])
+
+        token = test_framework.login_and_get_token(email=email, password="everywhere")
+        test_framework.assert_equals(200, mfa_status(token))
+        test_framework.assert_protected_route_access(
+            url=f"http://localhost:{test_framework.api_port}/api/doctors",
+            token=admin_token
+        )
+
     @suite.test
     def test_admin_permissions(test_framework):
         """Test that an admin user can access admin-only routes."""
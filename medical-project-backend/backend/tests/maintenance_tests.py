@@ -0,0 +1,137 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from app.maintenance import MaintenanceScheduler, MAINTENANCE_LOCK_CLASS
+from app.services.token_service import (
+    maintain_token_partitions,
+    partition_token_blacklist,
+    purge_expired_tokens,
+    TOKEN_PARTITIONED_QUERY,
+)
+
+
+def register_tests(suite, test_framework):
+    """Register maintenance scheduler tests with the provided test suite"""
+
+    @suite.test
+    def test_purge_deletes_expired_tokens_in_batches(test_framework):
+        """Test that the purge deletes every expired token and keeps the others"""
+        user_id = str(uuid.uuid4())
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                for expires_in in ("-2 days", "-1 hour", "-1 hour", "-1 minute", "1 hour"):
+                    cur.execute("""
+                        INSERT INTO token_blacklist (jti, token_type, user_id, expires_at)
+                        VALUES (%s, 'access', %s, NOW() + %s::INTERVAL);
+                    """, (str(uuid.uuid4()), user_id, expires_in))
+            conn.commit()
+
+        try:
+            removed = purge_expired_tokens(test_framework.db_instance, batch_size=2)
+            test_framework.assert_true(removed >= 4, f"Expected at least 4 removed, got {removed}")
+
+            with test_framework.db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT COUNT(*), COUNT(*) FILTER (WHERE expires_at < NOW())
+                        FROM token_blacklist WHERE user_id = %s;
+                    """, (user_id,))
+                    remaining, expired = cur.fetchone()
+                conn.rollback()
+            test_framework.assert_equals(1, remaining)
+            test_framework.assert_equals(0, expired)
+        finally:
+            with test_framework.db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM token_blacklist WHERE user_id = %s;", (user_id,))
+                conn.commit()
+
+    @suite.test
+    def test_token_past_the_partitions_is_kept(test_framework):
+        """Test that a token expiring past the daily partitions goes to the default one, then to its day"""
+        db_instance = test_framework.db_instance
+        with db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(TOKEN_PARTITIONED_QUERY)
+                partitioned = cur.fetchone()[0]
+            conn.rollback()
+        if not partitioned:
+            partition_token_blacklist(db_instance, ahead_days=2)
+
+        def token_partition(cur, jti):
+            cur.execute("SELECT tableoid::regclass::TEXT FROM token_blacklist WHERE jti = %s;", (jti,))
+            return cur.fetchone()[0]
+
+        jti = str(uuid.uuid4())
+        try:
+            with db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT MAX(c.relname) FROM pg_inherits i
+                        JOIN pg_class c ON c.oid = i.inhrelid
+                        WHERE i.inhparent = 'token_blacklist'::regclass
+                            AND c.relname LIKE 'token_blacklist_p%';
+                    """)
+                    last_day = datetime.strptime(cur.fetchone()[0], "token_blacklist_p%Y%m%d").date()
+                    day = last_day + timedelta(days=1)
+                    cur.execute("""
+                        INSERT INTO token_blacklist (jti, token_type, user_id, expires_at)
+                        VALUES (%s, 'refresh', %s, %s);
+                    """, (jti, str(uuid.uuid4()),
+                          datetime(day.year, day.month, day.day, 12, tzinfo=timezone.utc)))
+                    test_framework.assert_equals("token_blacklist_default", token_partition(cur, jti))
+                conn.commit()
+
+            today = datetime.now(timezone.utc).date()
+            result = maintain_token_partitions(db_instance, ahead_days=(day - today).days)
+            test_framework.assert_equals(1, result["moved"])
+            with db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    test_framework.assert_equals(f"token_blacklist_p{day:%Y%m%d}", token_partition(cur, jti))
+                conn.rollback()
+        finally:
+            with db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM token_blacklist WHERE jti = %s;", (jti,))
+                conn.commit()
+
+    @suite.test
+    def test_task_running_elsewhere_is_skipped(test_framework):
+        """Test that a task already holding its lock in another worker is skipped"""
+        scheduler = MaintenanceScheduler(test_framework.db_instance, enabled=False)
+        scheduler.add("answer", lambda db_instance: 42, 60)
+
+        conn = test_framework.db_instance.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(%s, 0);", (MAINTENANCE_LOCK_CLASS,))
+            test_framework.assert_equals(None, scheduler.run("answer"))
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s, 0);", (MAINTENANCE_LOCK_CLASS,))
+        finally:
+            conn.close()
+
+        test_framework.assert_equals(42, scheduler.run("answer"))
+        stats = scheduler.stats()["tasks"]["answer"]
+        test_framework.assert_equals(1, stats["runs"])
+        test_framework.assert_equals(1, stats["skips"])
+        test_framework.assert_equals(42, stats["last_result"])
+
+    @suite.test
+    def test_failures_are_recorded(test_framework):
+        """Test that a failing task is counted with its error"""
+        def fail(db_instance):
+            raise RuntimeError("maintenance failure")
+
+        scheduler = MaintenanceScheduler(test_framework.db_instance, enabled=False)
+        scheduler.add("fail", fail, 60)
+        try:
+            scheduler.run("fail")
+            test_framework.assert_true(False, "The task's error should be raised")
+        except RuntimeError:
+            pass
+        stats = scheduler.stats()["tasks"]["fail"]
+        test_framework.assert_equals(1, stats["failures"])
+        test_framework.assert_true("maintenance failure" in stats["last_error"])
+        # The lock is released after a failure.
+        scheduler.add("fail", lambda db_instance: "ok", 60)
+        test_framework.assert_equals("ok", scheduler.run("fail"))
@@ -477,6 +477,47 @@ def register_tests(suite, test_framework):
             raise AssertionError(f"Expected 404 Not Found for non-existent patient, but got {
                                  response.status_code}: {response.text}")
 
+    @suite.test
+    def test_get_patient_fields(test_framework):
+        """Test that fields and include project the patient document"""
+        url = f"http://localhost:{test_framework.api_port}/api/patients/INS123456"
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+        patient = requests.get(url, headers=headers).json()
+
+        response = requests.get(url, headers=headers,
+                                params={"fields": "first_name,last_name,date_of_birth"})
+        if response.status_code != 200:
+            raise AssertionError(f"Failed to get patient fields: {
+                                 response.status_code}, {response.text}")
+        expected = {name: patient[name]
+                    for name in ("first_name", "last_name", "date_of_birth")}
+        test_framework.assert_equals(expected, response.json())
+
+        response = requests.get(url, headers=headers, params={"include": "parents"})
+        test_framework.assert_equals(200, response.status_code)
+        expected = {name: value for name, value in patient.items()
+                    if name not in ("coordinates", "medical_history", "medical_visits")}
+        test_framework.assert_equals(expected, response.json())
+
+        response = requests.get(url, headers=headers,
+                                params={"fields": "first_name", "include": "medical_visits"})
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_equals(
+            {"first_name": patient["first_name"], "medical_visits": patient["medical_visits"]},
+            response.json())
+
+    @suite.test
+    def test_get_patient_unknown_fields(test_framework):
+        """Test that unknown fields and lists are rejected"""
+        url = f"http://localhost:{test_framework.api_port}/api/patients/INS123456"
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+        for params in ({"fields": "first_name,password_hash"}, {"include": "first_name"},
+                       {"fields": ""}, {"fields": "first_name", "from_date": "01-01-2024"}):
+            response = requests.get(url, headers=headers, params=params)
+            if response.status_code != 400:
+                raise AssertionError(f"Expected 400 for {params}, but got {
+                                     response.status_code}: {response.text}")
+
     @suite.teardown
     def teardown_patients_tests(test_framework):
         # No database cleanup needed - transactions handle this
@@ -0,0 +1,179 @@
+import requests
+from datetime import date
+from app.query_log import capture_queries
+
+# Outside of TESTING, every authenticated request starts with the token
+# revocation check, which queries the database while the revocation cache
+# is stale: budgets include it so that they hold in production too.
+AUTH_QUERIES = 1
+
+
+def register_tests(suite, test_framework):
+    """Register query budget tests with the provided test suite"""
+
+    @suite.setup
+    def setup_query_budget_tests(test_framework):
+        """Setup tokens for the query budget tests"""
+        try:
+            test_framework.admin_token = test_framework.login_and_get_token(
+                email="carol.williams@example.com",
+                password="password5"
+            )
+            test_framework.doctor_token = test_framework.login_and_get_token(
+                email="alice.brown@example.com",
+                password="password3"
+            )
+        except Exception as e:
+            raise AssertionError(f"Failed to obtain test tokens: {str(e)}")
+
+    def get(test_framework, path, token):
+        return requests.get(
+            f"http://localhost:{test_framework.api_port}{path}",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+
+    @suite.test
+    def test_capture_queries_records_statements(test_framework):
+        """Test that the instrumented cursor records statements without their parameters"""
+        with capture_queries() as query_log:
+            with test_framework.db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT %s::text;", ("INS123456",))
+                    cur.fetchone()
+                    cur.executemany("SELECT %s;", [(1,), (2,), (3,)])
+                conn.rollback()
+
+        test_framework.assert_equals(2, len(query_log.queries))
+        test_framework.assert_equals(4, query_log.count)
+        test_framework.assert_equals(
+            "SELECT %s::text;", query_log.queries[0]["statement"])
+        test_framework.assert_equals(1, query_log.queries[0]["rows"])
+        test_framework.assert_true(query_log.total_time > 0)
+        test_framework.assert_false(
+            "INS123456" in str(query_log.summary()),
+            "Query parameters must not be recorded")
+
+    @suite.test
+    def test_queries_outside_requests_are_not_recorded(test_framework):
+        """Test that nothing is recorded when no query log is active"""
+        with capture_queries() as query_log:
+            pass
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+        test_framework.assert_equals(0, query_log.count)
+
+    @suite.test
+    def test_query_headers_are_sent(test_framework):
+        """Test that serve-test reports the query count and time of each request"""
+        response = get(test_framework, "/api/doctors",
+                       test_framework.admin_token)
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_true("X-Query-Count" in response.headers)
+        test_framework.assert_true("X-Query-Time" in response.headers)
+        test_framework.assert_true(int(response.headers["X-Query-Count"]) > 0)
+
+    @suite.test
+    def test_get_patient_budget(test_framework):
+        """Test that GET /api/patients/<id> issues at most 2 queries"""
+        response = get(test_framework, "/api/patients/INS123456",
+                       test_framework.admin_token)
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_query_budget(response, AUTH_QUERIES + 1)
+
+    @suite.test
+    def test_get_unknown_patient_budget(test_framework):
+        """Test that a missing patient doesn't cost more queries than an existing one"""
+        response = get(test_framework, "/api/patients/INS000000",
+                       test_framework.admin_token)
+        test_framework.assert_equals(404, response.status_code)
+        test_framework.assert_query_budget(response, AUTH_QUERIES + 1)
+
+    @suite.test
+    def test_list_doctors_budget(test_framework):
+        """Test that GET /api/doctors issues a single query besides authentication"""
+        response = get(test_framework, "/api/doctors",
+                       test_framework.admin_token)
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_query_budget(response, AUTH_QUERIES + 1)
+
+    @suite.test
+    def test_list_establishments_budget(test_framework):
+        """Test that GET /api/establishments issues a single query besides authentication"""
+        response = get(test_framework, "/api/establishments",
+                       test_framework.admin_token)
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_query_budget(response, AUTH_QUERIES + 1)
+
+    @suite.test
+    def test_login_budget(test_framework):
+        """Test that logging in issues at most 2 queries"""
+        response = requests.post(
+            f"http://localhost:{test_framework.api_port}/api/auth/login",
+            json={"email": "alice.brown@example.com", "password": "password3"}
+        )
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_query_budget(response, 2)
+
+    @suite.test
+    def test_add_visit_budget(test_framework):
+        """Test that adding a visit doesn't issue one query per related entity"""
+        doctors = get(test_framework, "/api/doctors",
+                      test_framework.admin_token).json()["data"]
+        establishments = get(test_framework, "/api/establishments",
+                             test_framework.admin_token).json()["data"]
+
+        response = requests.post(
+            f"http://localhost:{test_framework.api_port}/api/patients/INS123456/visits",
+            headers={"Authorization": f"Bearer {test_framework.doctor_token}"},
+            json={
+                "establishment_id": establishments[0]["establishment_id"],
+                "doctor_id": doctors[0]["user_id"],
+                "visit_date": date.today().isoformat(),
+                "diagnostic": "Budget diagnostic",
+                "treatment": "Budget treatment",
+                "summary": "Budget visit",
+                "notes": "Budget notes"
+            }
+        )
+        test_framework.assert_equals(201, response.status_code)
+        test_framework.assert_query_budget(response, AUTH_QUERIES + 3)
+
+    @suite.test
+    def test_version_history_budget_does_not_grow_with_versions(test_framework):
+        """Test that the version history costs the same number of queries whatever its length"""
+        url = f"http://localhost:{test_framework.api_port}/api/patients/INS654321"
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+
+        response = requests.get(f"{url}/version_history", headers=headers)
+        test_framework.assert_equals(200, response.status_code)
+        queries_before = test_framework.assert_query_budget(
+            response, AUTH_QUERIES + 5)
+
+        patient = requests.get(url, headers=headers).json()
+        for i in range(3):
+            response = requests.put(url, headers=headers, json={
+                "login": patient["login"],
+                "gender": patient["gender"],
+                "city_of_birth": patient["city_of_birth"],
+                "first_name": f"Budget{i}",
+                "last_name": patient["last_name"],
+                "phone_number": patient["phone_number"],
+                "email": patient["email"],
+                "date_of_birth": "1990-01-01"
+            })
+            test_framework.assert_equals(201, response.status_code)
+
+        response = requests.get(f"{url}/version_history", headers=headers)
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_query_budget(response, queries_before)
+
+    @suite.test
+    def test_version_history_page_budget(test_framework):
+        """Test that a page of version history costs a constant number of queries"""
+        response = get(test_framework,
+                       "/api/patients/INS123456/version_history?limit=2",
+                       test_framework.admin_token)
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_query_budget(response, AUTH_QUERIES + 7)
@@ -0,0 +1,154 @@
+import os
+import time
+from contextlib import contextmanager
+from app import create_app
+from app.db import Database, READ, WRITE
+
+
+def register_tests(suite, test_framework):
+    """Register read replica routing tests with the provided test suite"""
+
+    @contextmanager
+    def environment(**variables):
+        previous = {name: os.environ.get(name) for name in variables}
+        os.environ.update(variables)
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    def primary_as_replica(test_framework) -> str:
+        primary = test_framework.db_instance
+        return f"{primary.host}:{primary.port}"
+
+    @contextmanager
+    def replicated_database(test_framework, replica_hosts: str = None, **variables):
+        # The primary stands in for the replica: it answers the lag query
+        # with no lag.
+        primary = test_framework.db_instance
+        with environment(INF6150_DATABASE_REPLICA_HOSTS=replica_hosts or primary_as_replica(test_framework),
+                         **variables):
+            db_instance = Database(primary.user, primary.password, primary.host,
+                                   primary.port, primary.database)
+        try:
+            yield db_instance
+        finally:
+            db_instance.close_pool()
+
+    def read(db_instance, intent: str = READ):
+        with db_instance.get_conn(intent) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+                cur.fetchone()
+            conn.rollback()
+
+    def checkouts(db_instance):
+        return db_instance.pool_stats()["checkouts"], db_instance.replica_pool_stats()[0]["checkouts"]
+
+    @suite.test
+    def test_reads_go_to_an_up_to_date_replica(test_framework):
+        """Test that reads are served by a replica within the maximum lag and writes by the primary"""
+        with replicated_database(test_framework) as db_instance:
+            read(db_instance)
+            primary_checkouts, replica_checkouts = checkouts(db_instance)
+            test_framework.assert_equals(0, primary_checkouts)
+            test_framework.assert_true(replica_checkouts > 0, "The read should use the replica")
+            test_framework.assert_equals(0.0, db_instance.replica_pool_stats()[0]["lag_seconds"])
+
+            read(db_instance, WRITE)
+            test_framework.assert_equals((1, replica_checkouts), checkouts(db_instance))
+
+    @suite.test
+    def test_lagging_replica_falls_back_to_primary(test_framework):
+        """Test that reads go to the primary while the replica lags more than allowed"""
+        with replicated_database(test_framework, INF6150_DATABASE_REPLICA_MAX_LAG="5",
+                                 INF6150_DATABASE_REPLICA_LAG_CHECK_INTERVAL="3600") as db_instance:
+            # As measured on a replica 60 seconds behind.
+            db_instance._replica_lag[0] = (time.monotonic(), 60.0)
+            read(db_instance)
+            test_framework.assert_equals((1, 0), checkouts(db_instance))
+            test_framework.assert_equals(60.0, db_instance.replica_pool_stats()[0]["lag_seconds"])
+
+            db_instance._replica_lag[0] = (time.monotonic(), 1.0)
+            read(db_instance)
+            test_framework.assert_equals((1, 1), checkouts(db_instance))
+
+    @suite.test
+    def test_unreachable_replica_falls_back_to_primary(test_framework):
+        """Test that a replica down at startup doesn't fail it, reads going to the primary"""
+        with replicated_database(test_framework, "127.0.0.1:1",
+                                 INF6150_DATABASE_REPLICA_LAG_CHECK_INTERVAL="0") as db_instance:
+            read(db_instance)
+            # Checked again, and still unreachable.
+            read(db_instance, READ)
+            stats = db_instance.replica_pool_stats()[0]
+            test_framework.assert_equals(2, db_instance.pool_stats()["checkouts"])
+            test_framework.assert_equals(0, stats["checkouts"])
+            test_framework.assert_equals(float("inf"), stats["lag_seconds"])
+
+    @suite.test
+    def test_writer_reads_from_primary(test_framework):
+        """Test that reads stick to the primary for a while after the user wrote"""
+        with replicated_database(test_framework) as db_instance:
+            session = {"key": "writer"}
+            db_instance.session_key_provider = lambda: session["key"]
+            db_instance.mark_write()
+
+            read(db_instance)
+            test_framework.assert_equals((1, 0), checkouts(db_instance))
+
+            session["key"] = "reader"
+            read(db_instance)
+            test_framework.assert_true(checkouts(db_instance)[1] > 0,
+                                       "Other users should still read from the replica")
+
+            db_instance.read_your_writes_window = 0.05
+            session["key"] = "writer"
+            db_instance.mark_write()
+            time.sleep(0.1)
+            replica_checkouts = checkouts(db_instance)[1]
+            read(db_instance)
+            test_framework.assert_true(checkouts(db_instance)[1] > replica_checkouts,
+                                       "The pin should end with the window")
+
+    @suite.test
+    def test_post_pins_the_user_to_primary(test_framework):
+        """Test that a successful POST sends the user's next reads to the primary"""
+        with environment(INF6150_DATABASE_REPLICA_HOSTS=primary_as_replica(test_framework),
+                         INF6150_DATABASE_REPLICA_LAG_CHECK_INTERVAL="3600",
+                         INF6150_MAINTENANCE="false"):
+            flask_app = create_app(use_test_db=True)
+        db_instance = flask_app.config["DATABASE"]
+        try:
+            client = flask_app.test_client()
+            tokens = []
+            for _ in range(2):
+                response = client.post("/api/auth/login", json={
+                    "email": "carol.williams@example.com", "password": "password5"})
+                test_framework.assert_equals(200, response.status_code)
+                tokens.append(response.get_json()["token"])
+
+            def get_establishments():
+                replica_checkouts = db_instance.replica_pool_stats()[0]["checkouts"]
+                response = client.get("/api/establishments",
+                                      headers={"Authorization": f"Bearer {tokens[1]}"})
+                test_framework.assert_equals(200, response.status_code)
+                return db_instance.replica_pool_stats()[0]["checkouts"] - replica_checkouts
+
+            test_framework.assert_true(get_establishments() > 0,
+                                       "Before writing, the listing should come from the replica")
+
+            # Logging out one of the sessions is a write of the same user.
+            response = client.post("/api/auth/logout",
+                                   headers={"Authorization": f"Bearer {tokens[0]}"})
+            test_framework.assert_equals(200, response.status_code)
+            test_framework.assert_equals(0, get_establishments())
+        finally:
+            if flask_app.config["REVOCATION_CACHE"] is not None:
+                flask_app.config["REVOCATION_CACHE"].close()
+            flask_app.config["PASSWORD_HASHER"].close()
+            db_instance.close_pool()
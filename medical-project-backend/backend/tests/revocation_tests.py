@@ -0,0 +1,91 @@
+import time
+import uuid
+from app.revocation import RevocationCache
+
+
+def register_tests(suite, test_framework):
+    """Register revocation cache tests with the provided test suite"""
+
+    def wait_for(condition, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.05)
+        return condition()
+
+    @suite.test
+    def test_revocations_reach_the_cache(test_framework):
+        """Test that a revocation committed elsewhere is seen within the staleness bound"""
+        cache = RevocationCache(test_framework.db_instance.connect,
+                                max_staleness=1.0, refresh_interval=300)
+        jti = str(uuid.uuid4())
+        try:
+            test_framework.assert_true(
+                wait_for(lambda: cache.is_revoked(jti) is not None, 5),
+                "The cache should load the revoked tokens")
+            test_framework.assert_equals(False, cache.is_revoked(jti))
+
+            with test_framework.db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO token_blacklist (jti, token_type, user_id, expires_at)
+                        VALUES (%s, 'access', %s, NOW() + INTERVAL '1 hour');
+                    """, (jti, str(uuid.uuid4())))
+                conn.commit()
+
+            test_framework.assert_true(
+                wait_for(lambda: cache.is_revoked(jti), cache.max_staleness),
+                "The revocation should reach the cache within max_staleness")
+            test_framework.assert_true(cache.stats()["notifications"] >= 1)
+        finally:
+            cache.close()
+            with test_framework.db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM token_blacklist WHERE jti = %s;", (jti,))
+                conn.commit()
+
+    @suite.test
+    def test_unreachable_database_defers_to_the_caller(test_framework):
+        """Test that a cache without news from the database isn't trusted"""
+        def connect():
+            raise ConnectionError("database unreachable")
+
+        cache = RevocationCache(connect, max_staleness=0.5)
+        try:
+            test_framework.assert_equals(None, cache.is_revoked(str(uuid.uuid4())))
+            test_framework.assert_true(
+                wait_for(lambda: cache.stats()["reconnects"] > 0, 2))
+            test_framework.assert_equals(None, cache.is_revoked(str(uuid.uuid4())))
+        finally:
+            cache.close()
+
+    @suite.test
+    def test_generation_bumps_reach_the_cache(test_framework):
+        """Test that a generation bump committed elsewhere is seen within the staleness bound"""
+        cache = RevocationCache(test_framework.db_instance.connect,
+                                max_staleness=1.0, refresh_interval=300)
+        user_id = str(uuid.uuid4())
+        try:
+            test_framework.assert_true(
+                wait_for(lambda: cache.generation(user_id) is not None, 5),
+                "The cache should load the token generations")
+            test_framework.assert_equals(0, cache.generation(user_id))
+
+            with test_framework.db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO token_generations (user_id, generation)
+                        VALUES (%s, 3);
+                    """, (user_id,))
+                conn.commit()
+
+            test_framework.assert_true(
+                wait_for(lambda: cache.generation(user_id) == 3, cache.max_staleness),
+                "The generation should reach the cache within max_staleness")
+        finally:
+            cache.close()
+            with test_framework.db_instance.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM token_generations WHERE user_id = %s;", (user_id,))
+                conn.commit()
@@ -0,0 +1,124 @@
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from app.json_provider import FastJSONProvider
+from app.models import DoctorListResponse, MedicalVisitResponse, PatientResponse, UserResponse
+from app.serialization import compile_encoder, http_date
+from werkzeug.http import http_date as werkzeug_http_date
+
+
+def register_tests(suite, test_framework):
+    """Register read-side serialization tests with the provided test suite"""
+
+    # jsonify's serialization, to compare encoders with the models they replace.
+    dumps = Flask(__name__).json.dumps
+
+    visit = {
+        "id": "b5d0c2d4-5c7a-4d44-9a38-0c7d1b4c0f11",
+        "patient_id": "INS123456",
+        "doctor": {"id": "d1", "login": "doc", "user_type": "DOCTOR",
+                   "first_name": "Alice", "last_name": "Brown"},
+        "establishment": {"establishment_id": "e1", "establishment_name": "Clinic",
+                          "created_at": "2024-03-01T08:15:30.123456-05:00"},
+        "visit_date": "2024-03-02",
+        "diagnostic_established": None,
+        "treatment": "Rest",
+        "visit_summary": "Checkup",
+        "notes": None,
+        "created_at": "2024-03-02T10:00:00+00:00",
+        "modified_at": None
+    }
+
+    @suite.test
+    def test_encoder_matches_model(test_framework):
+        """Test that an encoded document serializes like the model it replaces"""
+        encode = compile_encoder(MedicalVisitResponse)
+        test_framework.assert_equals(
+            dumps(MedicalVisitResponse(**visit).model_dump()), dumps(encode(visit)))
+
+    @suite.test
+    def test_encoder_reads_tuples_and_defaults(test_framework):
+        """Test that tuple rows are read by column and missing lists get their default"""
+        encode = compile_encoder(DoctorListResponse, columns=(
+            "user_id", "first_name", "last_name", "email", "phone_number"))
+        row = ("d1", "Alice", "Brown", "alice@example.com", "555-0100",
+               datetime(2024, 1, 1, tzinfo=timezone.utc))
+        test_framework.assert_equals({
+            "user_id": "d1", "first_name": "Alice", "last_name": "Brown",
+            "email": "alice@example.com", "phone_number": "555-0100"
+        }, encode(row))
+
+        patient = {
+            "medical_insurance_id": "INS123456", "gender": "F",
+            "city_of_birth": "Montreal", "user_id": "u1", "login": "jane",
+            "user_type": "PATIENT", "first_name": "Jane", "last_name": "Doe",
+            "phone_number": "555-0101", "email": "jane@example.com",
+            "created_at": datetime(2024, 1, 1, 12, tzinfo=timezone.utc),
+            "modified_at": datetime(2024, 1, 2, 12, tzinfo=timezone.utc),
+            "date_of_birth": date(1990, 1, 1),
+            "medical_visits": [visit]
+        }
+        test_framework.assert_equals(
+            dumps(PatientResponse(**patient).model_dump()),
+            dumps(compile_encoder(PatientResponse)(patient)))
+
+    @suite.test
+    def test_encoder_matches_model_on_database_rows(test_framework):
+        """Test that rows as PostgreSQL returns them serialize like the model"""
+        encode = compile_encoder(UserResponse)
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT json_build_object(
+                        'user_id', user_id,
+                        'login', login,
+                        'user_type', user_type,
+                        'first_name', first_name,
+                        'last_name', last_name,
+                        'phone_number', phone_number,
+                        'email', email,
+                        'created_at', created_at,
+                        'modified_at', modified_at
+                    )
+                    FROM users_current;
+                """)
+                rows = [row[0] for row in cur.fetchall()]
+            conn.rollback()
+
+        test_framework.assert_true(len(rows) > 0)
+        for row in rows:
+            test_framework.assert_equals(
+                dumps(UserResponse(**row).model_dump()), dumps(encode(row)))
+
+    @suite.test
+    def test_http_date_matches_werkzeug(test_framework):
+        """Test that dates are formatted exactly as werkzeug formats them"""
+        values = [
+            date(2024, 2, 29),
+            datetime(1999, 12, 31, 23, 59, 59, 999999),
+            datetime(2024, 3, 10, 1, 30, tzinfo=timezone.utc),
+            datetime(2024, 3, 10, 21, 30, tzinfo=timezone(timedelta(hours=-5))),
+            datetime(2024, 1, 1, 0, 15, tzinfo=timezone(timedelta(hours=5, minutes=45))),
+        ]
+        for value in values:
+            test_framework.assert_equals(werkzeug_http_date(value), http_date(value))
+
+    @suite.test
+    def test_fast_json_provider_matches_default(test_framework):
+        """Test that the fast JSON provider writes the same responses as Flask's default one"""
+        app = Flask(__name__)
+        document = {
+            "id": uuid.UUID("b5d0c2d4-5c7a-4d44-9a38-0c7d1b4c0f11"),
+            "created_at": datetime(2024, 3, 2, 10, tzinfo=timezone(timedelta(hours=-5))),
+            "visit_date": date(2024, 3, 2),
+            "amount": Decimal("12.50"),
+            "visits": [visit, {"notes": None, "count": 2 ** 70}],
+            "b": True,
+            "a": 1.5
+        }
+        for obj in (document, {1: "non-string key"}, []):
+            test_framework.assert_equals(
+                DefaultJSONProvider(app).response(obj).get_data(),
+                FastJSONProvider(app).response(obj).get_data())
@@ -0,0 +1,78 @@
+import json
+import requests
+
+NDJSON = "application/x-ndjson"
+
+
+def register_tests(suite, test_framework):
+    """Register NDJSON streaming tests with the provided test suite"""
+
+    @suite.setup
+    def setup_streaming_tests(test_framework):
+        """Setup tokens for the streaming tests"""
+        try:
+            test_framework.admin_token = test_framework.login_and_get_token(
+                email="carol.williams@example.com",
+                password="password5"
+            )
+        except Exception as e:
+            raise AssertionError(f"Failed to obtain test tokens: {str(e)}")
+
+    def get(test_framework, path, ndjson=False):
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+        if ndjson:
+            headers["Accept"] = NDJSON
+        return requests.get(
+            f"http://localhost:{test_framework.api_port}{path}", headers=headers)
+
+    def records(test_framework, response):
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_equals(NDJSON, response.headers["Content-Type"])
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    @suite.test
+    def test_stream_listings(test_framework):
+        """Test that doctors and establishments stream the same items as their JSON listing"""
+        for path in ("/api/doctors", "/api/establishments"):
+            document = get(test_framework, path).json()
+            streamed = records(test_framework, get(test_framework, path, ndjson=True))
+            test_framework.assert_equals(document["data"], streamed,
+                                         f"{path} streamed different items:")
+
+    @suite.test
+    def test_stream_patient(test_framework):
+        """Test that the streamed patient rebuilds into the JSON document"""
+        document = get(test_framework, "/api/patients/INS123456").json()
+        streamed = records(test_framework, get(
+            test_framework, "/api/patients/INS123456", ndjson=True))
+
+        test_framework.assert_equals("patient", streamed[0]["type"])
+        rebuilt = dict(streamed[0]["data"])
+        for section in ("coordinates", "medical_history", "medical_visits", "parents"):
+            rebuilt[section] = [record["data"] for record in streamed
+                                if record["type"] == section]
+        test_framework.assert_equals(document, rebuilt)
+
+    @suite.test
+    def test_stream_version_history(test_framework):
+        """Test that the streamed version history matches the full and diff formats"""
+        path = "/api/patients/INS123456/version_history"
+
+        history = get(test_framework, path).json()
+        streamed = records(test_framework, get(test_framework, path, ndjson=True))
+        test_framework.assert_equals(
+            history, {record["timestamp"]: record["snapshot"] for record in streamed})
+
+        diff = get(test_framework, f"{path}?format=diff").json()
+        streamed = records(test_framework, get(
+            test_framework, f"{path}?format=diff", ndjson=True))
+        test_framework.assert_equals(diff["base"], streamed[0])
+        test_framework.assert_equals(diff["changes"], streamed[1:])
+
+    @suite.test
+    def test_stream_unknown_patient(test_framework):
+        """Test that a missing patient is a 404 JSON error, not an empty stream"""
+        for path in ("/api/patients/INS000000", "/api/patients/INS000000/version_history"):
+            response = get(test_framework, path, ndjson=True)
+            test_framework.assert_equals(404, response.status_code)
+            test_framework.assert_equals("Patient not found.", response.json()["error"])
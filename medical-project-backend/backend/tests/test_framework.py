@@ -129,6 +129,30 @@ class TestFramework:
         except requests.RequestException as e:
             raise AssertionError(f"Request failed for URL {url}: {str(e)}")
 
+    def assert_query_budget(self, response, max_queries: int, max_time_ms: Optional[float] = None, message: Optional[str] = None):
+        """
+        Assert that the request behind `response` issued at most `max_queries`
+        database queries (and spent at most `max_time_ms` in them), as
+        reported by the X-Query-Count and X-Query-Time headers of serve-test.
+        """
+        if "X-Query-Count" not in response.headers:
+            raise AssertionError(
+                "Response has no X-Query-Count header: is the server running "
+                "with serve-test or INF6150_QUERY_LOG_HEADERS?")
+
+        query_count = int(response.headers["X-Query-Count"])
+        query_time = float(response.headers.get("X-Query-Time", 0))
+        request = f"{response.request.method} {response.request.path_url}"
+        if query_count > max_queries:
+            raise AssertionError(
+                message or f"{request} issued {query_count} queries, "
+                f"budget is {max_queries}")
+        if max_time_ms is not None and query_time > max_time_ms:
+            raise AssertionError(
+                message or f"{request} spent {query_time:.1f}ms in queries, "
+                f"budget is {max_time_ms:.1f}ms")
+        return query_count
+
     def login_and_get_token(self, email: str, password: str, force_refresh: bool = True) -> str:
         """Attempt to login and return the token if successful, with caching"""
         # Check if token is already in cache and not forcing refresh
@@ -286,14 +310,8 @@ class TestFramework:
                 self.db_instance.drop_tables(False)
 
                 # Initialize database structures
-                self.db_instance.initialize_extensions()
-                status.update("[bold green]Extensions initialized...")
-
-                self.db_instance.initialize_tables()
-                status.update("[bold green]Tables initialized...")
-
-                self.db_instance.initialize_indexes()
-                status.update("[bold green]Indexes initialized...")
+                self.db_instance.migrate(log=False)
+                status.update("[bold green]Migrations applied...")
 
                 # Insert test data
                 self.insert_test_data_with_status(status)
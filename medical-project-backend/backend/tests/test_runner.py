@@ -60,6 +60,17 @@ def run_tests():
         from tests.credentials_tests import register_tests as register_credentials_tests
         from tests.deletion_tests import register_tests as register_deletion_tests
         from tests.mfa_tests import register_tests as register_mfa_tests
+        from tests.query_budget_tests import register_tests as register_query_budget_tests
+        from tests.streaming_tests import register_tests as register_streaming_tests
+        from tests.serialization_tests import register_tests as register_serialization_tests
+        from tests.cache_tests import register_tests as register_cache_tests
+        from tests.etag_tests import register_tests as register_etag_tests
+        from tests.revocation_tests import register_tests as register_revocation_tests
+        from tests.maintenance_tests import register_tests as register_maintenance_tests
+        from tests.hashing_tests import register_tests as register_hashing_tests
+        from tests.bulk_loader_tests import register_tests as register_bulk_loader_tests
+        from tests.replica_tests import register_tests as register_replica_tests
+        from tests.data_generator_tests import register_tests as register_data_generator_tests
 
         print("All modules imported successfully")
 
@@ -100,6 +111,17 @@ def run_tests():
             "Credentials Update Tests")
         deletion_suite = test_framework.create_suite("Deletion/Hiding Tests")
         mfa_suite = test_framework.create_suite("MFA Tests")
+        query_budget_suite = test_framework.create_suite("Query Budget Tests")
+        streaming_suite = test_framework.create_suite("Streaming Tests")
+        serialization_suite = test_framework.create_suite("Serialization Tests")
+        cache_suite = test_framework.create_suite("Patient Cache Tests")
+        etag_suite = test_framework.create_suite("ETag Tests")
+        revocation_suite = test_framework.create_suite("Revocation Cache Tests")
+        maintenance_suite = test_framework.create_suite("Maintenance Tests")
+        hashing_suite = test_framework.create_suite("Password Hasher Tests")
+        bulk_loader_suite = test_framework.create_suite("Bulk Loader Tests")
+        replica_suite = test_framework.create_suite("Read Replica Tests")
+        data_generator_suite = test_framework.create_suite("Dataset Generator Tests")
 
         # Register tests with each suite
         print("Registering tests...")
@@ -120,6 +142,17 @@ def run_tests():
         register_credentials_tests(credentials_suite, test_framework)
         register_deletion_tests(deletion_suite, test_framework)
         register_mfa_tests(mfa_suite, test_framework)
+        register_query_budget_tests(query_budget_suite, test_framework)
+        register_streaming_tests(streaming_suite, test_framework)
+        register_serialization_tests(serialization_suite, test_framework)
+        register_cache_tests(cache_suite, test_framework)
+        register_etag_tests(etag_suite, test_framework)
+        register_revocation_tests(revocation_suite, test_framework)
+        register_maintenance_tests(maintenance_suite, test_framework)
+        register_hashing_tests(hashing_suite, test_framework)
+        register_bulk_loader_tests(bulk_loader_suite, test_framework)
+        register_replica_tests(replica_suite, test_framework)
+        register_data_generator_tests(data_generator_suite, test_framework)
 
         print("Running all tests...")
         test_framework.run_all_tests()
@@ -1,6 +1,8 @@
+import copy
 import requests
 import time
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from app.utils.version_replay import replay_versions
 
 
 def register_tests(suite, test_framework):
@@ -499,6 +501,268 @@ def register_tests(suite, test_framework):
 
         print("Successfully verified query version selection mechanism")
 
+    @suite.test
+    def test_patient_version_history_snapshots(test_framework):
+        """Test that an update adds a snapshot and leaves the previous ones untouched"""
+        url = f"http://localhost:{test_framework.api_port}/api/patients/INS789012"
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+
+        response = requests.get(f"{url}/version_history", headers=headers)
+        if response.status_code != 200:
+            raise AssertionError(f"Failed to get version history: {
+                                 response.status_code}, {response.text}")
+        history_before = response.json()
+        previous_name = list(history_before.values())[-1]["first_name"]
+
+        patient = requests.get(url, headers=headers).json()
+        new_name = f"History{int(time.time())}"
+        response = requests.put(url, headers=headers, json={
+            "login": patient["login"],
+            "gender": patient["gender"],
+            "city_of_birth": patient["city_of_birth"],
+            "first_name": new_name,
+            "last_name": patient["last_name"],
+            "phone_number": patient["phone_number"],
+            "email": patient["email"],
+            "date_of_birth": "1990-01-01"
+        })
+        if response.status_code != 201:
+            raise AssertionError(f"Failed to update patient: {
+                                 response.status_code}, {response.text}")
+
+        history_after = requests.get(
+            f"{url}/version_history", headers=headers).json()
+        snapshots = list(history_after.values())
+
+        test_framework.assert_equals(len(history_before) + 1, len(history_after))
+        test_framework.assert_equals(new_name, snapshots[-1]["first_name"])
+        test_framework.assert_equals(previous_name, snapshots[-2]["first_name"])
+        for key, snapshot in history_before.items():
+            test_framework.assert_equals(snapshot, history_after[key],
+                                         f"Snapshot {key} changed after an update:")
+
+        latest_coordinates = sorted(
+            coordinate["id"] for coordinate in snapshots[-1]["coordinates"])
+        current_coordinates = sorted(
+            coordinate["id"] for coordinate in requests.get(url, headers=headers).json()["coordinates"])
+        test_framework.assert_equals(current_coordinates, latest_coordinates)
+
+        print("Successfully verified patient version history snapshots")
+
+    @suite.test
+    def test_replay_versions_applies_instants_in_order(test_framework):
+        """Test the in-memory replay used to build the version history"""
+        users = [(1, "users", None, "user v1"), (3, "users", None, "user v2")]
+        coordinates = [(1, "coordinates", "b", "b v1"),
+                       (2, "coordinates", "a", "a v1"),
+                       (2, "coordinates", "b", "b v2")]
+
+        snapshots = [(timestamp, state.get("users", None), state.values("coordinates"))
+                     for timestamp, state in replay_versions(users, coordinates)]
+
+        test_framework.assert_equals([
+            (1, "user v1", ["b v1"]),
+            (2, "user v1", ["a v1", "b v2"]),
+            (3, "user v2", ["a v1", "b v2"]),
+        ], snapshots)
+
+    def apply_version_diff(snapshot, ops):
+        """Apply diff operations whose list items are addressed by id"""
+        def child(container, token):
+            if isinstance(container, list):
+                for item in container:
+                    if item.get("id", item.get("parent", {}).get("user_id")) == token:
+                        return item
+                raise AssertionError(f"No item '{token}' in list")
+            return container[token]
+
+        snapshot = copy.deepcopy(snapshot)
+        for op in ops:
+            tokens = [token.replace("~1", "/").replace("~0", "~")
+                      for token in op["path"].split("/")[1:]]
+            container = snapshot
+            for token in tokens[:-1]:
+                container = child(container, token)
+            last = tokens[-1]
+            if isinstance(container, list):
+                if op["op"] == "add":
+                    container.append(copy.deepcopy(op["value"]))
+                    container.sort(key=lambda item: item.get(
+                        "id", item.get("parent", {}).get("user_id")))
+                else:
+                    container.remove(child(container, last))
+            elif op["op"] == "remove":
+                del container[last]
+            else:
+                container[last] = copy.deepcopy(op["value"])
+        return snapshot
+
+    @suite.test
+    def test_patient_version_history_diff_format(test_framework):
+        """Test that the diff format rebuilds every snapshot of the full format"""
+        url = f"http://localhost:{test_framework.api_port}/api/patients/INS123456/version_history"
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+
+        full_response = requests.get(url, headers=headers)
+        diff_response = requests.get(f"{url}?format=diff", headers=headers)
+        if full_response.status_code != 200 or diff_response.status_code != 200:
+            raise AssertionError(f"Failed to get version history: {
+                                 full_response.status_code}, {diff_response.status_code}")
+
+        full = full_response.json()
+        diff = diff_response.json()
+        timestamps = list(full)
+
+        test_framework.assert_equals(timestamps[0], diff["base"]["timestamp"])
+        test_framework.assert_equals(full[timestamps[0]], diff["base"]["snapshot"])
+        test_framework.assert_equals(
+            timestamps[1:], [change["timestamp"] for change in diff["changes"]])
+
+        snapshot = diff["base"]["snapshot"]
+        for change in diff["changes"]:
+            snapshot = apply_version_diff(snapshot, change["ops"])
+            test_framework.assert_equals(full[change["timestamp"]], snapshot,
+                                         f"Snapshot {change['timestamp']} differs:")
+
+        if len(timestamps) > 2:
+            test_framework.assert_true(
+                len(diff_response.content) < len(full_response.content),
+                "Expected the diff format to be smaller than the full format")
+
+        response = requests.get(f"{url}?format=xml", headers=headers)
+        test_framework.assert_equals(400, response.status_code)
+
+    @suite.test
+    def test_patient_version_history_pagination(test_framework):
+        """Test that following the cursors returns the whole history, one page at a time"""
+        url = f"http://localhost:{test_framework.api_port}/api/patients/INS123456/version_history"
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+
+        full = requests.get(url, headers=headers).json()
+        timestamps = list(full)
+
+        pages = []
+        params = {"limit": 2}
+        while True:
+            response = requests.get(url, headers=headers, params=params)
+            if response.status_code != 200:
+                raise AssertionError(f"Failed to get history page: {
+                                     response.status_code}, {response.text}")
+            page = response.json()
+            test_framework.assert_true(len(page["data"]) <= 2)
+            pages.append(page["data"])
+            if not page["next_cursor"]:
+                break
+            params = {"cursor": page["next_cursor"]}
+
+        merged = {}
+        for page in pages:
+            merged.update(page)
+        test_framework.assert_equals((len(timestamps) + 1) // 2, len(pages))
+        test_framework.assert_equals(full, merged)
+
+        if len(timestamps) >= 3:
+            response = requests.get(url, headers=headers, params={
+                "since": timestamps[1], "until": timestamps[2]})
+            window = response.json()
+            test_framework.assert_equals(timestamps[1:3], list(window["data"]))
+            test_framework.assert_equals(full[timestamps[1]], window["data"][timestamps[1]])
+            test_framework.assert_equals(None, window["next_cursor"])
+
+        for params in ({"limit": 0}, {"since": "yesterday"}, {"cursor": "not-a-cursor"}):
+            response = requests.get(url, headers=headers, params=params)
+            test_framework.assert_equals(400, response.status_code,
+                                         f"Expected 400 for {params}:")
+
+    @suite.test
+    def test_valid_periods_follow_versions(test_framework):
+        """Test that each version is valid until the next version of its entity"""
+        entities = {
+            "users": "user_id",
+            "coordinates": "coordinate_id",
+            "medical_history": "history_id",
+            "medical_visits": "visit_id",
+        }
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                for table, entity in entities.items():
+                    cur.execute(f"""
+                        SELECT count(*) FILTER (WHERE valid_period IS DISTINCT FROM expected),
+                               count(*)
+                        FROM (
+                            SELECT valid_period, tstzrange(
+                                modified_at,
+                                CASE WHEN next_modified_at IS NOT NULL
+                                     THEN GREATEST(modified_at, next_modified_at) END,
+                                '[)') AS expected
+                            FROM (
+                                SELECT valid_period, modified_at, LEAD(modified_at) OVER (
+                                    PARTITION BY {entity} ORDER BY unique_id) AS next_modified_at
+                                FROM {table}
+                            ) versions
+                        ) periods;
+                    """)
+                    mismatches, versions = cur.fetchone()
+                    test_framework.assert_true(versions > 0, f"No versions in {table}")
+                    test_framework.assert_equals(0, mismatches,
+                                                 f"Wrong valid periods in {table}:")
+            conn.rollback()
+
+    @suite.test
+    def test_patient_at_date(test_framework):
+        """Test that from_date reads the versions valid at that date"""
+        url = f"http://localhost:{test_framework.api_port}/api/patients/INS123456"
+        headers = {"Authorization": f"Bearer {test_framework.admin_token}"}
+
+        patient = requests.get(url, headers=headers).json()
+        response = requests.put(url, headers=headers, json={
+            "login": patient["login"],
+            "gender": patient["gender"],
+            "city_of_birth": patient["city_of_birth"],
+            "first_name": f"AtDate{int(time.time())}",
+            "last_name": patient["last_name"],
+            "phone_number": patient["phone_number"],
+            "email": patient["email"],
+            "date_of_birth": "1995-07-15"
+        })
+        test_framework.assert_equals(201, response.status_code)
+
+        current = requests.get(url, headers=headers).json()
+        tomorrow = (date.today() + timedelta(days=1)).strftime("%d-%m-%Y")
+        response = requests.get(url, headers=headers,
+                                params={"from_date": tomorrow})
+        test_framework.assert_equals(200, response.status_code)
+        test_framework.assert_equals(current, response.json())
+
+        response = requests.get(url, headers=headers,
+                                params={"from_date": "01-01-2000"})
+        test_framework.assert_equals(404, response.status_code)
+
+        # Every version is the one read at its own modified_at, unless a
+        # later version replaced it within the same instant.
+        with test_framework.db_instance.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT v.unique_id, (
+                        SELECT u.unique_id FROM users u
+                        WHERE u.user_id = v.user_id AND u.hidden IS NOT TRUE
+                            AND u.valid_period @> v.modified_at
+                        ORDER BY u.unique_id DESC
+                        LIMIT 1
+                    ), (
+                        SELECT max(u.unique_id) FROM users u
+                        WHERE u.user_id = v.user_id AND u.modified_at = v.modified_at
+                    )
+                    FROM users v
+                    WHERE v.user_id = %s
+                    ORDER BY v.unique_id;
+                """, (current["user_id"],))
+                rows = cur.fetchall()
+            conn.rollback()
+        test_framework.assert_true(len(rows) >= 2)
+        for _, read_at, latest_of_instant in rows:
+            test_framework.assert_equals(latest_of_instant, read_at)
+
     @suite.teardown
     def teardown_versioning_tests(test_framework):
         # No database cleanup needed - transactions handle this